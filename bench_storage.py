@@ -0,0 +1,129 @@
+"""
+Benchmark đọc/ghi đồng thời trên SQLite: so sánh storage profile mặc định và WAL
+    
+    python bench_storage.py [--writers 4] [--readers 8] [--seconds 5]
+
+Writer thu phí và ghi lịch sử quét, reader đọc lịch sử giao dịch / thông tin xe.
+In ra số thao tác mỗi giây và số lỗi (ví dụ "database is locked") của từng profile.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+from flask import Flask
+
+from src.core.models import db
+from src.core.services import AccountService, ScanService, VehicleService
+from src.core.storage import build_engine_options, get_storage_info, install_sqlite_pragmas
+from src.core.vehicle_cache import vehicle_cache
+
+
+def create_bench_app(database_path, profile):
+    config = SimpleNamespace(STORAGE_PROFILE=profile)
+    database_url = f'sqlite:///{database_path}'
+    
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = build_engine_options(database_url, config)
+    db.init_app(app)
+    with app.app_context():
+        install_sqlite_pragmas(db.engine, config)
+        db.create_all()
+    return app
+
+
+def run_profile(profile, args):
+    database_path = os.path.join(tempfile.mkdtemp(prefix='etc_bench_'), 'bench.db')
+    app = create_bench_app(database_path, profile)
+    plates = [f'30G-{10000 + i}' for i in range(args.vehicles)]
+    
+    with app.app_context():
+        for plate in plates:
+            VehicleService.create_vehicle({'license_plate': plate, 'owner_name': 'Bench', 'account_balance': 10 ** 12})
+        storage = get_storage_info(db.engine)
+    
+    # Đo truy cập DB, không đo cache thông tin xe
+    vehicle_cache.configure(enabled=False)
+    
+    counters = {'writes': 0, 'reads': 0, 'errors': 0}
+    errors = {}
+    lock = threading.Lock()
+    stop = threading.Event()
+    
+    def count(kind, error=None):
+        with lock:
+            counters[kind] += 1
+            if error:
+                counters['errors'] += 1
+                errors[error[:60]] = errors.get(error[:60], 0) + 1
+    
+    def writer():
+        rng = random.Random()
+        with app.app_context():
+            while not stop.is_set():
+                plate = rng.choice(plates)
+                _, error = AccountService.deduct_toll(plate, 1000, 'Bench')
+                count('writes', error)
+                _, error = ScanService.record_scans([{
+                    'scan_type': 'license_plate', 'scanned_data': plate, 'license_plate': plate, 'confidence': 0.9
+                }])
+                count('writes', error)
+            db.session.remove()
+    
+    def reader():
+        rng = random.Random()
+        with app.app_context():
+            while not stop.is_set():
+                try:
+                    plate = rng.choice(plates)
+                    AccountService.get_transaction_history(plate, per_page=20)
+                    VehicleService.get_vehicle_detailed_info(plate)
+                    count('reads')
+                except Exception as e:
+                    db.session.rollback()
+                    count('reads', str(e))
+            db.session.remove()
+    
+    threads = [threading.Thread(target=writer) for _ in range(args.writers)]
+    threads += [threading.Thread(target=reader) for _ in range(args.readers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    
+    vehicle_cache.configure(enabled=True)
+    return {
+        'profile': profile,
+        'journal_mode': storage.get('journal_mode'),
+        'synchronous': storage.get('synchronous'),
+        'writes_per_second': round(counters['writes'] / elapsed, 1),
+        'reads_per_second': round(counters['reads'] / elapsed, 1),
+        'errors': counters['errors'],
+        'error_samples': errors
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark đọc/ghi đồng thời trên SQLite theo storage profile')
+    parser.add_argument('--writers', type=int, default=4, help='Số thread ghi')
+    parser.add_argument('--readers', type=int, default=8, help='Số thread đọc')
+    parser.add_argument('--seconds', type=float, default=5, help='Thời gian chạy mỗi profile')
+    parser.add_argument('--vehicles', type=int, default=50, help='Số xe')
+    args = parser.parse_args()
+    
+    results = [run_profile(profile, args) for profile in ('default', 'sqlite_wal')]
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+"""
+CLI nhận diện biển số từ file video
+    
+    python scan_video.py path/to/clip.mp4 [--frame-step 2] [--max-ocr-frames 30]
+"""
+import argparse
+import json
+
+from src.core.image_processor import LicensePlateProcessor
+from src.core.video_processor import VideoPlateScanner
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Nhận diện biển số từ video (bỏ phiếu nhiều frame)')
+    parser.add_argument('video', help='Đường dẫn file video')
+    parser.add_argument('--frame-step', type=int, default=2, help='Chỉ xét 1 trong N frame')
+    parser.add_argument('--motion-threshold', type=float, default=0.01, help='Tỉ lệ pixel thay đổi tối thiểu để OCR frame')
+    parser.add_argument('--max-ocr-frames', type=int, default=30, help='Số frame OCR tối đa')
+    args = parser.parse_args()
+    
+    config = {
+        'VIDEO_FRAME_STEP': args.frame_step,
+        'VIDEO_MOTION_THRESHOLD': args.motion_threshold,
+        'VIDEO_MAX_OCR_FRAMES': args.max_ocr_frames
+    }
+    scanner = VideoPlateScanner(LicensePlateProcessor(config), config)
+    result = scanner.scan_video(args.video)
+    
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,29 @@
-from flask import request
+from flask import Response, g, request
 from flask_restx import Api, Resource, Namespace, fields
-from werkzeug.utils import secure_filename
 from werkzeug.datastructures import FileStorage
 import os
+import tempfile
+import time
 from datetime import datetime
 
 from ..core.image_processor import LicensePlateProcessor
-from ..core.services import VehicleService, AccountService, ScanService
-from ..core.models import Vehicle, Transaction, ScanHistory
-from ..utils.utils import allowed_file
+from ..core.metrics import metrics
+from ..core.ocr_pool import OCRWorkerPool
+from ..core.scan_writer import ScanHistoryWriter
+from ..core.video_processor import VideoPlateScanner
+from ..core.services import VehicleService, AccountService, ScanService, SystemService
+from ..core.plate_index import plate_index
+from ..core.profiling import RequestProfiler, current_profile_summary
+from ..core.system_stats import system_stats
+from ..core.vehicle_cache import vehicle_cache
+from ..utils.utils import allowed_file, EvidenceStore
+
+HTTP_REQUESTS = metrics.counter(
+    'etc_http_requests_total', 'Số request HTTP theo route và mã trạng thái', ('method', 'endpoint', 'status')
+)
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    'etc_http_request_seconds', 'Thời gian xử lý request HTTP theo route (giây)', ('method', 'endpoint')
+)
 
 
 def init_api_routes(app, config):
@@ -24,8 +39,104 @@ def init_api_routes(app, config):
         prefix='/api'
     )
     
-    # Khởi tạo processor
-    license_processor = LicensePlateProcessor(config.__dict__)
+    # Khởi tạo processor: chạy OCR trong pool worker process nếu OCR_WORKERS > 0
+    processor_config = {key: getattr(config, key) for key in dir(config) if key.isupper()}
+    ocr_workers = getattr(config, 'OCR_WORKERS', 0)
+    if ocr_workers > 0:
+        license_processor = OCRWorkerPool(
+            processor_config,
+            workers=ocr_workers,
+            queue_size=getattr(config, 'OCR_QUEUE_SIZE', 8),
+            torch_threads=getattr(config, 'OCR_TORCH_THREADS', 1),
+            job_timeout=getattr(config, 'OCR_JOB_TIMEOUT', 60)
+        )
+    else:
+        license_processor = LicensePlateProcessor(processor_config)
+    app.extensions['license_processor'] = license_processor
+    video_scanner = VideoPlateScanner(license_processor, processor_config)
+    
+    # Lưu ảnh bằng chứng bất đồng bộ, tách khỏi đường xử lý OCR
+    evidence_store = EvidenceStore(
+        config.UPLOAD_FOLDER,
+        enabled=getattr(config, 'SAVE_UPLOADS', True),
+        max_pending=getattr(config, 'EVIDENCE_MAX_PENDING', 64)
+    )
+    app.extensions['evidence_store'] = evidence_store
+    
+    # Lịch sử quét: 'sync' (commit trong request) hoặc 'write_behind' (gom lô ở luồng nền)
+    scan_writer = None
+    if getattr(config, 'SCAN_WRITE_MODE', 'sync') == 'write_behind':
+        scan_writer = ScanHistoryWriter(
+            app,
+            batch_size=getattr(config, 'SCAN_WRITE_BATCH_SIZE', 50),
+            flush_interval=getattr(config, 'SCAN_WRITE_FLUSH_INTERVAL', 0.5),
+            max_queue=getattr(config, 'SCAN_WRITE_MAX_QUEUE', 10000)
+        )
+    app.extensions['scan_writer'] = scan_writer
+    
+    # ===================== METRICS =====================
+    
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+    
+    @app.after_request
+    def observe_request(response):
+        start = g.pop('request_start', None)
+        if start is not None:
+            # Nhãn theo mẫu route (/api/vehicles/<string:license_plate>) để số series có giới hạn
+            endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method, endpoint=endpoint)
+            HTTP_REQUESTS.inc(method=request.method, endpoint=endpoint, status=response.status_code)
+        return response
+    
+    # Giá trị đọc lúc xuất metrics
+    metrics.gauge('etc_ocr_ready', 'OCR đã warm-up xong (1) hay chưa (0)').set_function(
+        lambda: int(license_processor.is_ready())
+    )
+    metrics.gauge('etc_vehicle_cache_entries', 'Số xe trong cache thông tin xe (backend local)').set_function(
+        lambda: vehicle_cache.backend.size() if vehicle_cache.enabled else None
+    )
+    if scan_writer:
+        metrics.gauge('etc_scan_writer_queue_depth', 'Số lịch sử quét đang chờ ghi').set_function(
+            lambda: scan_writer.get_stats()['queue_depth']
+        )
+    if isinstance(license_processor, OCRWorkerPool):
+        metrics.gauge('etc_ocr_pool_in_flight', 'Số job OCR đang chạy hoặc chờ trong pool').set_function(
+            lambda: license_processor.get_stats()['in_flight']
+        )
+    
+    # ===================== PROFILING =====================
+    
+    # Opt-in: timing từng bước trong debug_info, cProfile lấy mẫu và ghi lại request chậm
+    profiler = None
+    if getattr(config, 'PROFILING_ENABLED', False):
+        profiler = RequestProfiler(
+            os.path.join(config.LOG_FOLDER, 'profiles'),
+            sample_rate=getattr(config, 'PROFILING_SAMPLE_RATE', 0.01),
+            slow_ms=getattr(config, 'PROFILING_SLOW_MS', 2000),
+            max_events=getattr(config, 'PROFILING_MAX_EVENTS', 200)
+        )
+    app.extensions['request_profiler'] = profiler
+    
+    if profiler:
+        @app.before_request
+        def start_request_profile():
+            if request.path.startswith('/api/'):
+                g.request_profile = profiler.start()
+        
+        @app.teardown_request
+        def finish_request_profile(exception=None):
+            started = g.pop('request_profile', None)
+            if started is not None:
+                endpoint = request.url_rule.rule if request.url_rule else request.path
+                profiler.finish(*started, label=f'{request.method} {endpoint}')
+    
+    if getattr(config, 'METRICS_ENABLED', True):
+        @app.route('/metrics')
+        def metrics_endpoint():
+            """Metrics theo định dạng text exposition của Prometheus"""
+            return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
     
     # ===================== MODELS =====================
     
@@ -47,7 +158,7 @@ def init_api_routes(app, config):
         'model': fields.String(description='Model xe'),
         'color': fields.String(description='Màu xe'),
         'year': fields.Integer(description='Năm sản xuất'),
-        'account_balance': fields.Float(description='Số dư tài khoản'),
+        'account_balance': fields.Integer(description='Số dư tài khoản (đồng)'),
         'account_status': fields.String(description='Trạng thái tài khoản')
     })
     
@@ -61,31 +172,36 @@ def init_api_routes(app, config):
         'model': fields.String(description='Model xe'),
         'color': fields.String(description='Màu xe'),
         'year': fields.Integer(description='Năm sản xuất'),
-        'account_balance': fields.Float(description='Số dư ban đầu', default=0.0)
+        'account_balance': fields.Integer(description='Số dư ban đầu (đồng)', default=0)
     })
     
     # Model cho nạp tiền
     topup_model = api.model('TopUp', {
         'license_plate': fields.String(required=True, description='Biển số xe'),
-        'amount': fields.Float(required=True, description='Số tiền nạp'),
+        'amount': fields.Integer(required=True, description='Số tiền nạp (đồng)'),
         'description': fields.String(description='Mô tả giao dịch')
     })
     
     # Model cho thu phí
     toll_model = api.model('TollCharge', {
         'license_plate': fields.String(required=True, description='Biển số xe'),
-        'amount': fields.Float(required=True, description='Số tiền thu phí'),
+        'amount': fields.Integer(required=True, description='Số tiền thu phí (đồng)'),
         'toll_station': fields.String(required=True, description='Trạm thu phí'),
         'description': fields.String(description='Mô tả giao dịch')
     })
     
+    # Model cho thu phí theo lô
+    toll_batch_model = api.model('TollChargeBatch', {
+        'events': fields.List(fields.Nested(toll_model), required=True, description='Danh sách sự kiện thu phí')
+    })
+    
     # Model cho lịch sử giao dịch
     transaction_model = api.model('Transaction', {
         'id': fields.Integer(description='ID giao dịch'),
         'transaction_type': fields.String(description='Loại giao dịch'),
-        'amount': fields.Float(description='Số tiền'),
-        'balance_before': fields.Float(description='Số dư trước giao dịch'),
-        'balance_after': fields.Float(description='Số dư sau giao dịch'),
+        'amount': fields.Integer(description='Số tiền (đồng)'),
+        'balance_before': fields.Integer(description='Số dư trước giao dịch'),
+        'balance_after': fields.Integer(description='Số dư sau giao dịch'),
         'toll_station': fields.String(description='Trạm thu phí'),
         'description': fields.String(description='Mô tả'),
         'status': fields.String(description='Trạng thái'),
@@ -106,6 +222,51 @@ def init_api_routes(app, config):
     transaction_ns = Namespace('transactions', description='Quản lý giao dịch và số dư')
     api.add_namespace(transaction_ns)
     
+    # ===================== PAGINATION =====================
+    
+    def use_cursor_pagination():
+        """Có tham số cursor (kể cả rỗng cho trang đầu) -> phân trang keyset thay vì page/offset"""
+        return 'cursor' in request.args
+    
+    def per_page_arg():
+        """per_page của request
+        
+        Keyset: phải nằm trong khoảng [1, MAX_PER_PAGE], ValueError nếu nằm ngoài.
+        page/offset: giữ hành vi cũ không báo lỗi, per_page < 1 về mặc định 20,
+        lớn hơn MAX_PER_PAGE thì bị giới hạn về MAX_PER_PAGE.
+        """
+        per_page = request.args.get('per_page', 20, type=int)
+        max_per_page = getattr(config, 'MAX_PER_PAGE', 100)
+        if use_cursor_pagination():
+            if not 1 <= per_page <= max_per_page:
+                raise ValueError(f'per_page phải nằm trong khoảng 1-{max_per_page}')
+            return per_page
+        if per_page < 1:
+            return 20
+        return min(per_page, max_per_page)
+    
+    def cursor_page_data(key, keyset_page, serialize):
+        """Dữ liệu trả về cho một trang keyset"""
+        data = {
+            key: [serialize(item) for item in keyset_page.items],
+            'next_cursor': keyset_page.next_cursor,
+            'has_more': keyset_page.has_more,
+            'per_page': keyset_page.per_page
+        }
+        if keyset_page.total is not None:
+            data['total'] = keyset_page.total
+        return data
+    
+    def archive_query_args():
+        """start / end (YYYY-MM-DD) và limit cho truy vấn bảng archive, ValueError nếu ngày sai định dạng"""
+        start = request.args.get('start')
+        end = request.args.get('end')
+        return (
+            datetime.strptime(start, '%Y-%m-%d') if start else None,
+            datetime.strptime(end, '%Y-%m-%d') if end else None,
+            min(request.args.get('limit', 100, type=int), getattr(config, 'ARCHIVE_QUERY_MAX_LIMIT', 1000))
+        )
+    
     # ===================== VEHICLE ENDPOINTS =====================
     
     @vehicle_ns.route('')
@@ -114,10 +275,29 @@ def init_api_routes(app, config):
         @vehicle_ns.marshal_with(base_response)
         @vehicle_ns.param('page', 'Số trang', type=int, default=1)
         @vehicle_ns.param('per_page', 'Số bản ghi mỗi trang', type=int, default=20)
+        @vehicle_ns.param('cursor', 'Cursor phân trang keyset (để trống cho trang đầu)', type=str)
+        @vehicle_ns.param('include_total', 'Đếm tổng số bản ghi khi dùng cursor', type=bool, default=False)
         def get(self):
             """Lấy danh sách xe"""
             page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 20, type=int)
+            try:
+                per_page = per_page_arg()
+            except ValueError as e:
+                return {'success': False, 'message': str(e)}, 400
+            
+            if use_cursor_pagination():
+                try:
+                    keyset_page = VehicleService.get_vehicles_by_cursor(
+                        request.args.get('cursor'), per_page, request.args.get('include_total') == 'true'
+                    )
+                except ValueError as e:
+                    return {'success': False, 'message': str(e)}, 400
+                
+                return {
+                    'success': True,
+                    'message': 'Lấy danh sách xe thành công',
+                    'data': cursor_page_data('vehicles', keyset_page, lambda vehicle: vehicle.to_dict())
+                }
             
             pagination = VehicleService.get_all_vehicles(page, per_page)
             
@@ -150,20 +330,35 @@ def init_api_routes(app, config):
                 'data': vehicle.to_dict()
             }, 201
     
+    @vehicle_ns.route('/cache')
+    class VehicleCacheStatsAPI(Resource):
+        @vehicle_ns.doc('get_vehicle_cache_stats')
+        @vehicle_ns.marshal_with(base_response)
+        def get(self):
+            """Thống kê cache thông tin xe và chỉ mục biển số"""
+            return {
+                'success': True,
+                'message': 'Lấy thống kê cache thành công',
+                'data': {
+                    'vehicle_cache': vehicle_cache.get_stats(),
+                    'plate_index': plate_index.get_stats()
+                }
+            }
+    
     @vehicle_ns.route('/<string:license_plate>')
     class VehicleAPI(Resource):
         @vehicle_ns.doc('get_vehicle')
         @vehicle_ns.marshal_with(base_response)
         def get(self, license_plate):
             """Lấy thông tin xe theo biển số"""
-            vehicle = VehicleService.get_vehicle_by_plate(license_plate)
-            if not vehicle:
+            vehicle_info = VehicleService.get_vehicle_info(license_plate)
+            if not vehicle_info:
                 return {'success': False, 'message': 'Không tìm thấy xe'}, 404
             
             return {
                 'success': True,
                 'message': 'Lấy thông tin xe thành công',
-                'data': vehicle.to_dict()
+                'data': vehicle_info
             }
     
     @vehicle_ns.route('/<string:license_plate>/detailed')
@@ -198,6 +393,26 @@ def init_api_routes(app, config):
                 'data': result
             }
     
+    @vehicle_ns.route('/<string:license_plate>/similar')
+    class VehicleSimilarAPI(Resource):
+        @vehicle_ns.doc('find_similar_plates')
+        @vehicle_ns.marshal_with(base_response)
+        @vehicle_ns.param('limit', 'Số biển số gợi ý tối đa', type=int, default=3)
+        @vehicle_ns.param('max_distance', 'Khoảng cách sửa lỗi tối đa', type=float, default=1.0)
+        def get(self, license_plate):
+            """Tìm biển số đã đăng ký gần đúng (chịu lỗi nhầm ký tự OCR)"""
+            limit = request.args.get('limit', getattr(config, 'PLATE_INDEX_TOP_K', 3), type=int)
+            max_distance = request.args.get('max_distance', getattr(config, 'PLATE_INDEX_MAX_DISTANCE', 1.0), type=float)
+            
+            return {
+                'success': True,
+                'message': 'Tìm biển số gần đúng thành công',
+                'data': {
+                    'query': license_plate.upper(),
+                    'matches': VehicleService.find_similar_plates(license_plate, max_distance=max_distance, limit=limit)
+                }
+            }
+    
     # ===================== TRANSACTION ENDPOINTS =====================
     
     @transaction_ns.route('/topup')
@@ -249,6 +464,39 @@ def init_api_routes(app, config):
                 'data': result
             }
     
+    @transaction_ns.route('/toll/batch')
+    class TollChargeBatchAPI(Resource):
+        @transaction_ns.doc('charge_toll_batch')
+        @transaction_ns.expect(toll_batch_model)
+        @transaction_ns.marshal_with(base_response)
+        def post(self):
+            """Thu phí BOT cho nhiều sự kiện trong một giao dịch DB (phát lại hàng đợi của làn xe)"""
+            data = request.json or {}
+            events = data.get('events')
+            
+            if not isinstance(events, list) or not events:
+                return {'success': False, 'message': 'Không có sự kiện thu phí'}, 400
+            
+            max_events = getattr(config, 'MAX_TOLL_BATCH_EVENTS', 1000)
+            if len(events) > max_events:
+                return {'success': False, 'message': f'Tối đa {max_events} sự kiện mỗi lô'}, 400
+            
+            results, error = AccountService.deduct_tolls_batch(events)
+            if error:
+                return {'success': False, 'message': error}, 409
+            
+            succeeded = sum(1 for result in results if result['success'])
+            return {
+                'success': True,
+                'message': f'Thu phí thành công {succeeded}/{len(results)} sự kiện',
+                'data': {
+                    'results': results,
+                    'total': len(results),
+                    'succeeded': succeeded,
+                    'failed': len(results) - succeeded
+                }
+            }
+    
     @transaction_ns.route('/<string:license_plate>/history')
     class TransactionHistoryAPI(Resource):
         @transaction_ns.doc('get_transaction_history')
@@ -256,11 +504,33 @@ def init_api_routes(app, config):
         @transaction_ns.param('days', 'Số ngày lịch sử', type=int, default=30)
         @transaction_ns.param('page', 'Số trang', type=int, default=1)
         @transaction_ns.param('per_page', 'Số bản ghi mỗi trang', type=int, default=20)
+        @transaction_ns.param('cursor', 'Cursor phân trang keyset (để trống cho trang đầu)', type=str)
+        @transaction_ns.param('include_total', 'Đếm tổng số bản ghi khi dùng cursor', type=bool, default=False)
         def get(self, license_plate):
             """Lấy lịch sử giao dịch"""
             days = request.args.get('days', 30, type=int)
             page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 20, type=int)
+            try:
+                per_page = per_page_arg()
+            except ValueError as e:
+                return {'success': False, 'message': str(e)}, 400
+            
+            if use_cursor_pagination():
+                try:
+                    keyset_page, error = AccountService.get_transaction_history_by_cursor(
+                        license_plate, days, request.args.get('cursor'), per_page,
+                        request.args.get('include_total') == 'true'
+                    )
+                except ValueError as e:
+                    return {'success': False, 'message': str(e)}, 400
+                if error:
+                    return {'success': False, 'message': error}, 404
+                
+                return {
+                    'success': True,
+                    'message': 'Lấy lịch sử giao dịch thành công',
+                    'data': cursor_page_data('transactions', keyset_page, lambda t: t.to_dict())
+                }
             
             pagination, error = AccountService.get_transaction_history(
                 license_plate, days, page, per_page
@@ -281,12 +551,131 @@ def init_api_routes(app, config):
                 }
             }
     
+    @transaction_ns.route('/<string:license_plate>/archive')
+    class TransactionArchiveAPI(Resource):
+        @transaction_ns.doc('get_archived_transactions')
+        @transaction_ns.marshal_with(base_response)
+        @transaction_ns.param('start', 'Từ ngày (YYYY-MM-DD)', type=str)
+        @transaction_ns.param('end', 'Đến trước ngày (YYYY-MM-DD)', type=str)
+        @transaction_ns.param('limit', 'Số bản ghi tối đa', type=int, default=100)
+        def get(self, license_plate):
+            """Lấy giao dịch đã lưu trữ (kiểm toán)"""
+            try:
+                start, end, limit = archive_query_args()
+            except ValueError:
+                return {'success': False, 'message': 'Ngày không hợp lệ, dùng định dạng YYYY-MM-DD'}, 400
+            
+            transactions, error = AccountService.get_archived_transactions(license_plate, start, end, limit)
+            if error:
+                return {'success': False, 'message': error}, 404
+            
+            return {
+                'success': True,
+                'message': 'Lấy giao dịch đã lưu trữ thành công',
+                'data': {'transactions': transactions, 'count': len(transactions)}
+            }
+    
     # ===================== SCAN ENDPOINTS =====================
     
     upload_parser = api.parser()
     upload_parser.add_argument('image', location='files', type=FileStorage, required=True, help='File ảnh')
     upload_parser.add_argument('station_location', location='form', type=str, help='Vị trí trạm')
     
+    batch_upload_parser = api.parser()
+    batch_upload_parser.add_argument('images', location='files', type=FileStorage, action='append',
+                                     required=True, help='Danh sách file ảnh')
+    batch_upload_parser.add_argument('station_location', location='form', type=str, help='Vị trí trạm')
+    
+    video_upload_parser = api.parser()
+    video_upload_parser.add_argument('video', location='files', type=FileStorage, required=True, help='File video')
+    video_upload_parser.add_argument('station_location', location='form', type=str, help='Vị trí trạm')
+    
+    def build_scan_records(result, filepath, station_location):
+        """Tạo dữ liệu lịch sử quét cho các biển số nhận diện được"""
+        if not result['success']:
+            return []
+        
+        return [
+            {
+                'scan_type': 'license_plate',
+                'scanned_data': plate_info['text'],
+                'confidence': plate_info['confidence'],
+                'license_plate': plate_info['text'],
+                'image_path': filepath,
+                'station_location': station_location
+            }
+            for plate_info in result.get('license_plates', [])
+        ]
+    
+    def save_scan_records(scan_records):
+        """Ghi lịch sử quét: đưa vào hàng đợi write-behind hoặc commit một lần cho cả lô"""
+        if not scan_records:
+            return
+        if scan_writer:
+            scan_writer.submit(scan_records)
+        else:
+            ScanService.record_scans(scan_records)
+    
+    def build_scan_data(result, include_profile=True):
+        """Tra cứu thông tin xe cho các biển số nhận diện được và tính thống kê"""
+        processed_results = []
+        if result['success'] and result.get('license_plates'):
+            for plate_info in result['license_plates']:
+                # Lấy thông tin chi tiết xe (qua cache), None nếu biển số chưa đăng ký
+                vehicle_detailed = VehicleService.get_vehicle_detailed_info(plate_info['text'])
+                
+                processed_result = {
+                    'license_plate': plate_info['text'],
+                    'confidence': round(plate_info['confidence'], 3),
+                    'score': round(plate_info.get('score', 0), 3),
+                    'source': plate_info.get('source', 'unknown'),
+                    'formatted': plate_info.get('formatted', plate_info['text']),
+                    'original_text': plate_info.get('original_text', ''),
+                    'vehicle_found': vehicle_detailed is not None
+                }
+                
+                if not vehicle_detailed:
+                    # Gợi ý biển số đã đăng ký gần nhất khi OCR đọc sai vài ký tự
+                    processed_result['suggested_vehicles'] = VehicleService.find_similar_plates(
+                        plate_info['text'],
+                        max_distance=getattr(config, 'PLATE_INDEX_MAX_DISTANCE', 1.0),
+                        limit=getattr(config, 'PLATE_INDEX_TOP_K', 3)
+                    )
+                
+                if vehicle_detailed:
+                    processed_result['vehicle_info'] = vehicle_detailed
+                    # Thêm thông tin trạng thái tài khoản
+                    balance = vehicle_detailed.get('account_balance', 0)
+                    processed_result['account_status'] = {
+                        'balance': balance,
+                        'status': 'sufficient' if balance >= 50000 else 'low' if balance > 0 else 'empty',
+                        'warning': balance < 50000,
+                        'can_travel': balance > 0
+                    }
+                
+                processed_results.append(processed_result)
+        
+        # Tính toán thống kê
+        stats = {
+            'total_candidates': result.get('total_candidates', 0),
+            'processing_versions': result.get('processing_versions', 1),
+            'roi_count': result.get('localization', {}).get('roi_count', 0),
+            'cascade_stopped_at': result.get('cascade', {}).get('stopped_at'),
+            'versions_skipped': result.get('cascade', {}).get('versions_skipped', 0),
+            'estimated_peak_image_bytes': result.get('memory', {}).get('estimated_peak_image_bytes'),
+            'valid_plates_found': len(processed_results),
+            'vehicles_in_system': sum(1 for r in processed_results if r['vehicle_found'])
+        }
+        
+        return {
+            'license_plates': processed_results,
+            'statistics': stats,
+            # Timing từng bước của request khi bật PROFILING_ENABLED
+            'debug_info': (include_profile and current_profile_summary()) or result.get('debug_info', ''),
+            'localization': result.get('localization'),
+            'processing_method': result.get('method', 'easyocr')
+        }
+    
     @scan_ns.route('/license-plate')
     class LicensePlateScanAPI(Resource):
         @scan_ns.doc('scan_license_plate')
@@ -308,77 +697,162 @@ def init_api_routes(app, config):
             file_extension = file.filename.rsplit('.', 1)[1].lower()
             filename = f"plate_{current_time}.{file_extension}"
             
-            # Lưu file
-            filepath = os.path.join(config.UPLOAD_FOLDER, filename)
-            file.save(filepath)
+            # Đọc ảnh vào bộ nhớ, việc lưu file chạy nền
+            image_bytes = file.read()
+            filepath = evidence_store.save(filename, image_bytes)
             
             # Nhận diện biển số với logic cải tiến
-            result = license_processor.detect_license_plate(filepath)
-            
-            # Xử lý kết quả và ghi lịch sử
-            processed_results = []
-            if result['success'] and result.get('license_plates'):
-                for plate_info in result['license_plates']:
-                    # Ghi lịch sử quét
-                    ScanService.record_scan({
-                        'scan_type': 'license_plate',
-                        'scanned_data': plate_info['text'],
-                        'confidence': plate_info['confidence'],
-                        'license_plate': plate_info['text'],
-                        'image_path': filepath,
-                        'station_location': station_location
-                    })
-                    
-                    # Lấy thông tin xe từ database
-                    vehicle = VehicleService.get_vehicle_by_plate(plate_info['text'])
-                    vehicle_detailed = None
-                    
-                    if vehicle:
-                        # Lấy thông tin chi tiết cho biển số có trong hệ thống
-                        vehicle_detailed = VehicleService.get_vehicle_detailed_info(plate_info['text'])
-                    
-                    processed_result = {
-                        'license_plate': plate_info['text'],
-                        'confidence': round(plate_info['confidence'], 3),
-                        'score': round(plate_info.get('score', 0), 3),
-                        'source': plate_info.get('source', 'unknown'),
-                        'formatted': plate_info.get('formatted', plate_info['text']),
-                        'original_text': plate_info.get('original_text', ''),
-                        'vehicle_found': vehicle is not None
-                    }
-                    
-                    if vehicle_detailed:
-                        processed_result['vehicle_info'] = vehicle_detailed
-                        # Thêm thông tin trạng thái tài khoản
-                        balance = vehicle_detailed.get('account_balance', 0)
-                        processed_result['account_status'] = {
-                            'balance': balance,
-                            'status': 'sufficient' if balance >= 50000 else 'low' if balance > 0 else 'empty',
-                            'warning': balance < 50000,
-                            'can_travel': balance > 0
-                        }
-                    
-                    processed_results.append(processed_result)
-            
-            # Tính toán thống kê
-            stats = {
-                'total_candidates': result.get('total_candidates', 0),
-                'processing_versions': result.get('processing_versions', 1),
-                'valid_plates_found': len(processed_results),
-                'vehicles_in_system': sum(1 for r in processed_results if r['vehicle_found'])
-            }
+            result = license_processor.detect_license_plate(image_bytes)
+            
+            # Ghi lịch sử quét
+            save_scan_records(build_scan_records(result, filepath, station_location))
             
             return {
                 'success': result['success'],
                 'message': result.get('message', 'Hoàn tất nhận diện biển số'),
+                'data': build_scan_data(result)
+            }
+    
+    @scan_ns.route('/license-plate/batch')
+    class LicensePlateBatchScanAPI(Resource):
+        @scan_ns.doc('scan_license_plate_batch')
+        @scan_ns.expect(batch_upload_parser)
+        @scan_ns.marshal_with(base_response)
+        def post(self):
+            """Nhận diện biển số xe từ nhiều ảnh trong một request"""
+            files = request.files.getlist('images')
+            if not files:
+                return {'success': False, 'message': 'Không có file được gửi'}, 400
+            
+            max_batch_images = getattr(config, 'MAX_BATCH_IMAGES', 16)
+            if len(files) > max_batch_images:
+                return {'success': False, 'message': f'Tối đa {max_batch_images} ảnh mỗi request'}, 400
+            
+            station_location = request.form.get('station_location')
+            
+            for file in files:
+                if not allowed_file(file.filename, config.ALLOWED_EXTENSIONS):
+                    return {'success': False, 'message': f'File {file.filename} phải là ảnh hợp lệ'}, 400
+            
+            # Đọc ảnh vào bộ nhớ và lưu nền, thêm chỉ số để không trùng tên trong cùng một giây
+            current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
+            images = []
+            filepaths = []
+            for index, file in enumerate(files):
+                file_extension = file.filename.rsplit('.', 1)[1].lower()
+                filename = f"plate_{current_time}_{index}.{file_extension}"
+                image_bytes = file.read()
+                images.append(image_bytes)
+                filepaths.append(evidence_store.save(filename, image_bytes))
+            
+            # Nhận diện tất cả ảnh với recognizer chạy theo lô
+            results = license_processor.detect_license_plates_batch(images)
+            
+            # Ghi lịch sử quét của cả batch trong một lần commit
+            scan_records = []
+            for result, filepath in zip(results, filepaths):
+                scan_records.extend(build_scan_records(result, filepath, station_location))
+            save_scan_records(scan_records)
+            
+            image_results = []
+            for file, result in zip(files, results):
+                image_result = {
+                    'filename': file.filename,
+                    'success': result['success'],
+                    'message': result.get('error', result.get('message', 'Hoàn tất nhận diện biển số'))
+                }
+                image_result.update(build_scan_data(result, include_profile=False))
+                image_results.append(image_result)
+            
+            return {
+                'success': any(result['success'] for result in results),
+                'message': 'Hoàn tất nhận diện biển số theo lô',
                 'data': {
-                    'license_plates': processed_results,
-                    'statistics': stats,
-                    'debug_info': result.get('debug_info', ''),
-                    'processing_method': result.get('method', 'easyocr')
+                    'results': image_results,
+                    'statistics': {
+                        'total_images': len(files),
+                        'successful_images': sum(1 for result in results if result['success']),
+                        'valid_plates_found': sum(
+                            r['statistics']['valid_plates_found'] for r in image_results
+                        )
+                    },
+                    'debug_info': current_profile_summary() or ''
                 }
             }
     
+    @scan_ns.route('/video')
+    class VideoScanAPI(Resource):
+        @scan_ns.doc('scan_video')
+        @scan_ns.expect(video_upload_parser)
+        @scan_ns.marshal_with(base_response)
+        def post(self):
+            """Nhận diện biển số từ video một lượt xe (bỏ phiếu nhiều frame)"""
+            if 'video' not in request.files:
+                return {'success': False, 'message': 'Không có file được gửi'}, 400
+            
+            file = request.files['video']
+            station_location = request.form.get('station_location')
+            
+            video_extensions = getattr(config, 'VIDEO_EXTENSIONS', {'mp4', 'avi', 'mov', 'mkv'})
+            if not allowed_file(file.filename, video_extensions):
+                return {'success': False, 'message': 'File phải là video hợp lệ'}, 400
+            
+            # OpenCV chỉ đọc video từ file -> lưu tạm rồi xoá sau khi xử lý
+            file_extension = file.filename.rsplit('.', 1)[1].lower()
+            fd, video_path = tempfile.mkstemp(suffix=f'.{file_extension}', dir=config.UPLOAD_FOLDER)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    file.save(f)
+                result = video_scanner.scan_video(video_path)
+            finally:
+                os.remove(video_path)
+            
+            # Ghi lịch sử quét cho biển số sau bỏ phiếu
+            save_scan_records(build_scan_records(result, None, station_location))
+            
+            data = build_scan_data(result)
+            data['vote'] = result.get('vote')
+            data['video_statistics'] = result.get('statistics')
+            
+            return {
+                'success': result['success'],
+                'message': result.get('error', 'Hoàn tất nhận diện biển số từ video'),
+                'data': data
+            }
+    
+    @scan_ns.route('/ocr-pool')
+    class OCRPoolStatsAPI(Resource):
+        @scan_ns.doc('get_ocr_pool_stats')
+        @scan_ns.marshal_with(base_response)
+        def get(self):
+            """Thống kê hàng đợi và worker OCR"""
+            if isinstance(license_processor, OCRWorkerPool):
+                stats = license_processor.get_stats()
+            else:
+                stats = {
+                    'mode': 'in_process',
+                    'workers': 0,
+                    'result_cache': license_processor.get_cache_stats()
+                }
+            
+            return {
+                'success': True,
+                'message': 'Lấy thống kê OCR thành công',
+                'data': stats
+            }
+    
+    @scan_ns.route('/history/writer')
+    class ScanHistoryWriterStatsAPI(Resource):
+        @scan_ns.doc('get_scan_history_writer_stats')
+        @scan_ns.marshal_with(base_response)
+        def get(self):
+            """Độ sâu hàng đợi và thời gian flush của bộ ghi lịch sử quét"""
+            return {
+                'success': True,
+                'message': 'Lấy thống kê ghi lịch sử quét thành công',
+                'data': scan_writer.get_stats() if scan_writer else {'mode': 'sync'}
+            }
+    
     @scan_ns.route('/history')
     class ScanHistoryAPI(Resource):
         @scan_ns.doc('get_scan_history')
@@ -387,12 +861,32 @@ def init_api_routes(app, config):
         @scan_ns.param('days', 'Số ngày lịch sử', type=int, default=7)
         @scan_ns.param('page', 'Số trang', type=int, default=1)
         @scan_ns.param('per_page', 'Số bản ghi mỗi trang', type=int, default=20)
+        @scan_ns.param('cursor', 'Cursor phân trang keyset (để trống cho trang đầu)', type=str)
+        @scan_ns.param('include_total', 'Đếm tổng số bản ghi khi dùng cursor', type=bool, default=False)
         def get(self):
             """Lấy lịch sử quét"""
             license_plate = request.args.get('license_plate')
             days = request.args.get('days', 7, type=int)
             page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 20, type=int)
+            try:
+                per_page = per_page_arg()
+            except ValueError as e:
+                return {'success': False, 'message': str(e)}, 400
+            
+            if use_cursor_pagination():
+                try:
+                    keyset_page = ScanService.get_scan_history_by_cursor(
+                        license_plate, days, request.args.get('cursor'), per_page,
+                        request.args.get('include_total') == 'true'
+                    )
+                except ValueError as e:
+                    return {'success': False, 'message': str(e)}, 400
+                
+                return {
+                    'success': True,
+                    'message': 'Lấy lịch sử quét thành công',
+                    'data': cursor_page_data('scans', keyset_page, lambda scan: scan.to_dict())
+                }
             
             pagination = ScanService.get_scan_history(license_plate, days, page, per_page)
             
@@ -408,16 +902,63 @@ def init_api_routes(app, config):
                 }
             }
     
+    @scan_ns.route('/history/archive')
+    class ScanHistoryArchiveAPI(Resource):
+        @scan_ns.doc('get_archived_scan_history')
+        @scan_ns.marshal_with(base_response)
+        @scan_ns.param('license_plate', 'Biển số xe (tùy chọn)', type=str)
+        @scan_ns.param('start', 'Từ ngày (YYYY-MM-DD)', type=str)
+        @scan_ns.param('end', 'Đến trước ngày (YYYY-MM-DD)', type=str)
+        @scan_ns.param('limit', 'Số bản ghi tối đa', type=int, default=100)
+        def get(self):
+            """Lấy lịch sử quét đã lưu trữ (kiểm toán)"""
+            try:
+                start, end, limit = archive_query_args()
+            except ValueError:
+                return {'success': False, 'message': 'Ngày không hợp lệ, dùng định dạng YYYY-MM-DD'}, 400
+            
+            scans = ScanService.get_archived_scans(request.args.get('license_plate'), start, end, limit)
+            
+            return {
+                'success': True,
+                'message': 'Lấy lịch sử quét đã lưu trữ thành công',
+                'data': {'scans': scans, 'count': len(scans)}
+            }
+    
+    # Readiness probe: chỉ sẵn sàng khi OCR đã warm-up xong
+    @api.route('/ready')
+    class ReadinessAPI(Resource):
+        @api.doc('readiness_check')
+        def get(self):
+            """Kiểm tra server đã sẵn sàng nhận request quét chưa"""
+            warmup_mode = getattr(config, 'OCR_WARMUP', 'background')
+            ready = warmup_mode == 'off' or license_processor.is_ready()
+            
+            return {
+                'success': ready,
+                'message': 'Ready' if ready else 'OCR đang warm-up',
+                'data': {
+                    'ready': ready,
+                    'warmup_mode': warmup_mode,
+                    'warmup': license_processor.get_warmup_info(),
+                    'timestamp': datetime.now().isoformat()
+                }
+            }, 200 if ready else 503
+    
     # Health check endpoint
     @api.route('/health')
     class HealthCheckAPI(Resource):
         @api.doc('health_check')
         def get(self):
-            """Kiểm tra trạng thái server"""
+            """Kiểm tra trạng thái server (SELECT 1 + trạng thái OCR, không đếm bảng)"""
+            warmup_mode = getattr(config, 'OCR_WARMUP', 'background')
+            ocr = {
+                'ready': warmup_mode == 'off' or license_processor.is_ready(),
+                'warmup_status': license_processor.get_warmup_info()['status']
+            }
+            
             try:
-                # Test database connection
-                total_vehicles = Vehicle.query.count()
-                total_transactions = Transaction.query.count()
+                SystemService.ping_database()
                 
                 return {
                     'success': True,
@@ -425,8 +966,7 @@ def init_api_routes(app, config):
                     'data': {
                         'status': 'healthy',
                         'database_status': 'connected',
-                        'total_vehicles': total_vehicles,
-                        'total_transactions': total_transactions,
+                        'ocr': ocr,
                         'timestamp': datetime.now().isoformat(),
                         'version': '1.0'
                     }
@@ -438,7 +978,25 @@ def init_api_routes(app, config):
                     'data': {
                         'status': 'unhealthy',
                         'database_status': 'error',
+                        'ocr': ocr,
                         'timestamp': datetime.now().isoformat(),
                         'version': '1.0'
                     }
                 }, 500
+    
+    # Số liệu tổng, tính lại tối đa mỗi STATS_REFRESH_INTERVAL giây
+    @api.route('/stats')
+    class SystemStatsAPI(Resource):
+        @api.doc('system_stats')
+        @api.marshal_with(base_response)
+        def get(self):
+            """Số liệu tổng của hệ thống (từ cache)"""
+            stats, refreshed_at = SystemService.get_system_stats()
+            stats['refreshed_at'] = refreshed_at.isoformat()
+            stats['refresh_interval'] = system_stats.refresh_interval
+            
+            return {
+                'success': True,
+                'message': 'Lấy số liệu hệ thống thành công',
+                'data': stats
+            }
@@ -1,10 +1,22 @@
 from flask import Flask, render_template
+import click
 from flask_cors import CORS
 import os
+import threading
 
 from config.settings import config
 from src.api.routes import init_api_routes
+from src.core.metrics import install_query_metrics
+from src.core.migrations import (
+    ensure_indexes, pending_money_columns, migrate_money_columns, check_ledger, check_query_plans
+)
 from src.core.models import db
+from src.core.plate_index import plate_index
+from src.core.retention import RetentionWorker, run_retention
+from src.core.services import VehicleService
+from src.core.storage import build_engine_options, install_sqlite_pragmas
+from src.core.system_stats import system_stats
+from src.core.vehicle_cache import vehicle_cache, create_cache_backend
 from src.utils.utils import setup_logging
 
 
@@ -23,6 +35,8 @@ def create_app(config_name=None):
     database_url = os.environ.get('DATABASE_URL', 'sqlite:///etc_backend.db')
     app.config['SQLALCHEMY_DATABASE_URI'] = database_url
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Storage profile: connection pool (mọi database) + PRAGMA SQLite khi mở kết nối
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = build_engine_options(database_url, app_config)
     
     # Enable CORS
     CORS(app)
@@ -37,13 +51,106 @@ def create_app(config_name=None):
     os.makedirs(app_config.UPLOAD_FOLDER, exist_ok=True)
     os.makedirs(app_config.LOG_FOLDER, exist_ok=True)
     
-    # Tạo database tables
+    # Cache thông tin xe: 'local' (mặc định, trong process), 'redis' (dùng chung giữa worker) hoặc 'off'
+    cache_backend = getattr(app_config, 'VEHICLE_CACHE_BACKEND', 'local')
+    vehicle_cache.configure(
+        backend=create_cache_backend(
+            cache_backend,
+            max_size=getattr(app_config, 'VEHICLE_CACHE_SIZE', 4096),
+            redis_url=getattr(app_config, 'VEHICLE_CACHE_REDIS_URL', None)
+        ) if cache_backend != 'off' else None,
+        ttl_seconds=getattr(app_config, 'VEHICLE_CACHE_TTL', 30),
+        enabled=cache_backend != 'off'
+    )
+    
+    # Số liệu tổng của /api/stats được tính lại tối đa mỗi STATS_REFRESH_INTERVAL giây
+    system_stats.configure(refresh_interval=getattr(app_config, 'STATS_REFRESH_INTERVAL', 60))
+    # Chỉ mục biển số nằm trong từng worker process, dựng lại từ DB mỗi PLATE_INDEX_REFRESH_INTERVAL giây
+    plate_index.configure(refresh_interval=getattr(app_config, 'PLATE_INDEX_REFRESH_INTERVAL', 60))
+    
     with app.app_context():
+        install_sqlite_pragmas(db.engine, app_config)
+        # Thời gian từng câu lệnh SQL cho /metrics
+        install_query_metrics(db.engine)
+        # Tạo database tables
         db.create_all()
+        # create_all không thêm index vào bảng đã có -> bổ sung cho database cũ
+        ensure_indexes()
+        # Đổi kiểu cột tiền phải tạo lại bảng, chỉ chạy một lần bằng lệnh migrate-money-columns
+        pending = pending_money_columns()
+        if pending:
+            app.logger.warning(
+                f"Cột tiền còn kiểu số thực ({', '.join(pending)}), chạy 'flask migrate-money-columns' để chuyển"
+            )
+        # Nạp chỉ mục biển số cho tra cứu gần đúng khi OCR đọc sai
+        VehicleService.load_plate_index()
     
     # Đăng ký routes
     init_api_routes(app, app_config)
     
+    # Warm-up OCR: 'background' (mặc định), 'blocking' hoặc 'off'
+    warmup_mode = getattr(app_config, 'OCR_WARMUP', 'background')
+    license_processor = app.extensions['license_processor']
+    if warmup_mode == 'blocking':
+        license_processor.warm_up()
+    elif warmup_mode == 'background':
+        threading.Thread(target=license_processor.warm_up, name='ocr-warmup', daemon=True).start()
+    
+    # Lưu trữ lịch sử cũ định kỳ (giây, 0 = tắt; có thể chạy bằng lệnh archive-history)
+    retention_interval = getattr(app_config, 'RETENTION_INTERVAL', 0)
+    if retention_interval > 0:
+        app.extensions['retention_worker'] = RetentionWorker(app, app_config, retention_interval)
+    
+    @app.cli.command('archive-history')
+    @click.option('--batches', type=int, default=None, help='Số lô tối đa mỗi bảng')
+    def archive_history(batches):
+        """Chuyển lịch sử quét / giao dịch cũ sang bảng archive theo tháng"""
+        report = run_retention(app_config, max_batches=batches)
+        for table_name, count in report.items():
+            click.echo(f'{table_name}: đã lưu trữ {count} bản ghi')
+    
+    @app.cli.command('rebuild-vehicle-stats')
+    def rebuild_vehicle_stats():
+        """Tính lại bảng thống kê xe từ lịch sử giao dịch (backfill)"""
+        count, error = VehicleService.rebuild_statistics()
+        if error:
+            raise click.ClickException(error)
+        click.echo(f'Đã tính lại thống kê cho {count} xe')
+    
+    @app.cli.command('migrate-money-columns')
+    def migrate_money_columns_command():
+        """Chuyển cột tiền của database cũ sang số nguyên đồng (chạy một lần, khi đã dừng worker)"""
+        try:
+            converted = migrate_money_columns()
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        if not converted:
+            click.echo('Cột tiền đã là số nguyên, không cần chuyển')
+            return
+        click.echo(f"Đã chuyển: {', '.join(converted)}")
+    
+    @app.cli.command('check-ledger')
+    def check_ledger_command():
+        """Kiểm tra bất biến sổ cái số dư / giao dịch"""
+        report = check_ledger()
+        for name, violations in report.items():
+            click.echo(f"{'OK  ' if not violations else 'FAIL'} {name}: {violations}")
+        if any(report.values()):
+            raise click.ClickException('Sổ cái có bản ghi vi phạm')
+    
+    @app.cli.command('check-query-plans')
+    def check_query_plans_command():
+        """Kiểm tra các truy vấn lịch sử dùng index (SQLite)"""
+        report = check_query_plans()
+        if report is None:
+            click.echo('Chỉ hỗ trợ kiểm tra query plan trên SQLite')
+            return
+        
+        for name, result in report.items():
+            click.echo(f"{'OK  ' if result['uses_index'] else 'FAIL'} {name}: {' | '.join(result['plan'])}")
+        if not all(result['uses_index'] for result in report.values()):
+            raise click.ClickException('Có truy vấn lịch sử quét toàn bảng')
+    
     # Route trang chủ
     @app.route('/')
     def home():
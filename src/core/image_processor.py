@@ -1,8 +1,7 @@
 import os
-import re
-import itertools
-from datetime import datetime
-from PIL import Image
+import time
+import bisect
+import threading
 
 # Import với error handling cho NumPy compatibility
 try:
@@ -20,6 +19,32 @@ except ImportError as e:
     print(f"⚠️  EasyOCR không khả dụng: {e}")
     EASYOCR_AVAILABLE = False
 
+from . import plate_grammar
+from .metrics import metrics, timed
+from .result_cache import PerceptualHashCache
+
+# Thứ tự mặc định các phiên bản tiền xử lý (source 'image_v{i+1}' theo chỉ số ở đây)
+PREPROCESS_VERSIONS = ('original', 'contrast', 'otsu', 'morphology', 'blur_threshold')
+
+OCR_STAGE_SECONDS = metrics.histogram(
+    'etc_ocr_stage_seconds', 'Thời gian từng bước nhận diện biển số (giây)', ('stage', 'variant')
+)
+PLATE_DETECTION_SECONDS = metrics.histogram(
+    'etc_plate_detection_seconds', 'Thời gian nhận diện biển số một ảnh (giây)', ('result',)
+)
+PLATE_DETECTIONS = metrics.counter(
+    'etc_plate_detections_total', 'Số ảnh đã nhận diện theo kết quả', ('result',)
+)
+
+
+def detection_outcome(result):
+    """Nhãn kết quả nhận diện: cache_hit, found, not_found hoặc error"""
+    if not result.get('success'):
+        return 'error'
+    if result.get('cache', {}).get('hit'):
+        return 'cache_hit'
+    return 'found' if result.get('license_plates') else 'not_found'
+
 
 class LicensePlateProcessor:
     """Class xử lý nhận diện biển số xe"""
@@ -27,24 +52,361 @@ class LicensePlateProcessor:
     def __init__(self, config=None):
         self.config = config or {}
         self.ocr_reader = None  # Lazy loading
+        self.version_order = self._validate_version_order(self.config.get('OCR_VERSION_ORDER', PREPROCESS_VERSIONS))
+        self._reader_lock = threading.Lock()
+        
+        # Trạng thái warm-up: pending / running / ready / failed
+        self.warmup_status = 'pending'
+        self.warmup_error = None
+        self.warmup_ms = None
+        
+        # Cache kết quả theo perceptual hash cho các frame lặp lại
+        self.result_cache = None
+        if self.config.get('OCR_RESULT_CACHE', True):
+            self.result_cache = PerceptualHashCache(
+                max_size=self.config.get('OCR_CACHE_SIZE', 256),
+                ttl_seconds=self.config.get('OCR_CACHE_TTL', 10),
+                max_distance=self.config.get('OCR_CACHE_MAX_DISTANCE', 2)
+            )
+    
+    @staticmethod
+    def _validate_version_order(order):
+        """Kiểm tra OCR_VERSION_ORDER khi khởi tạo, ValueError nếu có tên phiên bản không tồn tại"""
+        order = tuple(order)
+        unknown = [name for name in order if name not in PREPROCESS_VERSIONS]
+        if unknown or not order:
+            raise ValueError(
+                f"OCR_VERSION_ORDER không hợp lệ: {list(unknown or order)}, "
+                f"chỉ dùng các phiên bản {', '.join(PREPROCESS_VERSIONS)}"
+            )
+        return order
     
     def _get_ocr_reader(self):
         """Lazy loading OCR reader"""
         if not EASYOCR_AVAILABLE:
             return None
-            
-        if self.ocr_reader is None:
-            try:
-                languages = self.config.get('OCR_LANGUAGES', ['en', 'vi'])
-                self.ocr_reader = easyocr.Reader(languages, gpu=False)
-            except Exception as e:
-                print(f"❌ Không thể khởi tạo EasyOCR: {e}")
-                return None
+        
+        # Khoá để warm-up chạy nền và request đầu tiên không cùng tạo reader
+        with self._reader_lock:
+            if self.ocr_reader is None:
+                try:
+                    languages = self.config.get('OCR_LANGUAGES', ['en', 'vi'])
+                    self.ocr_reader = easyocr.Reader(languages, gpu=self.config.get('OCR_GPU', False))
+                except Exception as e:
+                    print(f"❌ Không thể khởi tạo EasyOCR: {e}")
+                    return None
         return self.ocr_reader
     
-    def detect_license_plate(self, image_path):
-        """Nhận diện biển số xe từ ảnh với logic cải tiến"""
+    def warm_up(self):
+        """Nạp OCR reader và chạy thử một lần trên ảnh tổng hợp"""
+        self.warmup_status = 'running'
+        start = time.perf_counter()
+        
+        try:
+            if CV2_AVAILABLE and EASYOCR_AVAILABLE:
+                reader = self._get_ocr_reader()
+                if reader is None:
+                    raise RuntimeError('Không thể khởi tạo OCR reader')
+                
+                # Ảnh biển số giả để chạy cả detector và recognizer
+                image = np.full((120, 400, 3), 255, dtype=np.uint8)
+                cv2.putText(image, '30G-49729', (20, 80), cv2.FONT_HERSHEY_SIMPLEX, 1.8, (0, 0, 0), 4)
+                reader.readtext(image)
+            
+            self.warmup_status = 'ready'
+        except Exception as e:
+            print(f"❌ Warm-up OCR thất bại: {e}")
+            self.warmup_status = 'failed'
+            self.warmup_error = str(e)
+        
+        self.warmup_ms = round((time.perf_counter() - start) * 1000, 2)
+        return self.warmup_status == 'ready'
+    
+    def is_ready(self):
+        """OCR đã warm-up xong chưa"""
+        return self.warmup_status == 'ready'
+    
+    def get_warmup_info(self):
+        """Thông tin trạng thái warm-up"""
+        return {
+            'status': self.warmup_status,
+            'warmup_ms': self.warmup_ms,
+            'error': self.warmup_error
+        }
+    
+    def detect_license_plate(self, image_source):
+        """Nhận diện biển số xe từ ảnh với logic cải tiến
+        
+        image_source: đường dẫn file, bytes của file ảnh (decode trực tiếp trong bộ nhớ)
+        hoặc mảng NumPy BGR đã decode.
+        """
+        start = time.perf_counter()
+        result = self._detect_license_plate(image_source)
+        
+        outcome = detection_outcome(result)
+        PLATE_DETECTIONS.inc(result=outcome)
+        PLATE_DETECTION_SECONDS.observe(time.perf_counter() - start, result=outcome)
+        return result
+    
+    def _detect_license_plate(self, image_source):
         # Kiểm tra dependencies
+        dependency_result = self._check_dependencies()
+        if dependency_result is not None:
+            return dependency_result
+        
+        try:
+            # Đọc ảnh
+            image, error_result = self._load_image(image_source)
+            if error_result is not None:
+                return error_result
+            
+            # Frame đã gặp gần đây -> trả kết quả cũ, bỏ qua OCR
+            image_hash, cached_result = self._lookup_cache(image)
+            if cached_result is not None:
+                return cached_result
+            
+            # Giới hạn độ phân giải, bỏ tham chiếu tới ảnh gốc ngay sau khi thu nhỏ
+            image, frame_scale, memory = self._normalize_resolution(image)
+            
+            reader = self._get_ocr_reader()
+            
+            if reader is None:
+                return {
+                    'success': False,
+                    'error': 'Không thể khởi tạo OCR reader',
+                    'license_plates': []
+                }
+            
+            # Khoanh vùng biển số trước khi OCR, không tìm thấy thì dùng cả ảnh
+            plate_regions, ocr_regions, localization_ms = self._locate_ocr_regions(image)
+            
+            # Cascade: chạy lần lượt từng phiên bản, dừng sớm khi đã có biển số đủ tin cậy
+            cascade_enabled = self.config.get('OCR_CASCADE', True)
+            cascade_threshold = self.config.get('OCR_CASCADE_THRESHOLD', 0.8)
+            version_order = self.version_order
+            cascade_stopped_at = None
+            
+            # Nhận diện text từ tất cả phiên bản ảnh của từng vùng
+            all_candidates = []
+            processing_versions = 0
+            detection_mode = 'per_version'
+            ocr_start = time.perf_counter()
+            
+            for x, y, w, h in ocr_regions:
+                region, region_scale = self._normalize_region(image[y:y + h, x:x + w], bool(plate_regions))
+                
+                # Chạy detector (CRAFT) một lần trên ảnh gốc, các phiên bản chỉ chạy recognizer
+                text_regions = None
+                if self.config.get('OCR_SHARED_DETECTION', True):
+                    text_regions = self._detect_text_regions(reader, region)
+                    if text_regions is not None:
+                        detection_mode = 'shared'
+                
+                # Các phiên bản ảnh được tạo lười, chỉ khi cần OCR
+                for i, processed_img in self._iter_preprocessed_images(region, version_order, memory):
+                    processing_versions += 1
+                    try:
+                        read_start = time.perf_counter()
+                        results = self._read_text(reader, processed_img, text_regions)
+                        OCR_STAGE_SECONDS.observe(
+                            time.perf_counter() - read_start, stage='ocr', variant=PREPROCESS_VERSIONS[i]
+                        )
+                        candidates = self._collect_ocr_candidates(
+                            results, f'image_v{i+1}', offset=(x, y), scale=region_scale
+                        )
+                    except Exception as e:
+                        print(f"⚠️  Lỗi xử lý ảnh version {i+1}: {e}")
+                        continue
+                    
+                    all_candidates.extend(candidates)
+                    
+                    if cascade_enabled and self._has_confident_plate(candidates, cascade_threshold):
+                        cascade_stopped_at = f'image_v{i+1}'
+                        break
+                
+                if cascade_stopped_at:
+                    break
+            
+            ocr_ms = (time.perf_counter() - ocr_start) * 1000
+            
+            result = self._build_plate_result(all_candidates)
+            result.update({
+                'processing_versions': processing_versions,
+                'detection_mode': detection_mode,
+                'cascade': {
+                    'enabled': cascade_enabled,
+                    'threshold': cascade_threshold,
+                    'stopped_at': cascade_stopped_at,
+                    'versions_skipped': len(ocr_regions) * len(version_order) - processing_versions
+                },
+                'localization': {
+                    'roi_count': len(plate_regions),
+                    'full_frame_fallback': not plate_regions,
+                    'localization_ms': round(localization_ms, 2),
+                    'ocr_ms': round(ocr_ms, 2)
+                },
+                'frame_scale': round(frame_scale, 4),
+                'memory': memory
+            })
+            self._store_cache(image_hash, result)
+            return result
+            
+        except Exception as e:
+            return {
+                'success': False,
+                'error': f'Lỗi xử lý ảnh: {str(e)}',
+                'license_plates': []
+            }
+    
+    def detect_license_plates_batch(self, image_sources):
+        """Nhận diện biển số cho nhiều ảnh cùng lúc
+        
+        Mỗi vòng xử lý một phiên bản tiền xử lý cho tất cả ảnh; khi reader chạy trên
+        GPU (OCR_GPU) crop của các ảnh được gom vào một lần gọi recognizer. Kết quả
+        trả về theo đúng thứ tự và cùng dạng với detect_license_plate.
+        """
+        start = time.perf_counter()
+        results = self._detect_license_plates_batch(image_sources)
+        
+        # Các ảnh xử lý chung nên thời gian mỗi ảnh là phần chia đều của cả lô
+        per_image_seconds = (time.perf_counter() - start) / max(1, len(results))
+        for result in results:
+            outcome = detection_outcome(result)
+            PLATE_DETECTIONS.inc(result=outcome)
+            PLATE_DETECTION_SECONDS.observe(per_image_seconds, result=outcome)
+        return results
+    
+    def _detect_license_plates_batch(self, image_sources):
+        dependency_result = self._check_dependencies()
+        if dependency_result is not None:
+            return [dict(dependency_result) for _ in image_sources]
+        
+        results = [None] * len(image_sources)
+        
+        try:
+            reader = self._get_ocr_reader()
+            if reader is None:
+                return [{
+                    'success': False,
+                    'error': 'Không thể khởi tạo OCR reader',
+                    'license_plates': []
+                } for _ in image_sources]
+            
+            cascade_enabled = self.config.get('OCR_CASCADE', True)
+            cascade_threshold = self.config.get('OCR_CASCADE_THRESHOLD', 0.8)
+            version_order = self.version_order
+            
+            # Chuẩn bị: đọc ảnh, khoanh vùng và detect text một lần cho mỗi vùng (OCR_SHARED_DETECTION)
+            shared_detection = self.config.get('OCR_SHARED_DETECTION', True)
+            states = {}
+            jobs = []
+            for index, image_source in enumerate(image_sources):
+                image, error_result = self._load_image(image_source)
+                if error_result is not None:
+                    results[index] = error_result
+                    continue
+                
+                image_hash, cached_result = self._lookup_cache(image)
+                if cached_result is not None:
+                    results[index] = cached_result
+                    continue
+                
+                image, frame_scale, memory = self._normalize_resolution(image)
+                plate_regions, ocr_regions, localization_ms = self._locate_ocr_regions(image)
+                states[index] = {
+                    'candidates': [],
+                    'plate_regions': plate_regions,
+                    'region_count': len(ocr_regions),
+                    'localization_ms': localization_ms,
+                    'processing_versions': 0,
+                    'stopped_at': None,
+                    'image_hash': image_hash,
+                    'frame_scale': frame_scale,
+                    'memory': memory
+                }
+                
+                for x, y, w, h in ocr_regions:
+                    region, region_scale = self._normalize_region(image[y:y + h, x:x + w], bool(plate_regions))
+                    jobs.append({
+                        'image_index': index,
+                        'offset': (x, y),
+                        'scale': region_scale,
+                        'text_regions': self._detect_text_regions(reader, region) if shared_detection else None,
+                        'versions': self._iter_preprocessed_images(region, version_order, memory)
+                    })
+            
+            # Mỗi vòng: một phiên bản ảnh cho mọi vùng còn đang chạy, một lần recognize
+            recognizer_batched = self._recognizer_batches(reader)
+            ocr_start = time.perf_counter()
+            while jobs:
+                round_jobs = []
+                round_items = []
+                for job in jobs:
+                    if states[job['image_index']]['stopped_at'] is not None:
+                        continue
+                    version_index, processed_img = next(job['versions'], (None, None))
+                    if processed_img is None:
+                        continue
+                    round_jobs.append((job, version_index))
+                    round_items.append((processed_img, job['text_regions']))
+                
+                if not round_jobs:
+                    break
+                
+                round_results = self._recognize_batch(reader, round_items)
+                
+                for (job, version_index), ocr_results in zip(round_jobs, round_results):
+                    state = states[job['image_index']]
+                    source = f'image_v{version_index+1}'
+                    candidates = self._collect_ocr_candidates(
+                        ocr_results, source, offset=job['offset'], scale=job['scale']
+                    )
+                    state['candidates'].extend(candidates)
+                    state['processing_versions'] += 1
+                    
+                    if (cascade_enabled and state['stopped_at'] is None
+                            and self._has_confident_plate(candidates, cascade_threshold)):
+                        state['stopped_at'] = source
+                
+                jobs = [job for job in jobs if states[job['image_index']]['stopped_at'] is None]
+            
+            ocr_ms = (time.perf_counter() - ocr_start) * 1000
+            
+            for index, state in states.items():
+                result = self._build_plate_result(state['candidates'])
+                result.update({
+                    'processing_versions': state['processing_versions'],
+                    'detection_mode': 'batched',
+                    'cascade': {
+                        'enabled': cascade_enabled,
+                        'threshold': cascade_threshold,
+                        'stopped_at': state['stopped_at'],
+                        'versions_skipped': state['region_count'] * len(version_order) - state['processing_versions']
+                    },
+                    'localization': {
+                        'roi_count': len(state['plate_regions']),
+                        'full_frame_fallback': not state['plate_regions'],
+                        'localization_ms': round(state['localization_ms'], 2),
+                        'ocr_ms': round(ocr_ms, 2)
+                    },
+                    'frame_scale': round(state['frame_scale'], 4),
+                    'memory': state['memory'],
+                    'batch_size': len(image_sources),
+                    'recognizer_batched': recognizer_batched
+                })
+                self._store_cache(state['image_hash'], result)
+                results[index] = result
+            return results
+            
+        except Exception as e:
+            return [result or {
+                'success': False,
+                'error': f'Lỗi xử lý ảnh: {str(e)}',
+                'license_plates': []
+            } for result in results]
+    
+    def _check_dependencies(self):
+        """Trả về kết quả lỗi/fallback nếu thiếu thư viện, None nếu đủ"""
         if not CV2_AVAILABLE:
             return {
                 'success': False,
@@ -69,228 +431,652 @@ class LicensePlateProcessor:
                 'note': 'EasyOCR không khả dụng - sử dụng fallback detection'
             }
         
-        try:
+        return None
+    
+    @timed(OCR_STAGE_SECONDS, stage='decode')
+    def _load_image(self, image_source):
+        """Đọc ảnh từ mảng NumPy, bytes (cv2.imdecode) hoặc file,
+        trả về (image, None) hoặc (None, kết quả lỗi)"""
+        if isinstance(image_source, np.ndarray):
+            return image_source, None
+        
+        if isinstance(image_source, (bytes, bytearray, memoryview)):
+            # Decode trực tiếp trong bộ nhớ, không đi qua đĩa
+            buffer = np.frombuffer(image_source, dtype=np.uint8)
+            image = cv2.imdecode(buffer, cv2.IMREAD_COLOR) if buffer.size else None
+        else:
             # Kiểm tra file tồn tại
-            if not os.path.exists(image_path):
-                return {
-                    'success': False,
-                    'error': f'Không tìm thấy file ảnh tại: {image_path}',
-                    'license_plates': []
-                }
-            
-            # Đọc và tiền xử lý ảnh
-            image = cv2.imread(image_path)
-            if image is None:
-                return {
+            if not os.path.exists(image_source):
+                return None, {
                     'success': False,
-                    'error': 'Không thể đọc file ảnh - định dạng không hỗ trợ',
+                    'error': f'Không tìm thấy file ảnh tại: {image_source}',
                     'license_plates': []
                 }
             
-            # Tạo nhiều phiên bản ảnh để tăng độ chính xác
-            processed_images = self._preprocess_image_for_ocr(image)
-            
-            # Nhận diện text từ tất cả phiên bản ảnh
-            all_candidates = []
-            reader = self._get_ocr_reader()
-            
-            if reader is None:
-                return {
-                    'success': False,
-                    'error': 'Không thể khởi tạo OCR reader',
-                    'license_plates': []
-                }
+            image = cv2.imread(image_source)
+        
+        if image is None:
+            return None, {
+                'success': False,
+                'error': 'Không thể đọc file ảnh - định dạng không hỗ trợ',
+                'license_plates': []
+            }
+        
+        return image, None
+    
+    @timed(OCR_STAGE_SECONDS, stage='cache_lookup')
+    def _lookup_cache(self, image):
+        """Tra cache theo hash ảnh, trả về (hash, kết quả cache hoặc None)"""
+        if self.result_cache is None:
+            return None, None
+        
+        image_hash = self.result_cache.compute_hash(image)
+        cached_result, distance = self.result_cache.get(image_hash)
+        if cached_result is not None:
+            cached_result['cache'] = {'hit': True, 'distance': distance}
+        return image_hash, cached_result
+    
+    def _store_cache(self, image_hash, result):
+        """Lưu kết quả nhận diện thành công vào cache"""
+        if self.result_cache is None or image_hash is None or not result.get('success'):
+            return
+        
+        result['cache'] = {'hit': False, 'distance': None}
+        self.result_cache.put(image_hash, result)
+    
+    def get_cache_stats(self):
+        """Thống kê cache kết quả (None nếu tắt cache)"""
+        return self.result_cache.get_stats() if self.result_cache else None
+    
+    @timed(OCR_STAGE_SECONDS, stage='normalize')
+    def _normalize_resolution(self, image):
+        """Thu nhỏ ảnh để cạnh dài không vượt quá OCR_MAX_SIDE
+        
+        Trả về (ảnh, hệ số scale, thống kê bộ nhớ buffer ảnh của request). Các số
+        byte là ước lượng từ nbytes của buffer NumPy, không phải bộ nhớ đo được của process.
+        """
+        decoded_bytes = image.nbytes
+        max_side = self.config.get('OCR_MAX_SIDE', 1280)
+        img_height, img_width = image.shape[:2]
+        long_side = max(img_height, img_width)
+        
+        scale = 1.0
+        estimated_peak_bytes = decoded_bytes
+        if max_side and long_side > max_side:
+            scale = max_side / float(long_side)
+            size = (max(1, int(round(img_width * scale))), max(1, int(round(img_height * scale))))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+            # Lúc resize cả ảnh gốc và ảnh thu nhỏ cùng tồn tại
+            estimated_peak_bytes = decoded_bytes + image.nbytes
+        
+        memory = {
+            'decoded_bytes': decoded_bytes,
+            'normalized_bytes': image.nbytes,
+            'estimated_peak_image_bytes': estimated_peak_bytes
+        }
+        return image, scale, memory
+    
+    def _normalize_region(self, region, is_plate_region):
+        """Resize vùng biển số để mỗi dòng chữ cao khoảng OCR_TARGET_PLATE_HEIGHT pixel
+        
+        Trả về (vùng ảnh, hệ số scale). Không áp dụng cho trường hợp OCR cả frame.
+        """
+        target_height = self.config.get('OCR_TARGET_PLATE_HEIGHT', 64)
+        if not is_plate_region or not target_height:
+            return region, 1.0
+        
+        region_height, region_width = region.shape[:2]
+        # Biển 2 dòng (xe máy, biển vuông) có tỉ lệ gần vuông
+        lines = 2 if region_width / float(region_height) < 2.5 else 1
+        scale = target_height * lines / float(region_height)
+        scale = min(scale, self.config.get('OCR_MAX_UPSCALE', 3.0))
+        
+        if abs(scale - 1.0) < 0.1:
+            return region, 1.0
+        
+        interpolation = cv2.INTER_CUBIC if scale > 1 else cv2.INTER_AREA
+        size = (max(1, int(round(region_width * scale))), max(1, int(round(region_height * scale))))
+        return cv2.resize(region, size, interpolation=interpolation), scale
+    
+    def _locate_ocr_regions(self, image):
+        """Khoanh vùng biển số, trả về (vùng biển số, vùng sẽ OCR, thời gian ms)"""
+        localization_start = time.perf_counter()
+        plate_regions = []
+        if self.config.get('PLATE_LOCALIZATION', True):
+            plate_regions = self._localize_plate_regions(image)
+        localization_ms = (time.perf_counter() - localization_start) * 1000
+        OCR_STAGE_SECONDS.observe(localization_ms / 1000, stage='localization')
+        
+        img_height, img_width = image.shape[:2]
+        ocr_regions = plate_regions or [(0, 0, img_width, img_height)]
+        return plate_regions, ocr_regions, localization_ms
+    
+    def _build_plate_result(self, all_candidates):
+        """Ghép, xác thực và format các ứng viên thành kết quả nhận diện"""
+        # Tìm và ghép các ứng viên biển số
+        extraction_start = time.perf_counter()
+        license_candidates = self._extract_license_plate_candidates(all_candidates)
+        validation_start = time.perf_counter()
+        OCR_STAGE_SECONDS.observe(validation_start - extraction_start, stage='extraction')
+        
+        # Xác thực, sửa lỗi theo vị trí và format biển số trong một lần parse
+        valid_plates = []
+        seen = set()
+        for candidate in license_candidates:
+            match = plate_grammar.parse_plate(candidate['text'])
+            if match is not None and match.formatted not in seen:
+                seen.add(match.formatted)
+                formatted = match.formatted
+                valid_plates.append({
+                    'text': formatted,
+                    'confidence': candidate['confidence'],
+                    'score': candidate.get('score', 0),
+                    'source': candidate['source'],
+                    'formatted': formatted,
+                    'original_text': candidate.get('original_text', '')
+                })
+        
+        # Sắp xếp theo độ tin cậy
+        valid_plates.sort(key=lambda x: (x['confidence'], x['score']), reverse=True)
+        OCR_STAGE_SECONDS.observe(time.perf_counter() - validation_start, stage='validation')
+        
+        return {
+            'success': True,
+            'license_plates': valid_plates,
+            'total_candidates': len(all_candidates),
+            'method': 'easyocr'
+        }
+    
+    @timed(OCR_STAGE_SECONDS, stage='text_detection')
+    def _detect_text_regions(self, reader, image):
+        """Chạy text detector một lần, trả về (horizontal_list, free_list) hoặc None nếu lỗi"""
+        try:
+            horizontal_list, free_list = reader.detect(image)
+            return horizontal_list[0], free_list[0]
+        except Exception as e:
+            print(f"⚠️  Lỗi detect vùng text, chuyển về readtext từng phiên bản: {e}")
+            return None
+    
+    def _read_text(self, reader, processed_img, text_regions=None):
+        """OCR một phiên bản ảnh: chỉ chạy recognizer nếu đã có sẵn vùng text"""
+        if text_regions is None:
+            return reader.readtext(processed_img)
+        
+        horizontal_list, free_list = text_regions
+        if not horizontal_list and not free_list:
+            return []
+        
+        if processed_img.ndim == 3:
+            gray = cv2.cvtColor(processed_img, cv2.COLOR_BGR2GRAY)
+        else:
+            gray = processed_img
+        return reader.recognize(gray, horizontal_list=horizontal_list, free_list=free_list)
+    
+    @staticmethod
+    def _recognizer_batches(reader):
+        """Recognizer có xử lý nhiều crop trong một lần forward không
+        
+        EasyOCR trên CPU luôn nhận dạng từng box một (kể cả khi truyền batch_size),
+        chỉ trên GPU mới gom crop theo lô.
+        """
+        return getattr(reader, 'device', 'cpu') != 'cpu'
+    
+    @timed(OCR_STAGE_SECONDS, stage='ocr_batch')
+    def _recognize_batch(self, reader, items):
+        """Chạy recognizer cho crop của nhiều ảnh
+        
+        items: danh sách (ảnh, text_regions). Trên GPU các ảnh được xếp chồng theo
+        chiều dọc thành một canvas, box được dịch toạ độ tương ứng để recognizer xử lý
+        tất cả crop trong một lần gọi; kết quả được tách lại theo từng ảnh. Trên CPU
+        ghép canvas không nhanh hơn nên từng ảnh được nhận dạng riêng.
+        """
+        if not self._recognizer_batches(reader):
+            return [self._read_text(reader, processed_img, text_regions) for processed_img, text_regions in items]
+        
+        outputs = [[] for _ in items]
+        parts = []
+        horizontal_list = []
+        free_list = []
+        canvas_height = 0
+        
+        for k, (processed_img, text_regions) in enumerate(items):
+            if text_regions is None:
+                # Không có vùng text dùng chung -> OCR riêng ảnh này
+                outputs[k] = reader.readtext(processed_img)
+                continue
             
-            for i, processed_img in enumerate(processed_images):
-                try:
-                    results = reader.readtext(processed_img)
-                    for (bbox, text, confidence) in results:
-                        # Lọc và xử lý text
-                        cleaned_text = self._clean_text(text)
-                        if len(cleaned_text) >= 6:  # Biển số tối thiểu 6 ký tự
-                            all_candidates.append({
-                                'text': cleaned_text,
-                                'original_text': text,
-                                'confidence': confidence,
-                                'source': f'image_v{i+1}',
-                                'bbox': bbox
-                            })
-                except Exception as e:
-                    print(f"⚠️  Lỗi xử lý ảnh version {i+1}: {e}")
-                    continue
+            boxes, polygons = text_regions
+            if not boxes and not polygons:
+                continue
             
-            # Tìm và ghép các ứng viên biển số
-            license_candidates = self._extract_license_plate_candidates(all_candidates)
-            
-            # Xác thực và format biển số
-            valid_plates = []
-            for candidate in license_candidates:
-                if self._is_vietnamese_license_plate(candidate['text']):
-                    formatted = self._format_license_plate(candidate['text'])
-                    valid_plates.append({
-                        'text': formatted,
-                        'confidence': candidate['confidence'],
-                        'score': candidate.get('score', 0),
-                        'source': candidate['source'],
-                        'formatted': formatted,
-                        'original_text': candidate.get('original_text', '')
-                    })
+            gray = cv2.cvtColor(processed_img, cv2.COLOR_BGR2GRAY) if processed_img.ndim == 3 else processed_img
+            img_height, img_width = gray.shape[:2]
             
-            # Sắp xếp theo độ tin cậy
-            valid_plates.sort(key=lambda x: (x['confidence'], x['score']), reverse=True)
+            # Cắt box trong phạm vi ảnh để không lấn sang ảnh kế bên trên canvas
+            for x_min, x_max, y_min, y_max in boxes:
+                horizontal_list.append([
+                    max(0, x_min), min(img_width, x_max),
+                    max(0, y_min) + canvas_height, min(img_height, y_max) + canvas_height
+                ])
+            for polygon in polygons:
+                free_list.append([
+                    [min(max(0, px), img_width), min(max(0, py), img_height) + canvas_height]
+                    for px, py in polygon
+                ])
             
-            return {
-                'success': True,
-                'license_plates': valid_plates,
-                'total_candidates': len(all_candidates),
-                'processing_versions': len(processed_images),
-                'method': 'easyocr'
-            }
+            parts.append((canvas_height, gray, k))
+            canvas_height += img_height
+        
+        if not parts:
+            return outputs
+        
+        canvas_width = max(gray.shape[1] for _, gray, _ in parts)
+        canvas = np.zeros((canvas_height, canvas_width), dtype=np.uint8)
+        for top, gray, _ in parts:
+            canvas[top:top + gray.shape[0], :gray.shape[1]] = gray
+        
+        batch_size = self.config.get('OCR_BATCH_SIZE', 32)
+        results = reader.recognize(
+            canvas, horizontal_list=horizontal_list, free_list=free_list, batch_size=batch_size
+        )
+        
+        # Trả kết quả về đúng ảnh dựa trên toạ độ y
+        part_tops = [top for top, _, _ in parts]
+        for bbox, text, confidence in results:
+            top_y = min(point[1] for point in bbox)
+            part_index = bisect.bisect_right(part_tops, top_y) - 1
+            part_top, _, k = parts[max(0, part_index)]
+            local_bbox = [[px, py - part_top] for px, py in bbox]
+            outputs[k].append((local_bbox, text, confidence))
+        
+        return outputs
+    
+    def _collect_ocr_candidates(self, results, source, offset=(0, 0), scale=1.0):
+        """Chuyển kết quả OCR thành danh sách ứng viên đã làm sạch"""
+        candidates = []
+        offset_x, offset_y = offset
+        for (bbox, text, confidence) in results:
+            # Đưa toạ độ bbox (trong vùng đã resize) về hệ toạ độ của ảnh đã chuẩn hoá
+            bbox = [[int(px / scale) + offset_x, int(py / scale) + offset_y] for px, py in bbox]
             
-        except Exception as e:
-            return {
-                'success': False,
-                'error': f'Lỗi xử lý ảnh: {str(e)}',
-                'license_plates': []
-            }
+            # Lọc và xử lý text, giữ cả mảnh ngắn (dòng trên/dưới của biển 2 dòng) để ghép
+            cleaned_text = self._clean_text(text)
+            if len(cleaned_text) >= 2:
+                candidates.append({
+                    'text': cleaned_text,
+                    'original_text': text,
+                    'confidence': confidence,
+                    'source': source,
+                    'bbox': bbox
+                })
+        return candidates
     
-    def _preprocess_image_for_ocr(self, image):
-        """Tạo nhiều phiên bản ảnh đã xử lý để tăng độ chính xác OCR"""
-        versions = []
+    def _localize_plate_regions(self, image):
+        """Khoanh vùng biển số bằng edge + morphology + contour (chỉ dùng OpenCV/NumPy)
         
+        Trả về danh sách (x, y, w, h) đã thêm padding, sắp xếp theo điểm giảm dần.
+        """
         try:
-            # Phiên bản 1: Ảnh gốc
-            versions.append(image)
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+            img_height, img_width = gray.shape[:2]
+            frame_area = float(img_height * img_width)
             
-            # Phiên bản 2: Grayscale + Contrast
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            contrast = cv2.convertScaleAbs(gray, alpha=1.5, beta=30)
-            versions.append(contrast)
+            min_aspect, max_aspect = self.config.get('PLATE_ASPECT_RANGE', (1.0, 8.0))
+            min_area_ratio = self.config.get('PLATE_MIN_AREA_RATIO', 0.002)
+            max_area_ratio = self.config.get('PLATE_MAX_AREA_RATIO', 0.5)
+            min_contrast = self.config.get('PLATE_MIN_CONTRAST', 30)
+            padding = self.config.get('PLATE_ROI_PADDING', 0.15)
+            max_rois = self.config.get('PLATE_MAX_ROIS', 3)
             
-            # Phiên bản 3: Threshold
-            _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-            versions.append(thresh)
+            # Cạnh ký tự trên biển số dày đặc -> nối lại thành khối chữ nhật
+            blurred = cv2.bilateralFilter(gray, 9, 75, 75)
+            edges = cv2.Canny(blurred, 50, 200)
+            kernel_w = max(3, img_width // 60)
+            kernel_h = max(3, img_height // 120)
+            close_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_w, kernel_h))
+            closed = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, close_kernel)
+            open_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+            closed = cv2.morphologyEx(closed, cv2.MORPH_OPEN, open_kernel)
             
-            # Phiên bản 4: Morphology
-            kernel = np.ones((2,2), np.uint8)
-            morph = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
-            versions.append(morph)
+            contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
             
-            # Phiên bản 5: Gaussian Blur + Threshold
-            blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-            _, thresh2 = cv2.threshold(blurred, 127, 255, cv2.THRESH_BINARY)
-            versions.append(thresh2)
+            scored = []
+            for contour in contours:
+                x, y, w, h = cv2.boundingRect(contour)
+                area = w * h
+                if area < min_area_ratio * frame_area or area > max_area_ratio * frame_area:
+                    continue
+                
+                aspect = w / float(h)
+                if not (min_aspect <= aspect <= max_aspect):
+                    continue
+                
+                # Độ "chữ nhật" của contour và độ tương phản bên trong vùng
+                rectangularity = cv2.contourArea(contour) / float(area)
+                if rectangularity < 0.4:
+                    continue
+                
+                contrast = float(gray[y:y + h, x:x + w].std())
+                if contrast < min_contrast:
+                    continue
+                
+                scored.append((rectangularity * contrast, (x, y, w, h)))
+            
+            scored.sort(key=lambda item: item[0], reverse=True)
+            
+            regions = []
+            for _, (x, y, w, h) in scored:
+                pad_x = max(4, int(w * padding))
+                pad_y = max(4, int(h * padding))
+                x0 = max(0, x - pad_x)
+                y0 = max(0, y - pad_y)
+                x1 = min(img_width, x + w + pad_x)
+                y1 = min(img_height, y + h + pad_y)
+                box = (x0, y0, x1 - x0, y1 - y0)
+                
+                # Bỏ các vùng trùng lặp nhiều với vùng đã chọn
+                if any(self._box_iou(box, kept) > 0.5 for kept in regions):
+                    continue
+                regions.append(box)
+                if len(regions) >= max_rois:
+                    break
+            
+            return regions
             
         except Exception as e:
-            print(f"⚠️  Lỗi tiền xử lý ảnh: {e}")
-            # Fallback về ảnh gốc
-            versions = [image]
-        
-        return versions
+            print(f"⚠️  Lỗi khoanh vùng biển số: {e}")
+            return []
     
-    def _clean_text(self, text):
-        """Làm sạch text OCR"""
-        if not text:
-            return ""
+    @staticmethod
+    def _box_iou(box_a, box_b):
+        """Tỉ lệ giao/hợp của hai box (x, y, w, h)"""
+        ax, ay, aw, ah = box_a
+        bx, by, bw, bh = box_b
+        inter_w = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+        inter_h = max(0, min(ay + ah, by + bh) - max(ay, by))
+        inter = inter_w * inter_h
+        union = aw * ah + bw * bh - inter
+        return inter / float(union) if union else 0.0
+    
+    def _iter_preprocessed_images(self, image, order=PREPROCESS_VERSIONS, memory=None):
+        """Sinh lần lượt (chỉ số phiên bản, ảnh) theo thứ tự cho trước
         
-        # Loại bỏ ký tự đặc biệt, giữ lại chữ cái, số và dấu gạch ngang
-        cleaned = re.sub(r'[^A-Za-z0-9\-.]', '', text.upper())
+        Mỗi phiên bản chỉ được tính khi cần, ảnh trung gian (gray, Otsu) dùng chung
+        và được giải phóng ngay khi các phiên bản còn lại không cần tới nữa.
+        Nếu truyền memory, cập nhật memory['estimated_peak_image_bytes'] theo các buffer đang giữ.
+        """
+        cache = {}
         
-        # Thay thế các ký tự dễ nhầm lẫn
-        replacements = {
-            'O': '0', 'I': '1', 'Z': '2', 'S': '5',
-            'G': '6', 'B': '8', 'Q': '0'
+        def gray():
+            if 'gray' not in cache:
+                cache['gray'] = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+            return cache['gray']
+        
+        def otsu():
+            if 'otsu' not in cache:
+                _, cache['otsu'] = cv2.threshold(gray(), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+            return cache['otsu']
+        
+        builders = {
+            # Phiên bản 1: Ảnh gốc
+            'original': lambda: image,
+            # Phiên bản 2: Grayscale + Contrast
+            'contrast': lambda: cv2.convertScaleAbs(gray(), alpha=1.5, beta=30),
+            # Phiên bản 3: Threshold
+            'otsu': otsu,
+            # Phiên bản 4: Morphology
+            'morphology': lambda: cv2.morphologyEx(otsu(), cv2.MORPH_CLOSE, np.ones((2, 2), np.uint8)),
+            # Phiên bản 5: Gaussian Blur + Threshold
+            'blur_threshold': lambda: cv2.threshold(
+                cv2.GaussianBlur(gray(), (5, 5), 0), 127, 255, cv2.THRESH_BINARY
+            )[1],
         }
         
-        for old, new in replacements.items():
-            if old in cleaned and len([c for c in cleaned if c.isdigit()]) < 3:
-                cleaned = cleaned.replace(old, new)
+        # Ảnh trung gian mà mỗi phiên bản cần
+        needs = {
+            'original': set(),
+            'contrast': {'gray'},
+            'otsu': {'gray', 'otsu'},
+            'morphology': {'gray', 'otsu'},
+            'blur_threshold': {'gray'},
+        }
         
-        return cleaned
+        for position, name in enumerate(order):
+            try:
+                build_start = time.perf_counter()
+                version = builders[name]()
+                OCR_STAGE_SECONDS.observe(time.perf_counter() - build_start, stage='preprocess', variant=name)
+            except Exception as e:
+                print(f"⚠️  Lỗi tiền xử lý ảnh ({name}): {e}")
+                continue
+            
+            if memory is not None:
+                self._track_image_memory(memory, image, list(cache.values()) + [version])
+            
+            # Giải phóng ảnh trung gian không còn phiên bản nào cần
+            still_needed = set().union(*(needs[later] for later in order[position + 1:]))
+            for key in list(cache):
+                if key not in still_needed:
+                    del cache[key]
+            
+            yield PREPROCESS_VERSIONS.index(name), version
+            del version
+    
+    @staticmethod
+    def _track_image_memory(memory, region, buffers):
+        """Cập nhật ước lượng đỉnh bộ nhớ buffer ảnh (tổng nbytes frame đã chuẩn hoá + vùng + buffer đang giữ)"""
+        live = {}
+        for buffer in [region] + buffers:
+            # View (slice) của frame không cấp phát thêm bộ nhớ
+            if buffer.base is None:
+                live[id(buffer)] = buffer.nbytes
+        live_bytes = memory['normalized_bytes'] + sum(live.values())
+        memory['estimated_peak_image_bytes'] = max(memory['estimated_peak_image_bytes'], live_bytes)
+    
+    def _has_confident_plate(self, candidates, threshold):
+        """Có ứng viên nào là biển số hợp lệ và đạt ngưỡng tin cậy không"""
+        return any(
+            c['confidence'] >= threshold and self._is_vietnamese_license_plate(c['text'])
+            for c in self._extract_license_plate_candidates(candidates)
+        )
+    
+    def _clean_text(self, text):
+        """Làm sạch text OCR (sửa nhầm lẫn ký tự được làm theo vị trí trong plate_grammar)"""
+        return plate_grammar.clean_text(text)
     
     def _extract_license_plate_candidates(self, all_candidates):
-        """Ghép và tìm các ứng viên biển số từ tất cả OCR results"""
-        candidates = []
+        """Ghép và tìm các ứng viên biển số từ tất cả OCR results
         
-        # Nhóm theo độ tin cậy cao
-        high_confidence = [c for c in all_candidates if c['confidence'] > 0.7]
-        medium_confidence = [c for c in all_candidates if 0.5 <= c['confidence'] <= 0.7]
+        Các mảnh text được gom theo vị trí (cùng vùng trên nhiều phiên bản ảnh),
+        sau đó chỉ ghép các cụm nằm cạnh nhau: trên-dưới (biển 2 dòng) hoặc
+        trái-phải (một dòng bị tách). Tra cứu láng giềng qua lưới ô nên gần tuyến tính.
+        """
+        clusters = self._cluster_fragments(all_candidates)
+        candidates = []
         
-        # Xử lý ứng viên độ tin cậy cao trước
-        for candidate in high_confidence:
-            text = candidate['text']
-            if len(text) >= 6:
+        # Cụm độ tin cậy cao, đủ dài -> ứng viên đơn
+        for cluster in clusters:
+            if cluster['confidence'] > 0.7 and len(cluster['text']) >= 6:
                 candidates.append({
-                    'text': text,
-                    'confidence': candidate['confidence'],
-                    'score': candidate['confidence'],
-                    'source': candidate['source'],
-                    'original_text': candidate.get('original_text', '')
+                    'text': cluster['text'],
+                    'confidence': cluster['confidence'],
+                    'score': cluster['confidence'],
+                    'source': cluster['source'],
+                    'original_text': cluster['original_text']
                 })
         
-        # Thử ghép các ứng viên độ tin cậy trung bình
-        for i, c1 in enumerate(medium_confidence):
-            for j, c2 in enumerate(medium_confidence):
-                if i != j:
-                    merged_text = c1['text'] + c2['text']
-                    if 6 <= len(merged_text) <= 10:
-                        avg_confidence = (c1['confidence'] + c2['confidence']) / 2
-                        candidates.append({
-                            'text': merged_text,
-                            'confidence': avg_confidence,
-                            'score': avg_confidence * 0.9,  # Penalty cho merged
-                            'source': f"{c1['source']}+{c2['source']}",
-                            'original_text': f"{c1.get('original_text', '')}+{c2.get('original_text', '')}"
-                        })
-        
-        # Loại bỏ duplicate và sắp xếp
-        seen = set()
-        unique_candidates = []
+        # Ghép các cụm kề nhau theo hình học
+        joinable = [c for c in clusters if c['confidence'] >= 0.5 and c['box'] is not None]
+        for first, second in self._adjacent_cluster_pairs(joinable):
+            original_text = first['original_text'] + second['original_text']
+            merged_text = self._clean_text(original_text)
+            if not 6 <= len(merged_text.replace('-', '').replace('.', '')) <= 10:
+                continue
+            
+            # Độ tin cậy trung bình có trọng số theo số ký tự mỗi mảnh
+            total_length = len(first['text']) + len(second['text'])
+            confidence = (
+                first['confidence'] * len(first['text']) + second['confidence'] * len(second['text'])
+            ) / total_length
+            candidates.append({
+                'text': merged_text,
+                'confidence': confidence,
+                'score': confidence * 0.9,  # Penalty cho merged
+                'source': f"{first['source']}+{second['source']}",
+                'original_text': f"{first['original_text']}+{second['original_text']}"
+            })
+        
+        # Loại bỏ duplicate (giữ điểm cao nhất) và sắp xếp
+        best = {}
         for candidate in candidates:
-            if candidate['text'] not in seen:
-                seen.add(candidate['text'])
-                unique_candidates.append(candidate)
+            kept = best.get(candidate['text'])
+            if kept is None or candidate['score'] > kept['score']:
+                best[candidate['text']] = candidate
         
-        return sorted(unique_candidates, key=lambda x: x['score'], reverse=True)
+        return sorted(best.values(), key=lambda x: x['score'], reverse=True)
     
-    def _is_vietnamese_license_plate(self, text):
-        """Kiểm tra xem text có phải là biển số Việt Nam không"""
-        if not text or len(text) < 6:
-            return False
+    @staticmethod
+    def _fragment_box(fragment):
+        """Box (x0, y0, x1, y1) bao quanh bbox OCR, None nếu không có bbox"""
+        bbox = fragment.get('bbox')
+        if not bbox:
+            return None
+        xs = [point[0] for point in bbox]
+        ys = [point[1] for point in bbox]
+        return min(xs), min(ys), max(xs), max(ys)
+    
+    def _cluster_fragments(self, fragments):
+        """Gom các mảnh trùng vị trí (IoU cao) trên các phiên bản ảnh thành cụm
         
-        # Patterns cho biển số Việt Nam
-        patterns = [
-            r'^\d{2}[A-Z]{1,2}\d{4,5}$',      # 30G1234, 51AB1234
-            r'^\d{2}[A-Z]{1,2}-?\d{4,5}$',    # 30G-1234, 51AB-1234
-            r'^\d{2}-?[A-Z]{1,2}-?\d{4,5}$',  # 30-G-1234
-        ]
+        Mỗi cụm lấy text có tổng độ tin cậy lớn nhất làm kết quả đọc.
+        """
+        boxes = [self._fragment_box(fragment) for fragment in fragments]
+        parent = list(range(len(fragments)))
         
-        # Loại bỏ dấu gạch ngang để check
-        text_no_dash = text.replace('-', '').replace('.', '')
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
         
-        for pattern in patterns:
-            if re.match(pattern, text_no_dash):
-                return True
+        # Lưới ô theo tâm box, chỉ so sánh các mảnh ở ô lân cận
+        heights = sorted(box[3] - box[1] for box in boxes if box is not None)
+        cell = max(1, heights[len(heights) // 2]) if heights else 1
+        grid = {}
+        for index, box in enumerate(boxes):
+            if box is None:
+                continue
+            cx = int((box[0] + box[2]) / 2 // cell)
+            cy = int((box[1] + box[3]) / 2 // cell)
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for other in grid.get((cx + dx, cy + dy), ()):
+                        if self._box_iou(self._xyxy_to_xywh(box), self._xyxy_to_xywh(boxes[other])) > 0.5:
+                            parent[find(index)] = find(other)
+            grid.setdefault((cx, cy), []).append(index)
         
-        # Kiểm tra format linh hoạt hơn
-        if re.match(r'^\d{2}[A-Z]{1,2}\d{4,5}', text_no_dash):
-            return True
+        groups = {}
+        for index in range(len(fragments)):
+            groups.setdefault(find(index), []).append(index)
         
-        return False
+        clusters = []
+        for members in groups.values():
+            text_weights = {}
+            for index in members:
+                text = fragments[index]['text']
+                text_weights[text] = text_weights.get(text, 0.0) + fragments[index]['confidence']
+            best_text = max(text_weights, key=text_weights.get)
+            best_fragment = max(
+                (fragments[index] for index in members if fragments[index]['text'] == best_text),
+                key=lambda fragment: fragment['confidence']
+            )
+            
+            member_boxes = [boxes[index] for index in members if boxes[index] is not None]
+            box = None
+            if member_boxes:
+                box = tuple(
+                    sum(member_box[k] for member_box in member_boxes) / len(member_boxes) for k in range(4)
+                )
+            
+            clusters.append({
+                'text': best_text,
+                'confidence': best_fragment['confidence'],
+                'source': best_fragment['source'],
+                'original_text': best_fragment.get('original_text', ''),
+                'box': box
+            })
+        
+        return clusters
     
-    def _format_license_plate(self, text):
-        """Format biển số theo chuẩn Việt Nam"""
-        if not text:
-            return text
+    @staticmethod
+    def _xyxy_to_xywh(box):
+        x0, y0, x1, y1 = box
+        return x0, y0, x1 - x0, y1 - y0
+    
+    def _adjacent_cluster_pairs(self, clusters):
+        """Sinh các cặp (trước, sau) kề nhau: dòng trên-dòng dưới hoặc trái-phải cùng dòng"""
+        heights = sorted(c['box'][3] - c['box'][1] for c in clusters)
+        cell = max(1, heights[len(heights) // 2]) if heights else 1
         
-        # Loại bỏ tất cả dấu gạch ngang và khoảng trắng
-        clean_text = re.sub(r'[-.\s]', '', text.upper())
+        grid = {}
+        for index, cluster in enumerate(clusters):
+            x0, y0, x1, y1 = cluster['box']
+            for cx in range(int(x0 // cell), int(x1 // cell) + 1):
+                grid.setdefault((cx, int(y0 // cell)), []).append(index)
         
-        # Format: 30G12345 -> 30G-12345
-        if re.match(r'^\d{2}[A-Z]{1,2}\d{4,5}$', clean_text):
-            # Tìm vị trí chèn dấu gạch ngang
-            match = re.match(r'^(\d{2}[A-Z]{1,2})(\d{4,5})$', clean_text)
-            if match:
-                return f"{match.group(1)}-{match.group(2)}"
+        for index, first in enumerate(clusters):
+            x0, y0, x1, y1 = first['box']
+            height = y1 - y0
+            
+            # Chỉ xét các ô lân cận phía dưới và bên phải cụm hiện tại
+            nearby = set()
+            for cx in range(int(x0 // cell) - 1, int((x1 + 3 * height) // cell) + 2):
+                for cy in range(int((y0 - 2 * height) // cell) - 1, int((y1 + 2 * height) // cell) + 2):
+                    nearby.update(grid.get((cx, cy), ()))
+            
+            for other in nearby:
+                if other == index:
+                    continue
+                second = clusters[other]
+                if self._is_next_line(first['box'], second['box']) or self._is_next_on_line(first['box'], second['box']):
+                    yield first, second
+    
+    @staticmethod
+    def _is_next_line(top, bottom):
+        """bottom là dòng ngay dưới top và thẳng hàng theo chiều ngang"""
+        top_height = top[3] - top[1]
+        bottom_height = bottom[3] - bottom[1]
+        if not top_height or not bottom_height or not 0.5 <= bottom_height / top_height <= 2.0:
+            return False
+        
+        gap = bottom[1] - top[3]
+        if not -0.3 * top_height <= gap <= 1.0 * top_height:
+            return False
+        
+        overlap = min(top[2], bottom[2]) - max(top[0], bottom[0])
+        narrower = min(top[2] - top[0], bottom[2] - bottom[0])
+        return narrower > 0 and overlap >= 0.5 * narrower
+    
+    @staticmethod
+    def _is_next_on_line(left, right):
+        """right nằm ngay bên phải left trên cùng một dòng"""
+        height = max(left[3] - left[1], right[3] - right[1])
+        if not height:
+            return False
+        
+        vertical_overlap = min(left[3], right[3]) - max(left[1], right[1])
+        if vertical_overlap < 0.5 * min(left[3] - left[1], right[3] - right[1]):
+            return False
         
-        return clean_text
+        gap = right[0] - left[2]
+        return -0.3 * height <= gap <= 1.5 * height
+    
+    @staticmethod
+    def _is_vietnamese_license_plate(text):
+        """Kiểm tra xem text có phải là biển số Việt Nam không"""
+        return plate_grammar.is_valid_plate(text)
+    
+    @staticmethod
+    def _format_license_plate(text):
+        """Format biển số theo chuẩn Việt Nam"""
+        return plate_grammar.format_plate(text)
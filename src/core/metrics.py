@@ -0,0 +1,260 @@
+"""
+Registry metrics trong process (counter, gauge, histogram), xuất theo định dạng text của Prometheus
+    
+    REQUESTS = metrics.counter('etc_http_requests_total', 'Số request HTTP', ('method', 'status'))
+    REQUESTS.inc(method='GET', status='200')
+    
+    with OCR_SECONDS.time(stage='decode'):
+        ...
+
+Mỗi lần ghi chỉ cần một dict lookup và một lock ngắn, không phụ thuộc thư viện ngoài.
+"""
+import bisect
+import functools
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Bucket mặc định (giây): từ 1ms tới 10s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(labelnames, key)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = None
+    
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def _key(self, labels):
+        return tuple([str(labels.get(name, '')) for name in self.labelnames]) if self.labelnames else ()
+    
+    def _samples(self):
+        """[(hậu tố tên, nhãn, giá trị)]"""
+        with self._lock:
+            return [('', _format_labels(self.labelnames, key), value) for key, value in self._values.items()]
+    
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.type_name}'
+        ]
+        for suffix, labels, value in self._samples():
+            lines.append(f'{self.name}{suffix}{labels} {_format_value(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    """Giá trị chỉ tăng"""
+    
+    type_name = 'counter'
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Giá trị tăng giảm tuỳ ý, hoặc đọc từ hàm callback lúc xuất metrics"""
+    
+    type_name = 'gauge'
+    
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+    
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+    
+    def set_function(self, function):
+        """Giá trị (không nhãn) lấy từ function() mỗi lần xuất; function trả về None thì bỏ qua"""
+        self._function = function
+    
+    def _samples(self):
+        if self._function is None:
+            return super()._samples()
+        try:
+            value = self._function()
+        except Exception:
+            value = None
+        return [] if value is None else [('', '', value)]
+
+
+class Histogram(_Metric):
+    """Phân bố giá trị theo bucket (thường là thời gian tính bằng giây)"""
+    
+    type_name = 'histogram'
+    
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._listeners = []
+    
+    def add_listener(self, listener):
+        """Gọi listener(value, labels) cho mỗi giá trị quan sát được (ví dụ để profiling theo request)"""
+        self._listeners.append(listener)
+    
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [số mẫu theo bucket (không cộng dồn), bucket +Inf ở cuối], tổng, số mẫu
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+        for listener in self._listeners:
+            listener(value, labels)
+    
+    @contextmanager
+    def time(self, **labels):
+        """Đo thời gian chạy khối lệnh (giây)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+    
+    def _samples(self):
+        with self._lock:
+            snapshot = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        
+        samples = []
+        for key, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(float(bound))}"'
+                samples.append(('_bucket', _format_labels(self.labelnames, key, le), cumulative))
+            labels = _format_labels(self.labelnames, key)
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, count))
+        return samples
+
+
+class MetricsRegistry:
+    """Tập hợp metrics của process; khai báo lại cùng tên trả về metric đã có"""
+    
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+    
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f'Metric {name} đã được khai báo với kiểu {metric.type_name}')
+            return metric
+    
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+    
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+    
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+    
+    def render(self):
+        """Toàn bộ metrics theo định dạng text exposition 0.0.4"""
+        with self._lock:
+            registered = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in registered:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def timed(histogram, **labels):
+    """Decorator đo thời gian chạy hàm vào histogram"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+
+def instrument_service(cls):
+    """Class decorator: đo thời gian mọi staticmethod public của service"""
+    for name, attribute in list(vars(cls).items()):
+        if isinstance(attribute, staticmethod) and not name.startswith('_'):
+            wrapped = timed(SERVICE_SECONDS, service=cls.__name__, method=name)(attribute.__func__)
+            setattr(cls, name, staticmethod(wrapped))
+    return cls
+
+
+def install_query_metrics(engine):
+    """Đo thời gian từng câu lệnh SQL theo loại (SELECT, INSERT, UPDATE...)"""
+    from sqlalchemy import event
+    
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+    
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info['query_start'].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+        DB_QUERY_SECONDS.observe(time.perf_counter() - start, operation=operation)
+    
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(context):
+        # Câu lệnh lỗi không qua after_cursor_execute
+        stack = context.connection.info.get('query_start') if context.connection is not None else None
+        if stack:
+            stack.pop()
+        DB_QUERY_ERRORS.inc()
+
+
+metrics = MetricsRegistry()
+
+SERVICE_SECONDS = metrics.histogram(
+    'etc_service_seconds', 'Thời gian chạy method của service layer (giây)', ('service', 'method')
+)
+DB_QUERY_SECONDS = metrics.histogram(
+    'etc_db_query_seconds', 'Thời gian câu lệnh SQL theo loại (giây)', ('operation',)
+)
+DB_QUERY_ERRORS = metrics.counter('etc_db_query_errors_total', 'Số câu lệnh SQL lỗi')
@@ -0,0 +1,228 @@
+"""
+Migration schema cho database đã tồn tại
+
+db.create_all() chỉ tạo bảng còn thiếu, không thêm index hay đổi kiểu cột của bảng
+đã có. Các hàm ở đây bổ sung phần còn thiếu một cách idempotent, chạy được nhiều lần.
+"""
+import logging
+from datetime import timedelta
+
+from sqlalchemy import Integer, inspect, text
+from sqlalchemy.schema import CreateTable
+
+from .models import db, Transaction, ScanHistory, Vehicle, vietnam_now
+
+logger = logging.getLogger(__name__)
+
+
+def ensure_indexes(engine=None):
+    """Tạo các index khai báo trong models nhưng chưa có trong database, trả về tên index đã tạo"""
+    engine = engine or db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    
+    created = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+                created.append(index.name)
+                logger.info(f"Đã tạo index {index.name} trên bảng {table.name}")
+    return created
+
+
+# Cột tiền lưu bằng số nguyên đồng; database cũ có thể còn kiểu REAL / FLOAT
+MONEY_COLUMNS = {
+    'vehicles': ('account_balance',),
+    'transactions': ('amount', 'balance_before', 'balance_after'),
+    'vehicle_statistics': ('total_spent', 'total_topup')
+}
+
+
+def _stale_money_columns(engine):
+    """{bảng: [cột tiền chưa phải kiểu số nguyên]} của database hiện tại"""
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    
+    stale = {}
+    for table_name, column_names in MONEY_COLUMNS.items():
+        if table_name not in existing_tables:
+            continue
+        types = {column['name']: column['type'] for column in inspector.get_columns(table_name)}
+        columns = [name for name in column_names if name in types and not isinstance(types[name], Integer)]
+        if columns:
+            stale[table_name] = columns
+    return stale
+
+
+def _rebuild_sqlite_table(connection, table, columns):
+    """Tạo lại bảng SQLite theo model (SQLite không ALTER được kiểu cột), làm tròn cột tiền về số nguyên"""
+    temp_name = f'{table.name}__migrate'
+    existing = {column['name'] for column in inspect(connection).get_columns(table.name)}
+    copied = [column.name for column in table.columns if column.name in existing]
+    select_list = ', '.join(
+        f'CAST(ROUND(COALESCE({name}, 0)) AS INTEGER)' if name in columns else name for name in copied
+    )
+    
+    create_sql = str(CreateTable(table).compile(connection)).strip()
+    connection.exec_driver_sql(create_sql.replace(f'CREATE TABLE {table.name} (', f'CREATE TABLE {temp_name} (', 1))
+    connection.exec_driver_sql(
+        f'INSERT INTO {temp_name} ({", ".join(copied)}) SELECT {select_list} FROM {table.name}'
+    )
+    connection.exec_driver_sql(f'DROP TABLE {table.name}')
+    connection.exec_driver_sql(f'ALTER TABLE {temp_name} RENAME TO {table.name}')
+    for index in table.indexes:
+        index.create(bind=connection)
+
+
+def pending_money_columns(engine=None):
+    """['bảng.cột'] cột tiền còn kiểu số thực, cần chạy lệnh migrate-money-columns"""
+    stale = _stale_money_columns(engine or db.engine)
+    return [f'{table_name}.{column}' for table_name, columns in stale.items() for column in columns]
+
+
+def _inconsistent_rounded_transactions(connection):
+    """Số giao dịch mà sau khi làm tròn từng cột không còn balance_after = balance_before + amount"""
+    return connection.exec_driver_sql(
+        'SELECT COUNT(*) FROM transactions '
+        'WHERE ROUND(balance_after) != ROUND(balance_before) + ROUND(amount)'
+    ).scalar()
+
+
+def migrate_money_columns(engine=None):
+    """Chuyển cột tiền còn kiểu số thực sang BIGINT (số nguyên đồng), trả về ['bảng.cột'] đã chuyển
+    
+    Giá trị có phần lẻ được làm tròn và ghi cảnh báo. Nếu làm tròn làm sai
+    balance_after = balance_before + amount ở giao dịch nào thì không chuyển gì
+    và raise ValueError, cần sửa dữ liệu trước. SQLite: tạo lại bảng theo model;
+    PostgreSQL: ALTER COLUMN TYPE BIGINT.
+    
+    Có DROP / RENAME bảng nên chỉ chạy một lần qua lệnh migrate-money-columns,
+    không chạy khi khởi động worker.
+    """
+    engine = engine or db.engine
+    stale = _stale_money_columns(engine)
+    if not stale:
+        return []
+    
+    if engine.dialect.name not in ('sqlite', 'postgresql'):
+        logger.warning(f"Cột tiền chưa là số nguyên, cần chuyển thủ công: {stale}")
+        return []
+    
+    with engine.connect() as connection:
+        if 'transactions' in stale:
+            inconsistent = _inconsistent_rounded_transactions(connection)
+            if inconsistent:
+                connection.rollback()
+                raise ValueError(
+                    f"{inconsistent} giao dịch sẽ sai balance_after = balance_before + amount sau khi làm tròn, "
+                    "cần sửa dữ liệu trước khi chuyển cột tiền"
+                )
+        
+        for table_name, columns in stale.items():
+            fractional = connection.exec_driver_sql(
+                f'SELECT COUNT(*) FROM {table_name} WHERE '
+                + ' OR '.join(f'{column} != ROUND({column})' for column in columns)
+            ).scalar()
+            if fractional:
+                logger.warning(f"Bảng {table_name}: {fractional} dòng có số tiền lẻ sẽ được làm tròn")
+        
+        if engine.dialect.name == 'sqlite':
+            # Bảng được DROP / tạo lại nên tạm tắt kiểm tra khoá ngoại (chỉ đổi được ngoài transaction)
+            foreign_keys = connection.exec_driver_sql('PRAGMA foreign_keys').scalar()
+            connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+            connection.commit()
+            try:
+                for table_name, columns in stale.items():
+                    _rebuild_sqlite_table(connection, db.metadata.tables[table_name], columns)
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                connection.exec_driver_sql(f'PRAGMA foreign_keys={foreign_keys}')
+                connection.commit()
+        else:
+            for table_name, columns in stale.items():
+                for column in columns:
+                    connection.exec_driver_sql(
+                        f'ALTER TABLE {table_name} ALTER COLUMN {column} TYPE BIGINT USING ROUND({column})::BIGINT'
+                    )
+            connection.commit()
+    
+    converted = [f'{table_name}.{column}' for table_name, columns in stale.items() for column in columns]
+    logger.info(f"Đã chuyển cột tiền sang số nguyên: {', '.join(converted)}")
+    return converted
+
+
+def check_ledger():
+    """Kiểm tra bất biến sổ cái, trả về {tên kiểm tra: số bản ghi vi phạm}
+    
+    - balance_after = balance_before + amount ở mọi giao dịch
+    - thu phí có amount âm, nạp tiền có amount dương
+    - không có số dư âm (tài khoản và sau giao dịch)
+    - số dư tài khoản bằng balance_after của giao dịch mới nhất (bảng chính)
+    """
+    latest = db.session.query(
+        Transaction.vehicle_id, db.func.max(Transaction.id).label('transaction_id')
+    ).group_by(Transaction.vehicle_id).subquery()
+    
+    return {
+        'transaction_arithmetic': Transaction.query.filter(
+            Transaction.balance_after != Transaction.balance_before + Transaction.amount
+        ).count(),
+        'transaction_sign': Transaction.query.filter(db.or_(
+            db.and_(Transaction.transaction_type == 'toll', Transaction.amount >= 0),
+            db.and_(Transaction.transaction_type == 'topup', Transaction.amount <= 0)
+        )).count(),
+        'negative_balance': Vehicle.query.filter(Vehicle.account_balance < 0).count()
+                            + Transaction.query.filter(Transaction.balance_after < 0).count(),
+        'balance_matches_last_transaction': db.session.query(Vehicle.id)
+            .join(latest, latest.c.vehicle_id == Vehicle.id)
+            .join(Transaction, Transaction.id == latest.c.transaction_id)
+            .filter(Transaction.balance_after != Vehicle.account_balance)
+            .count()
+    }
+
+
+def _history_queries():
+    """Các truy vấn lịch sử chính, cần dùng index"""
+    since = vietnam_now() - timedelta(days=30)
+    return {
+        'transaction_history': Transaction.query.filter(
+            Transaction.vehicle_id == 1,
+            Transaction.created_at >= since
+        ).order_by(Transaction.created_at.desc()),
+        'scan_history_by_vehicle': ScanHistory.query.filter(
+            ScanHistory.vehicle_id == 1,
+            ScanHistory.created_at >= since
+        ).order_by(ScanHistory.created_at.desc()),
+        'scan_history_all': ScanHistory.query.filter(
+            ScanHistory.created_at >= since
+        ).order_by(ScanHistory.created_at.desc()),
+        'recent_scans_by_plate': ScanHistory.query.filter_by(
+            scanned_data='30G-12345'
+        ).order_by(ScanHistory.created_at.desc()).limit(5)
+    }
+
+
+def check_query_plans():
+    """Kiểm tra các truy vấn lịch sử dùng index (EXPLAIN QUERY PLAN, chỉ SQLite)
+    
+    Trả về {tên truy vấn: {'plan': [...], 'uses_index': bool}}, None nếu không phải SQLite.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return None
+    
+    report = {}
+    for name, query in _history_queries().items():
+        statement = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+        rows = db.session.execute(text(f'EXPLAIN QUERY PLAN {statement}')).fetchall()
+        plan = [row[-1] for row in rows]
+        # Quét toàn bảng hiện là "SCAN <bảng>" không kèm "USING ... INDEX"
+        full_scan = any(step.startswith('SCAN') and 'INDEX' not in step for step in plan)
+        report[name] = {'plan': plan, 'uses_index': not full_scan}
+    return report
@@ -23,7 +23,8 @@ class Vehicle(db.Model):
     color = db.Column(db.String(30))
     year = db.Column(db.Integer)
     
-    account_balance = db.Column(db.Float, default=0.0)
+    # Tiền lưu bằng số nguyên đồng
+    account_balance = db.Column(db.BigInteger, nullable=False, default=0)
     account_status = db.Column(db.String(20), default='active')
     
     created_at = db.Column(db.DateTime, default=vietnam_now)
@@ -31,6 +32,7 @@ class Vehicle(db.Model):
     
     transactions = db.relationship('Transaction', backref='vehicle', lazy=True)
     scans = db.relationship('ScanHistory', backref='vehicle', lazy=True)
+    statistics = db.relationship('VehicleStatistics', backref='vehicle', lazy=True, uselist=False)
 
     def to_dict(self):
         """Convert to dictionary"""
@@ -53,13 +55,19 @@ class Vehicle(db.Model):
 class Transaction(db.Model):
     """Model cho lịch sử giao dịch"""
     __tablename__ = 'transactions'
+    __table_args__ = (
+        # Lịch sử giao dịch theo xe, sắp xếp theo thời gian
+        db.Index('ix_transactions_vehicle_created', 'vehicle_id', 'created_at'),
+        # Chọn giao dịch cũ theo thời gian để lưu trữ (retention)
+        db.Index('ix_transactions_created', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.id'), nullable=False)
     transaction_type = db.Column(db.String(20), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
-    balance_before = db.Column(db.Float, nullable=False)
-    balance_after = db.Column(db.Float, nullable=False)
+    amount = db.Column(db.BigInteger, nullable=False)
+    balance_before = db.Column(db.BigInteger, nullable=False)
+    balance_after = db.Column(db.BigInteger, nullable=False)
     toll_station = db.Column(db.String(100))
     description = db.Column(db.Text)
     status = db.Column(db.String(20), default='completed')
@@ -80,9 +88,35 @@ class Transaction(db.Model):
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None
         }
 
+class VehicleStatistics(db.Model):
+    """Thống kê giao dịch của từng xe, cập nhật cùng transaction với nạp tiền / thu phí"""
+    __tablename__ = 'vehicle_statistics'
+    
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.id'), primary_key=True)
+    total_transactions = db.Column(db.Integer, nullable=False, default=0)
+    total_spent = db.Column(db.BigInteger, nullable=False, default=0)
+    total_topup = db.Column(db.BigInteger, nullable=False, default=0)
+    last_activity = db.Column(db.DateTime)
+    
+    updated_at = db.Column(db.DateTime, default=vietnam_now, onupdate=vietnam_now)
+
+    def to_dict(self):
+        return {
+            'total_transactions': self.total_transactions,
+            'total_spent': self.total_spent,
+            'total_topup': self.total_topup,
+            'last_activity': self.last_activity.strftime('%Y-%m-%d %H:%M:%S') if self.last_activity else None
+        }
+
 class ScanHistory(db.Model):
     """Model cho lịch sử quét"""
     __tablename__ = 'scan_history'
+    __table_args__ = (
+        # Lịch sử quét theo xe / theo biển số đọc được / toàn bộ, sắp xếp theo thời gian
+        db.Index('ix_scan_history_vehicle_created', 'vehicle_id', 'created_at'),
+        db.Index('ix_scan_history_scanned_created', 'scanned_data', 'created_at'),
+        db.Index('ix_scan_history_created', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.id'), nullable=True)
@@ -0,0 +1,208 @@
+import atexit
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from .image_processor import LicensePlateProcessor
+
+# Processor riêng của mỗi worker process (khởi tạo trong _init_worker)
+_worker_processor = None
+
+
+def _init_worker(config, torch_threads):
+    """Khởi tạo worker: cố định số thread của torch và nạp sẵn OCR reader"""
+    global _worker_processor
+    
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+        torch.set_num_interop_threads(1)
+    except Exception:
+        # torch không có hoặc đã khởi tạo thread pool - dùng mặc định
+        pass
+    
+    _worker_processor = LicensePlateProcessor(config)
+    _worker_processor.warm_up()
+
+
+def _warm_up_worker():
+    """Job rỗng để buộc pool tạo worker (warm-up chạy trong initializer)"""
+    return _worker_processor.warmup_status
+
+
+def _run_job(method, args):
+    """Chạy một job OCR trong worker, trả về (kết quả, thời điểm bắt đầu, thời điểm kết thúc)"""
+    started_at = time.time()
+    result = getattr(_worker_processor, method)(*args)
+    return result, started_at, time.time()
+
+
+class OCRWorkerPool:
+    """Pool các worker process OCR, mỗi worker giữ một reader đã nạp sẵn
+    
+    Job được gửi qua hàng đợi có giới hạn: khi số job đang chờ vượt quá
+    queue_size thì job mới bị từ chối ngay thay vì xếp hàng vô hạn.
+    Có cùng interface detect_license_plate / detect_license_plates_batch
+    với LicensePlateProcessor nên routes dùng được cả hai.
+    """
+    
+    def __init__(self, config, workers=2, queue_size=8, torch_threads=1, job_timeout=60):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.job_timeout = job_timeout
+        
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(config, torch_threads)
+        )
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+        
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._failed = 0
+        self._busy_seconds = 0.0
+        self._total_wait_ms = 0.0
+        self._max_wait_ms = 0.0
+        self._last_wait_ms = 0.0
+        
+        self.warmup_status = 'pending'
+        self.warmup_error = None
+        self.warmup_ms = None
+        
+        atexit.register(self.shutdown)
+    
+    def warm_up(self):
+        """Khởi động tất cả worker và chờ reader của chúng warm-up xong"""
+        self.warmup_status = 'running'
+        start = time.perf_counter()
+        
+        try:
+            futures = [self._executor.submit(_warm_up_worker) for _ in range(self.workers)]
+            statuses = [future.result() for future in futures]
+            if all(status == 'ready' for status in statuses):
+                self.warmup_status = 'ready'
+            else:
+                self.warmup_status = 'failed'
+                self.warmup_error = f'Trạng thái worker: {statuses}'
+        except Exception as e:
+            self.warmup_status = 'failed'
+            self.warmup_error = str(e)
+        
+        self.warmup_ms = round((time.perf_counter() - start) * 1000, 2)
+        return self.warmup_status == 'ready'
+    
+    def is_ready(self):
+        """Các worker đã warm-up xong chưa"""
+        return self.warmup_status == 'ready'
+    
+    def get_warmup_info(self):
+        """Thông tin trạng thái warm-up"""
+        return {
+            'status': self.warmup_status,
+            'warmup_ms': self.warmup_ms,
+            'error': self.warmup_error
+        }
+    
+    def detect_license_plate(self, image_source):
+        """Nhận diện biển số từ ảnh (đường dẫn, bytes hoặc mảng NumPy) trong một worker process"""
+        return self._submit('detect_license_plate', (image_source,), lambda result: result)
+    
+    def detect_license_plates_batch(self, image_sources):
+        """Nhận diện biển số cho nhiều ảnh trong một worker process"""
+        return self._submit(
+            'detect_license_plates_batch', (image_sources,),
+            lambda error_result: [dict(error_result) for _ in image_sources]
+        )
+    
+    def _submit(self, method, args, wrap_error):
+        """Gửi job vào pool và chờ kết quả"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            return wrap_error({
+                'success': False,
+                'error': 'Hàng đợi OCR đã đầy, vui lòng thử lại sau',
+                'license_plates': []
+            })
+        
+        submitted_at = time.time()
+        with self._lock:
+            self._in_flight += 1
+        
+        try:
+            future = self._executor.submit(_run_job, method, args)
+            # Slot chỉ được trả khi job thực sự kết thúc: job quá hạn vẫn chiếm worker nên vẫn tính vào giới hạn
+            future.add_done_callback(self._release_slot)
+        except Exception as e:
+            self._release_slot()
+            with self._lock:
+                self._failed += 1
+            return wrap_error({
+                'success': False,
+                'error': f'Lỗi worker OCR: {str(e)}',
+                'license_plates': []
+            })
+        
+        try:
+            result, started_at, finished_at = future.result(timeout=self.job_timeout)
+            
+            wait_ms = max(0.0, (started_at - submitted_at) * 1000)
+            with self._lock:
+                self._completed += 1
+                self._busy_seconds += finished_at - started_at
+                self._total_wait_ms += wait_ms
+                self._max_wait_ms = max(self._max_wait_ms, wait_ms)
+                self._last_wait_ms = wait_ms
+            
+            if isinstance(result, dict):
+                result['queue_wait_ms'] = round(wait_ms, 2)
+            return result
+            
+        except Exception as e:
+            # Job còn nằm trong hàng đợi thì huỷ luôn (slot được trả ngay qua callback)
+            future.cancel()
+            with self._lock:
+                self._failed += 1
+            return wrap_error({
+                'success': False,
+                'error': f'Lỗi worker OCR: {str(e) or type(e).__name__}',
+                'license_plates': []
+            })
+    
+    def _release_slot(self, future=None):
+        """Trả slot hàng đợi khi job kết thúc (xong, lỗi hoặc bị huỷ)"""
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+    
+    def get_stats(self):
+        """Thống kê hàng đợi, mức sử dụng worker và thời gian chờ"""
+        with self._lock:
+            elapsed = max(time.time() - self._started_at, 1e-6)
+            return {
+                'mode': 'process_pool',
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'in_flight': self._in_flight,
+                'queue_depth': max(0, self._in_flight - self.workers),
+                'busy_workers': min(self._in_flight, self.workers),
+                'utilization': round(min(1.0, self._busy_seconds / (elapsed * self.workers)), 4),
+                'completed_jobs': self._completed,
+                'rejected_jobs': self._rejected,
+                'failed_jobs': self._failed,
+                'wait_ms': {
+                    'avg': round(self._total_wait_ms / self._completed, 2) if self._completed else 0.0,
+                    'max': round(self._max_wait_ms, 2),
+                    'last': round(self._last_wait_ms, 2)
+                }
+            }
+    
+    def shutdown(self):
+        """Dừng các worker process"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,236 @@
+import re
+import threading
+import time
+from collections import defaultdict
+
+# Cặp ký tự OCR hay nhầm lẫn -> chi phí thay thế thấp hơn
+_CONFUSION_PAIRS = [
+    ('0', 'O'), ('0', 'D'), ('0', 'Q'), ('O', 'D'), ('O', 'Q'),
+    ('1', 'I'), ('1', 'L'), ('1', 'T'), ('7', 'T'),
+    ('2', 'Z'), ('4', 'A'), ('5', 'S'), ('6', 'G'), ('8', 'B'), ('3', 'B')
+]
+CONFUSION_COST = 0.5
+
+_CONFUSIONS = frozenset(_CONFUSION_PAIRS) | frozenset((b, a) for a, b in _CONFUSION_PAIRS)
+_SEPARATOR_PATTERN = re.compile(r'[^A-Z0-9]')
+
+
+def _build_canonical_table():
+    """Gộp các ký tự dễ nhầm (theo bao đóng bắc cầu) về một ký tự đại diện"""
+    groups = {}
+    for a, b in _CONFUSION_PAIRS:
+        merged = groups.get(a, {a}) | groups.get(b, {b})
+        for char in merged:
+            groups[char] = merged
+    return str.maketrans({char: min(group) for char, group in groups.items()})
+
+
+_CANONICAL = _build_canonical_table()
+
+
+def normalize_plate_key(plate):
+    """Khoá so sánh: viết hoa, bỏ dấu phân cách"""
+    return _SEPARATOR_PATTERN.sub('', (plate or '').upper())
+
+
+def confusion_distance(a, b):
+    """Khoảng cách Levenshtein có trọng số: thay ký tự dễ nhầm tốn 0.5, các thao tác khác tốn 1"""
+    if a == b:
+        return 0.0
+    if not a:
+        return float(len(b))
+    if not b:
+        return float(len(a))
+    
+    previous = [float(j) for j in range(len(b) + 1)]
+    for i, char_a in enumerate(a, 1):
+        current = [float(i)]
+        for j, char_b in enumerate(b, 1):
+            if char_a == char_b:
+                substitution = previous[j - 1]
+            elif (char_a, char_b) in _CONFUSIONS:
+                substitution = previous[j - 1] + CONFUSION_COST
+            else:
+                substitution = previous[j - 1] + 1.0
+            current.append(min(previous[j] + 1.0, current[j - 1] + 1.0, substitution))
+        previous = current
+    return previous[-1]
+
+
+def _distance_within_one(a, b):
+    """confusion_distance(a, b) nếu <= 1, ngược lại None (nhanh hơn quy hoạch động)
+    
+    Cùng độ dài: chỉ có thể là các phép thay (thêm + xoá đã tốn 2).
+    Lệch một ký tự: đúng một phép thêm/xoá và phần còn lại phải trùng khớp.
+    """
+    if len(a) == len(b):
+        distance = 0.0
+        for char_a, char_b in zip(a, b):
+            if char_a != char_b:
+                distance += CONFUSION_COST if (char_a, char_b) in _CONFUSIONS else 1.0
+                if distance > 1.0:
+                    return None
+        return distance
+    
+    if len(a) < len(b):
+        a, b = b, a
+    if len(a) - len(b) != 1:
+        return None
+    for position in range(len(b)):
+        if a[position] != b[position]:
+            return 1.0 if a[position + 1:] == b[position:] else None
+    return 1.0
+
+
+class PlateIndex:
+    """Chỉ mục biển số đã đăng ký, tìm biển gần nhất khi OCR đọc sai ký tự
+    
+    Khoá được chuẩn hoá về ký tự đại diện của nhóm dễ nhầm, nên nhầm ký tự không
+    làm đổi khoá. Mỗi khoá chuẩn hoá độ dài n được lưu theo nửa đầu (n // 2 ký tự)
+    và nửa sau: hai chuỗi cách nhau tối đa một thao tác sửa thì trùng ít nhất một
+    nửa, nên chỉ cần tra vài bucket nhỏ rồi tính confusion_distance cho ứng viên.
+    
+    Chỉ mục nằm trong từng process: add/remove chỉ có tác dụng ở worker xử lý
+    request ghi, nên chỉ mục được dựng lại từ DB sau mỗi refresh_interval giây
+    (refresh_if_stale) để các worker khác cũng thấy xe mới.
+    """
+    
+    # Chia đôi khoá chỉ đảm bảo tìm đủ khi có tối đa một lỗi không phải nhầm ký tự
+    MAX_DISTANCE = 1.0
+    
+    def __init__(self, refresh_interval=60):
+        self._lock = threading.RLock()
+        self._plates = {}  # khoá -> biển số gốc
+        self._buckets = defaultdict(set)  # (độ dài, nửa đầu/nửa sau) -> các khoá
+        self.loaded = False
+        self.refresh_interval = refresh_interval
+        self._built_monotonic = 0.0
+        self._refresh_lock = threading.Lock()
+        self.refreshes = 0
+    
+    def configure(self, refresh_interval=None):
+        if refresh_interval is not None:
+            self.refresh_interval = refresh_interval
+    
+    def is_stale(self):
+        """Chưa nạp, hoặc đã dựng quá refresh_interval giây (0 = không tự dựng lại)"""
+        if not self.loaded:
+            return True
+        return bool(self.refresh_interval) and time.monotonic() - self._built_monotonic >= self.refresh_interval
+    
+    def refresh_if_stale(self, loader):
+        """Dựng lại từ loader() (danh sách biển số) nếu chỉ mục đã cũ
+        
+        Chỉ một request dựng lại; nếu đã có chỉ mục cũ thì request khác dùng tạm
+        thay vì chờ.
+        """
+        if not self.is_stale():
+            return False
+        if not self._refresh_lock.acquire(blocking=not self.loaded):
+            return False
+        try:
+            if not self.is_stale():
+                return False
+            self.build(loader())
+            return True
+        finally:
+            self._refresh_lock.release()
+    
+    @staticmethod
+    def _segments(canonical):
+        """Bucket của một khoá đã chuẩn hoá"""
+        length = len(canonical)
+        half = length // 2
+        return (length, 'P', canonical[:half]), (length, 'S', canonical[half:])
+    
+    def build(self, plates):
+        """Dựng lại toàn bộ chỉ mục từ danh sách biển số"""
+        with self._lock:
+            self._plates = {}
+            self._buckets = defaultdict(set)
+            for plate in plates:
+                self._insert(plate)
+            self.loaded = True
+            self._built_monotonic = time.monotonic()
+            self.refreshes += 1
+    
+    def add(self, plate):
+        """Thêm (hoặc cập nhật) một biển số"""
+        with self._lock:
+            self._insert(plate)
+    
+    def remove(self, plate):
+        """Xoá biển số khỏi chỉ mục"""
+        key = normalize_plate_key(plate)
+        with self._lock:
+            if self._plates.pop(key, None) is None:
+                return
+            for segment in self._segments(key.translate(_CANONICAL)):
+                bucket = self._buckets[segment]
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[segment]
+    
+    def _insert(self, plate):
+        key = normalize_plate_key(plate)
+        if not key:
+            return
+        
+        self._plates[key] = plate
+        for segment in self._segments(key.translate(_CANONICAL)):
+            self._buckets[segment].add(key)
+    
+    def search(self, plate, max_distance=1.0, limit=3):
+        """Tìm tối đa limit biển số có khoảng cách <= max_distance, gần nhất trước
+        
+        Trả về danh sách {'license_plate', 'distance'}.
+        """
+        key = normalize_plate_key(plate)
+        if not key:
+            return []
+        
+        max_distance = min(max_distance, self.MAX_DISTANCE)
+        canonical = key.translate(_CANONICAL)
+        
+        with self._lock:
+            candidates = set()
+            for length in (len(canonical) - 1, len(canonical), len(canonical) + 1):
+                if length <= 0:
+                    continue
+                half = length // 2
+                # Lỗi ở nửa sau -> nửa đầu trùng; lỗi ở nửa đầu -> nửa sau trùng
+                for segment in ((length, 'P', canonical[:half]),
+                                (length, 'S', canonical[len(canonical) - (length - half):])):
+                    bucket = self._buckets.get(segment)
+                    if bucket:
+                        candidates |= bucket
+            
+            matches = []
+            for candidate in candidates:
+                distance = _distance_within_one(key, candidate)
+                if distance is not None and distance <= max_distance:
+                    matches.append((distance, candidate))
+            
+            matches.sort()
+            return [
+                {'license_plate': self._plates[candidate], 'distance': distance}
+                for distance, candidate in matches[:limit]
+            ]
+    
+    def get_stats(self):
+        """Số biển số và số bucket trong chỉ mục"""
+        with self._lock:
+            return {
+                'plates': len(self._plates),
+                'buckets': len(self._buckets),
+                'loaded': self.loaded,
+                'refresh_interval': self.refresh_interval,
+                'refreshes': self.refreshes
+            }
+    
+    def __len__(self):
+        return len(self._plates)
+
+
+# Chỉ mục dùng chung trong process, nạp khi khởi động app
+plate_index = PlateIndex()
@@ -0,0 +1,212 @@
+"""
+Profiling theo request (opt-in, PROFILING_ENABLED)
+
+- Thời gian từng bước của request (tiền xử lý / OCR theo phiên bản ảnh, từng câu
+  lệnh SQL, method service) được gom từ các histogram metrics sẵn có và trả về
+  trong debug_info của response quét.
+- cProfile chạy cho PROFILING_SAMPLE_RATE phần request; kết quả pstats (.prof và
+  bản text top hàm theo cumulative time) ghi vào LOG_FOLDER/profiles.
+- Request chậm hơn PROFILING_SLOW_MS luôn được ghi lại (.json thời gian từng bước,
+  kèm .prof nếu request đó đang chạy cProfile).
+"""
+import contextvars
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from datetime import datetime
+
+from .image_processor import OCR_STAGE_SECONDS
+from .metrics import DB_QUERY_SECONDS, SERVICE_SECONDS, metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DUMPS = metrics.counter('etc_profile_dumps_total', 'Số lần ghi profile request theo lý do', ('reason',))
+
+_current_profile = contextvars.ContextVar('request_profile', default=None)
+
+
+class RequestProfile:
+    """Thời gian các bước của một request"""
+    
+    def __init__(self, max_events=200):
+        self.started = time.perf_counter()
+        self.max_events = max_events
+        self.events = []
+        self.dropped_events = 0
+        # (loại, bước, biến thể) -> [số lần, tổng ms, lâu nhất ms]
+        self.totals = {}
+        self.profiler = None
+    
+    def record(self, category, stage, variant, seconds):
+        ms = seconds * 1000
+        key = (category, stage, variant)
+        total = self.totals.get(key)
+        if total is None:
+            total = self.totals[key] = [0, 0.0, 0.0]
+        total[0] += 1
+        total[1] += ms
+        total[2] = max(total[2], ms)
+        
+        if len(self.events) < self.max_events:
+            self.events.append({
+                'category': category,
+                'stage': stage,
+                'variant': variant,
+                'ms': round(ms, 3),
+                'at_ms': round((time.perf_counter() - self.started) * 1000 - ms, 3)
+            })
+        else:
+            self.dropped_events += 1
+    
+    def elapsed_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+    
+    def summary(self):
+        """Tổng hợp theo bước (lâu nhất trước) và danh sách từng lần gọi theo thời gian"""
+        stages = [
+            {
+                'category': category,
+                'stage': stage,
+                'variant': variant,
+                'count': count,
+                'total_ms': round(total_ms, 3),
+                'max_ms': round(max_ms, 3)
+            }
+            for (category, stage, variant), (count, total_ms, max_ms) in self.totals.items()
+        ]
+        stages.sort(key=lambda item: item['total_ms'], reverse=True)
+        return {
+            'elapsed_ms': round(self.elapsed_ms(), 3),
+            'stages': stages,
+            'events': list(self.events),
+            'dropped_events': self.dropped_events,
+            'cprofile': self.profiler is not None
+        }
+
+
+def current_profile_summary():
+    """Timing của request hiện tại, None nếu request không được profile"""
+    profile = _current_profile.get()
+    return profile.summary() if profile is not None else None
+
+
+def _listener(category, stage_label, variant_label=None):
+    def listener(value, labels):
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.record(
+                category, labels.get(stage_label, ''), labels.get(variant_label, '') if variant_label else '', value
+            )
+    return listener
+
+
+_listeners_installed = False
+_listeners_lock = threading.Lock()
+
+
+def _install_listeners():
+    """Cho các histogram đo thời gian từng bước ghi vào profile của request đang chạy (một lần)"""
+    global _listeners_installed
+    with _listeners_lock:
+        if _listeners_installed:
+            return
+        OCR_STAGE_SECONDS.add_listener(_listener('ocr', 'stage', 'variant'))
+        DB_QUERY_SECONDS.add_listener(_listener('db', 'operation'))
+        SERVICE_SECONDS.add_listener(_listener('service', 'method', 'service'))
+        _listeners_installed = True
+
+
+class RequestProfiler:
+    """Bật profile cho từng request, lấy mẫu cProfile và ghi file cho request chậm
+    
+    Mỗi thời điểm chỉ một request chạy cProfile; request được chọn mẫu khi đã có
+    request khác đang chạy cProfile thì chỉ đo thời gian từng bước.
+    """
+    
+    def __init__(self, profile_folder, sample_rate=0.01, slow_ms=2000, max_events=200):
+        self.profile_folder = profile_folder
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.max_events = max_events
+        # Chỉ đăng ký hook khi bật profiling, tắt thì histogram không phải gọi listener
+        _install_listeners()
+        
+        self._cprofile_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.sampled = 0
+        self.slow_requests = 0
+    
+    def start(self):
+        """Bắt đầu profile request hiện tại, trả về (profile, token) để truyền cho finish"""
+        profile = RequestProfile(self.max_events)
+        if self.sample_rate > 0 and random.random() < self.sample_rate and self._cprofile_lock.acquire(blocking=False):
+            profile.profiler = cProfile.Profile()
+            profile.profiler.enable()
+        
+        return profile, _current_profile.set(profile)
+    
+    def finish(self, profile, token, label):
+        """Kết thúc profile, ghi file nếu request được lấy mẫu hoặc chậm"""
+        if profile.profiler is not None:
+            profile.profiler.disable()
+        _current_profile.reset(token)
+        
+        try:
+            elapsed_ms = profile.elapsed_ms()
+            slow = bool(self.slow_ms) and elapsed_ms >= self.slow_ms
+            with self._stats_lock:
+                self.requests += 1
+                self.sampled += profile.profiler is not None
+                self.slow_requests += slow
+            
+            if slow or profile.profiler is not None:
+                self._dump(profile, label, elapsed_ms, slow)
+        except Exception as e:
+            logger.error(f"Không thể ghi profile request {label}: {e}")
+        finally:
+            if profile.profiler is not None:
+                self._cprofile_lock.release()
+    
+    def _dump(self, profile, label, elapsed_ms, slow):
+        os.makedirs(self.profile_folder, exist_ok=True)
+        safe_label = re.sub(r'[^A-Za-z0-9]+', '_', label).strip('_')[:80]
+        base_path = os.path.join(
+            self.profile_folder, f"{datetime.now():%Y%m%d_%H%M%S_%f}_{safe_label}_{int(elapsed_ms)}ms"
+        )
+        
+        summary = profile.summary()
+        summary.update({'request': label, 'slow': slow})
+        with open(f'{base_path}.json', 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        
+        if profile.profiler is not None:
+            profile.profiler.dump_stats(f'{base_path}.prof')
+            report = io.StringIO()
+            pstats.Stats(profile.profiler, stream=report).sort_stats('cumulative').print_stats(40)
+            with open(f'{base_path}.txt', 'w', encoding='utf-8') as f:
+                f.write(report.getvalue())
+            PROFILE_DUMPS.inc(reason='sampled')
+        
+        if slow:
+            PROFILE_DUMPS.inc(reason='slow')
+            top = ', '.join(f"{s['stage']}={s['total_ms']:.0f}ms" for s in summary['stages'][:3])
+            logger.warning(f"Request chậm {label}: {elapsed_ms:.0f}ms ({top}), profile: {base_path}.json")
+    
+    def get_stats(self):
+        with self._stats_lock:
+            return {
+                'sample_rate': self.sample_rate,
+                'slow_ms': self.slow_ms,
+                'profile_folder': self.profile_folder,
+                'requests': self.requests,
+                'sampled': self.sampled,
+                'slow_requests': self.slow_requests
+            }
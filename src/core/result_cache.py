@@ -0,0 +1,107 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import cv2
+    import numpy as np
+    CV2_AVAILABLE = True
+except ImportError:
+    CV2_AVAILABLE = False
+
+
+def dhash(image, hash_size=16):
+    """Tính difference hash (dHash) của ảnh, trả về số nguyên hash_size*hash_size bit"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    resized = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    diff = resized[:, 1:] > resized[:, :-1]
+    return int.from_bytes(np.packbits(diff.flatten()).tobytes(), 'big')
+
+
+def hamming_distance(hash_a, hash_b):
+    """Số bit khác nhau giữa hai hash"""
+    return bin(hash_a ^ hash_b).count('1')
+
+
+class PerceptualHashCache:
+    """Cache kết quả nhận diện theo perceptual hash của ảnh
+    
+    Ảnh giống hệt hoặc gần giống (khoảng cách Hamming <= max_distance) dùng lại
+    kết quả đã có. Giới hạn số phần tử (LRU) và thời gian sống (TTL).
+    """
+    
+    def __init__(self, max_size=256, ttl_seconds=10, max_distance=2, hash_size=16):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        
+        self._entries = OrderedDict()  # hash -> (thời điểm lưu, kết quả)
+        self._lock = threading.Lock()
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def compute_hash(self, image):
+        """Hash của ảnh đã decode"""
+        return dhash(image, self.hash_size)
+    
+    def get(self, image_hash):
+        """Tìm kết quả gần nhất trong ngưỡng Hamming, trả về (kết quả, khoảng cách) hoặc (None, None)"""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            
+            best_hash, best_distance = None, None
+            if image_hash in self._entries:
+                best_hash, best_distance = image_hash, 0
+            else:
+                for cached_hash in self._entries:
+                    distance = hamming_distance(image_hash, cached_hash)
+                    if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                        best_hash, best_distance = cached_hash, distance
+            
+            if best_hash is None:
+                self.misses += 1
+                return None, None
+            
+            self.hits += 1
+            self._entries.move_to_end(best_hash)
+            return copy.deepcopy(self._entries[best_hash][1]), best_distance
+    
+    def put(self, image_hash, result):
+        """Lưu kết quả cho hash, loại bỏ phần tử cũ nhất khi đầy"""
+        with self._lock:
+            self._entries[image_hash] = (time.monotonic(), copy.deepcopy(result))
+            self._entries.move_to_end(image_hash)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def _evict_expired(self, now):
+        """Loại bỏ các phần tử đã hết thời gian sống"""
+        expired = [h for h, (stored_at, _) in self._entries.items() if now - stored_at > self.ttl_seconds]
+        for h in expired:
+            del self._entries[h]
+            self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def get_stats(self):
+        """Thống kê hit/miss của cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl_seconds': self.ttl_seconds,
+                'max_distance': self.max_distance,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,258 @@
+"""
+Lưu trữ (retention) lịch sử quét và giao dịch cũ sang bảng archive theo tháng
+
+Bản ghi cũ hơn số ngày cấu hình được chuyển từ bảng chính sang bảng
+<bảng>_archive_YYYYMM theo từng lô nhỏ; mỗi lô là một DB transaction ngắn
+(INSERT vào archive + DELETE khỏi bảng chính) để không giữ khoá ghi lâu.
+Bảng archive vẫn truy vấn được bằng query_archive() cho mục đích kiểm toán.
+"""
+import logging
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import Column, Index, MetaData, Table, inspect, select
+
+from .models import db, Transaction, ScanHistory, vietnam_now
+
+logger = logging.getLogger(__name__)
+
+# Bảng được lưu trữ -> model (dùng lại to_dict khi đọc archive)
+ARCHIVED_MODELS = {
+    'scan_history': ScanHistory,
+    'transactions': Transaction
+}
+
+# Danh sách bảng archive được đọc lại từ database tối đa mỗi ARCHIVE_TABLES_REFRESH giây
+# (để thấy bảng do process khác tạo); bảng do process này tạo được thêm ngay
+ARCHIVE_TABLES_REFRESH = 60
+
+_archive_metadata = MetaData()
+# engine -> (tên các bảng archive đã có, thời điểm đọc)
+_archive_tables = {}
+_archive_lock = threading.Lock()
+
+
+def archive_table_name(table_name, month):
+    return f'{table_name}_archive_{month:%Y%m}'
+
+
+def _archive_table(table_name, month):
+    """Table của bảng archive tháng (cùng cột với bảng chính, không có khoá ngoại)"""
+    name = archive_table_name(table_name, month)
+    with _archive_lock:
+        table = _archive_metadata.tables.get(name)
+        if table is None:
+            source = ARCHIVED_MODELS[table_name].__table__
+            table = Table(
+                name, _archive_metadata,
+                *[Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+                  for column in source.columns],
+                Index(f'ix_{name}_vehicle_created', 'vehicle_id', 'created_at'),
+                Index(f'ix_{name}_created', 'created_at')
+            )
+        return table
+
+
+def _archive_table_names():
+    """Tên các bảng archive trong database (cache, không inspect mỗi lần đọc)"""
+    engine = db.engine
+    with _archive_lock:
+        cached = _archive_tables.get(engine)
+        if cached is None or time.monotonic() - cached[1] >= ARCHIVE_TABLES_REFRESH:
+            names = {name for name in inspect(engine).get_table_names() if '_archive_' in name}
+            cached = _archive_tables[engine] = (names, time.monotonic())
+        return set(cached[0])
+
+
+def _ensure_archive_table(table):
+    if table.name not in _archive_table_names():
+        table.create(bind=db.engine, checkfirst=True)
+        with _archive_lock:
+            cached = _archive_tables.get(db.engine)
+            if cached is not None:
+                cached[0].add(table.name)
+
+
+def list_archive_tables(table_name):
+    """Các bảng archive đã có của một bảng, [(tháng, tên bảng)] mới nhất trước"""
+    pattern = re.compile(rf'^{table_name}_archive_(\d{{4}})(\d{{2}})$')
+    tables = []
+    for name in _archive_table_names():
+        match = pattern.match(name)
+        if match:
+            tables.append((datetime(int(match.group(1)), int(match.group(2)), 1), name))
+    return sorted(tables, reverse=True)
+
+
+def archive_batch(table_name, cutoff, batch_size=500):
+    """Chuyển tối đa batch_size bản ghi cũ hơn cutoff sang archive, trả về số bản ghi đã chuyển"""
+    source = ARCHIVED_MODELS[table_name].__table__
+    rows = db.session.execute(
+        select(source)
+        .where(source.c.created_at < cutoff)
+        .order_by(source.c.created_at, source.c.id)
+        .limit(batch_size)
+    ).mappings().all()
+    if not rows:
+        db.session.rollback()
+        return 0
+    
+    by_month = {}
+    for row in rows:
+        month = row['created_at'].replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        by_month.setdefault(month, []).append(dict(row))
+    
+    # Tạo bảng archive trước khi ghi: DDL chạy trên kết nối riêng, không được chờ khoá của lô này
+    tables = {month: _archive_table(table_name, month) for month in by_month}
+    for table in tables.values():
+        _ensure_archive_table(table)
+    
+    try:
+        for month, month_rows in by_month.items():
+            db.session.execute(tables[month].insert(), month_rows)
+        db.session.execute(source.delete().where(source.c.id.in_([row['id'] for row in rows])))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    
+    return len(rows)
+
+
+def run_retention(config, max_batches=None):
+    """Chạy một lượt lưu trữ cho tất cả bảng, trả về {bảng: số bản ghi đã chuyển}
+    
+    Mỗi bảng chuyển tối đa max_batches lô (RETENTION_MAX_BATCHES), nghỉ
+    RETENTION_BATCH_PAUSE giây giữa các lô để nhường khoá ghi cho request.
+    """
+    batch_size = getattr(config, 'RETENTION_BATCH_SIZE', 500)
+    pause = getattr(config, 'RETENTION_BATCH_PAUSE', 0.05)
+    max_batches = max_batches or getattr(config, 'RETENTION_MAX_BATCHES', 20)
+    horizons = {
+        'scan_history': getattr(config, 'RETENTION_SCAN_HISTORY_DAYS', 90),
+        'transactions': getattr(config, 'RETENTION_TRANSACTIONS_DAYS', 365)
+    }
+    
+    report = {}
+    for table_name, days in horizons.items():
+        cutoff = vietnam_now() - timedelta(days=days)
+        archived = 0
+        for _ in range(max_batches):
+            count = archive_batch(table_name, cutoff, batch_size)
+            archived += count
+            if count < batch_size:
+                break
+            time.sleep(pause)
+        report[table_name] = archived
+        if archived:
+            logger.info(f"Đã lưu trữ {archived} bản ghi {table_name} cũ hơn {days} ngày")
+    return report
+
+
+def query_archive(table_name, start=None, end=None, vehicle_id=None, limit=100):
+    """Đọc bản ghi từ các bảng archive trong khoảng [start, end), mới nhất trước"""
+    model = ARCHIVED_MODELS[table_name]
+    first_month = start.replace(day=1, hour=0, minute=0, second=0, microsecond=0, tzinfo=None) if start else None
+    
+    records = []
+    for month, name in list_archive_tables(table_name):
+        if len(records) >= limit:
+            break
+        if first_month and month < first_month:
+            break
+        if end and month >= end.replace(tzinfo=None):
+            continue
+        
+        table = _archive_table(table_name, month)
+        query = select(table)
+        if start:
+            query = query.where(table.c.created_at >= start)
+        if end:
+            query = query.where(table.c.created_at < end)
+        if vehicle_id is not None:
+            query = query.where(table.c.vehicle_id == vehicle_id)
+        query = query.order_by(table.c.created_at.desc(), table.c.id.desc()).limit(limit - len(records))
+        
+        for row in db.session.execute(query).mappings():
+            record = model(**row).to_dict()
+            record['archive_table'] = name
+            records.append(record)
+    return records
+
+
+def archived_transaction_aggregates(vehicle_id=None):
+    """Tổng hợp giao dịch đã lưu trữ theo xe: {vehicle_id: (số giao dịch, tổng thu phí, tổng nạp, lần cuối)}"""
+    aggregates = {}
+    for month, name in list_archive_tables('transactions'):
+        table = _archive_table('transactions', month)
+        query = select(
+            table.c.vehicle_id,
+            db.func.count(table.c.id),
+            db.func.sum(db.case((table.c.transaction_type == 'toll', -table.c.amount), else_=0)),
+            db.func.sum(db.case((table.c.transaction_type == 'topup', table.c.amount), else_=0)),
+            db.func.max(table.c.created_at)
+        ).group_by(table.c.vehicle_id)
+        if vehicle_id is not None:
+            query = query.where(table.c.vehicle_id == vehicle_id)
+        
+        for row_vehicle_id, count, spent, topup, last_activity in db.session.execute(query):
+            aggregates[row_vehicle_id] = merge_aggregates(
+                aggregates.get(row_vehicle_id), (count, spent, topup, last_activity)
+            )
+    return aggregates
+
+
+def merge_aggregates(first, second):
+    """Cộng hai bộ (số giao dịch, tổng thu phí, tổng nạp, lần cuối)"""
+    if first is None:
+        return second
+    if second is None:
+        return first
+    last_activities = [value for value in (first[3], second[3]) if value]
+    return (
+        first[0] + second[0],
+        (first[1] or 0) + (second[1] or 0),
+        (first[2] or 0) + (second[2] or 0),
+        max(last_activities) if last_activities else None
+    )
+
+
+class RetentionWorker:
+    """Chạy run_retention định kỳ ở luồng nền"""
+    
+    def __init__(self, app, config, interval):
+        self.app = app
+        self.config = config
+        self.interval = interval
+        self.last_run = None
+        self.last_report = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='retention-worker', daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    self.last_report = run_retention(self.config)
+                    self.last_error = None
+                except Exception as e:
+                    self.last_error = str(e)
+                    logger.error(f"Lưu trữ lịch sử thất bại: {e}")
+                finally:
+                    db.session.remove()
+            self.last_run = vietnam_now()
+    
+    def stop(self):
+        self._stop.set()
+    
+    def get_stats(self):
+        return {
+            'interval': self.interval,
+            'last_run': self.last_run.isoformat() if self.last_run else None,
+            'last_report': self.last_report,
+            'last_error': self.last_error
+        }
@@ -0,0 +1,136 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from .services import ScanService, vietnam_now
+
+
+class ScanHistoryWriter:
+    """Ghi lịch sử quét kiểu write-behind: gom bản ghi và commit theo lô ở luồng nền
+    
+    Bản ghi được đưa vào hàng đợi có giới hạn; luồng ghi commit một lô khi đủ
+    batch_size bản ghi hoặc sau flush_interval giây. Khi hàng đợi đầy, bản ghi
+    được ghi đồng bộ thay vì bị bỏ. Hàng đợi được flush hết khi tắt app.
+    """
+    
+    def __init__(self, app, batch_size=50, flush_interval=0.5, max_queue=10000):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger(__name__)
+        
+        self.flushes = 0
+        self.flushed_records = 0
+        self.failed_records = 0
+        self.overflow_records = 0
+        self._total_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._last_flush_ms = 0.0
+        
+        self._thread = threading.Thread(target=self._run, name='scan-history-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+    
+    def submit(self, scan_data_list):
+        """Đưa bản ghi vào hàng đợi (thời điểm quét được giữ nguyên)"""
+        for scan_data in scan_data_list:
+            scan_data = dict(scan_data)
+            scan_data.setdefault('created_at', vietnam_now())
+            try:
+                self._queue.put_nowait(scan_data)
+            except queue.Full:
+                # Hàng đợi đầy -> ghi đồng bộ, không làm mất lịch sử quét
+                with self._lock:
+                    self.overflow_records += 1
+                self._write([scan_data])
+    
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._collect_batch()
+            if batch:
+                self._write(batch)
+    
+    def _collect_batch(self):
+        """Chờ bản ghi đầu tiên rồi gom thêm đến khi đủ lô hoặc hết thời gian"""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+    
+    def _write(self, batch):
+        """Commit một lô bản ghi"""
+        start = time.perf_counter()
+        with self.app.app_context():
+            _, error = ScanService.record_scans(batch)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        
+        with self._lock:
+            self.flushes += 1
+            self._total_flush_ms += elapsed_ms
+            self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+            self._last_flush_ms = elapsed_ms
+            if error:
+                self.failed_records += len(batch)
+            else:
+                self.flushed_records += len(batch)
+        
+        if error:
+            self._logger.error(f"Không thể ghi {len(batch)} lịch sử quét: {error}")
+    
+    def flush(self):
+        """Ghi ngay toàn bộ bản ghi đang chờ"""
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._write(batch)
+    
+    def shutdown(self):
+        """Dừng luồng ghi và flush phần còn lại"""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join(timeout=self.flush_interval * 2 + 5)
+        self.flush()
+    
+    def get_stats(self):
+        """Độ sâu hàng đợi và thời gian flush"""
+        with self._lock:
+            return {
+                'mode': 'write_behind',
+                'queue_depth': self._queue.qsize(),
+                'max_queue': self._queue.maxsize,
+                'batch_size': self.batch_size,
+                'flush_interval': self.flush_interval,
+                'flushes': self.flushes,
+                'flushed_records': self.flushed_records,
+                'failed_records': self.failed_records,
+                'overflow_records': self.overflow_records,
+                'flush_ms': {
+                    'avg': round(self._total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+                    'max': round(self._max_flush_ms, 2),
+                    'last': round(self._last_flush_ms, 2)
+                }
+            }
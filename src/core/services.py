@@ -1,7 +1,20 @@
+import base64
+import json
+import time
+from collections import namedtuple
 from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import and_, bindparam, or_, text, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import IntegrityError
 import pytz
-from ..core.models import db, Vehicle, Transaction, ScanHistory
+from ..core.models import db, Vehicle, Transaction, ScanHistory, VehicleStatistics
+from ..core.metrics import instrument_service
+from ..core.plate_index import plate_index
+from ..core.retention import archived_transaction_aggregates, merge_aggregates, query_archive
+from ..core.storage import is_lock_error
+from ..core.system_stats import system_stats
+from ..core.vehicle_cache import vehicle_cache
 
 VN_TZ = pytz.timezone('Asia/Ho_Chi_Minh')
 
@@ -9,35 +22,127 @@ def vietnam_now():
     """Trả về thời gian hiện tại theo múi giờ Việt Nam"""
     return datetime.now(VN_TZ)
 
+def to_dong(amount):
+    """Chuyển số tiền về số nguyên đồng, ValueError nếu có phần lẻ"""
+    if isinstance(amount, bool):
+        raise ValueError("Số tiền không hợp lệ")
+    try:
+        value = Decimal(str(amount))
+    except InvalidOperation:
+        raise ValueError("Số tiền không hợp lệ")
+    if not value.is_finite() or value != value.to_integral_value():
+        raise ValueError("Số tiền phải là số nguyên đồng")
+    return int(value)
 
+# Một trang phân trang keyset: next_cursor là None khi hết dữ liệu, total chỉ có khi được yêu cầu
+KeysetPage = namedtuple('KeysetPage', 'items next_cursor has_more per_page total')
+
+def encode_cursor(values):
+    """Mã hoá giá trị khoá sắp xếp của bản ghi cuối trang thành cursor"""
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, columns):
+    """Giải mã cursor theo kiểu của các cột sắp xếp, ValueError nếu cursor không hợp lệ"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(payload, list) or len(payload) != len(columns):
+            raise ValueError
+        return [
+            datetime.fromisoformat(value) if column.type.python_type is datetime else column.type.python_type(value)
+            for column, value in zip(columns, payload)
+        ]
+    except (TypeError, ValueError, UnicodeDecodeError, json.JSONDecodeError, NotImplementedError):
+        raise ValueError("Cursor không hợp lệ")
+
+def keyset_paginate(query, columns, cursor=None, per_page=20, include_total=False, descending=True):
+    """Phân trang keyset theo các cột columns (cột cuối phải duy nhất, ví dụ id)
+    
+    Thay OFFSET bằng điều kiện "sau bản ghi cuối trang trước" nên trang N tốn như
+    trang 1; COUNT chỉ chạy khi include_total. ValueError nếu per_page < 1 hoặc cursor sai.
+    """
+    if per_page < 1:
+        raise ValueError("per_page phải lớn hơn 0")
+    
+    total = query.order_by(None).count() if include_total else None
+    
+    if cursor:
+        values = decode_cursor(cursor, columns)
+        conditions = []
+        for position, (column, value) in enumerate(zip(columns, values)):
+            equal_prefix = [columns[i] == values[i] for i in range(position)]
+            conditions.append(and_(*equal_prefix, column < value if descending else column > value))
+        query = query.filter(or_(*conditions))
+    
+    query = query.order_by(*[column.desc() if descending else column.asc() for column in columns])
+    items = query.limit(per_page + 1).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_cursor([getattr(items[-1], column.key) for column in columns])
+    return KeysetPage(items=items, next_cursor=next_cursor, has_more=has_more, per_page=per_page, total=total)
+
+
+@instrument_service
 class VehicleService:
     """Service xử lý thông tin xe"""
     
     @staticmethod
     def get_vehicle_by_plate(license_plate):
         """Lấy thông tin xe theo biển số"""
-        return Vehicle.query.filter_by(license_plate=license_plate.upper()).first()
+        return Vehicle.query.filter_by(license_plate=vehicle_cache.normalize_key(license_plate)).first()
+    
+    @staticmethod
+    def get_vehicle_info(license_plate):
+        """Lấy thông tin xe (dict) qua cache, None nếu biển số chưa đăng ký"""
+        # Chuẩn hoá một lần: khoá cache và truy vấn DB phải cùng một biển số
+        license_plate = vehicle_cache.normalize_key(license_plate)
+        
+        def load():
+            vehicle = VehicleService.get_vehicle_by_plate(license_plate)
+            return vehicle.to_dict() if vehicle else None
+        
+        return vehicle_cache.get_or_load(license_plate, load)
+    
+    @staticmethod
+    def _registered_plates():
+        return [plate for (plate,) in db.session.query(Vehicle.license_plate)]
+    
+    @staticmethod
+    def load_plate_index():
+        """Nạp toàn bộ biển số đã đăng ký vào chỉ mục tìm kiếm gần đúng"""
+        plate_index.build(VehicleService._registered_plates())
+        return len(plate_index)
+    
+    @staticmethod
+    def find_similar_plates(license_plate, max_distance=1.0, limit=3):
+        """Tìm các biển số đã đăng ký gần với biển số OCR đọc được (chịu lỗi nhầm ký tự)"""
+        # Dựng lại định kỳ để thấy xe được tạo ở worker process khác
+        plate_index.refresh_if_stale(VehicleService._registered_plates)
+        return plate_index.search(license_plate, max_distance=max_distance, limit=limit)
     
     @staticmethod
     def get_vehicle_detailed_info(license_plate):
         """Lấy thông tin chi tiết xe bao gồm lịch sử giao dịch gần đây"""
-        vehicle = Vehicle.query.filter_by(license_plate=license_plate.upper()).first()
-        if not vehicle:
+        vehicle_info = VehicleService.get_vehicle_info(license_plate)
+        if not vehicle_info:
             return None
-        
-        vehicle_info = vehicle.to_dict()
+        vehicle_id = vehicle_info['id']
+        account_balance = vehicle_info['account_balance']
         
         recent_transactions = Transaction.query.filter_by(
-            vehicle_id=vehicle.id
+            vehicle_id=vehicle_id
         ).order_by(Transaction.created_at.desc()).limit(5).all()
         
         vehicle_info['recent_transactions'] = [
             {
                 'id': t.id,
                 'type': t.transaction_type,
-                'amount': float(t.amount),
-                'balance_before': float(t.balance_before),
-                'balance_after': float(t.balance_after),
+                'amount': t.amount,
+                'balance_before': t.balance_before,
+                'balance_after': t.balance_after,
                 'toll_station': t.toll_station,
                 'date': t.created_at.strftime('%Y-%m-%d %H:%M:%S'),
                 'status': t.status,
@@ -62,31 +167,151 @@ class VehicleService:
             for s in recent_scans
         ]
         
-        # Thống kê
-        total_transactions = Transaction.query.filter_by(vehicle_id=vehicle.id).count()
-        total_spent_result = db.session.query(db.func.sum(Transaction.amount)).filter(
-            Transaction.vehicle_id == vehicle.id,
-            Transaction.transaction_type == 'toll'
-        ).scalar()
-        total_spent = abs(float(total_spent_result)) if total_spent_result else 0.0
-        
-        total_topup_result = db.session.query(db.func.sum(Transaction.amount)).filter(
-            Transaction.vehicle_id == vehicle.id,
-            Transaction.transaction_type == 'topup'
-        ).scalar()
-        total_topup = float(total_topup_result) if total_topup_result else 0.0
-        
-        vehicle_info['statistics'] = {
-            'total_transactions': total_transactions,
-            'total_spent': total_spent,
-            'total_topup': total_topup,
-            'current_balance': float(vehicle.account_balance),
-            'account_status': 'sufficient' if vehicle.account_balance >= 50000 else 'low' if vehicle.account_balance > 0 else 'empty',
-            'last_activity': recent_transactions[0].created_at.strftime('%Y-%m-%d %H:%M:%S') if recent_transactions else None
-        }
+        # Thống kê (đọc từ bảng thống kê được cập nhật cùng mỗi giao dịch)
+        statistics = VehicleService.get_vehicle_statistics(vehicle_id)
+        statistics.update({
+            'current_balance': account_balance,
+            'account_status': 'sufficient' if account_balance >= 50000 else 'low' if account_balance > 0 else 'empty'
+        })
+        vehicle_info['statistics'] = statistics
         
         return vehicle_info
     
+    @staticmethod
+    def get_vehicle_statistics(vehicle_id):
+        """Thống kê giao dịch của xe, tính từ lịch sử (không ghi) nếu chưa có bản ghi
+        
+        Bản ghi thống kê được tạo bởi giao dịch đầu tiên hoặc lệnh rebuild-vehicle-stats.
+        """
+        statistics = VehicleStatistics.query.get(vehicle_id)
+        if statistics is None:
+            statistics = VehicleService._compute_statistics(vehicle_id)
+        
+        return statistics.to_dict()
+    
+    @staticmethod
+    def _compute_statistics(vehicle_id):
+        """Tính thống kê từ toàn bộ lịch sử giao dịch của xe, kể cả đã lưu trữ (chưa add vào session)"""
+        hot = tuple(db.session.query(
+            db.func.count(Transaction.id),
+            db.func.sum(db.case((Transaction.transaction_type == 'toll', -Transaction.amount), else_=0)),
+            db.func.sum(db.case((Transaction.transaction_type == 'topup', Transaction.amount), else_=0)),
+            db.func.max(Transaction.created_at)
+        ).filter(Transaction.vehicle_id == vehicle_id).one())
+        total_transactions, total_spent, total_topup, last_activity = merge_aggregates(
+            hot, archived_transaction_aggregates(vehicle_id).get(vehicle_id)
+        )
+        
+        return VehicleStatistics(
+            vehicle_id=vehicle_id,
+            total_transactions=total_transactions,
+            total_spent=int(total_spent or 0),
+            total_topup=int(total_topup or 0),
+            last_activity=last_activity
+        )
+    
+    @staticmethod
+    def _apply_transaction_statistics(*transactions):
+        """Cộng các giao dịch vào thống kê của xe trong cùng DB transaction (chưa commit)
+        
+        Dùng UPDATE cộng dồn trong SQL để hai giao dịch đồng thời không ghi đè nhau;
+        mỗi xe chỉ một câu UPDATE dù có nhiều giao dịch. Xe chưa có bản ghi thống kê
+        được tạo bằng upsert để giao dịch đồng thời không bị lỗi trùng khoá chính.
+        """
+        # Flush để giao dịch có created_at và được tính nếu phải tính lại từ lịch sử
+        db.session.flush()
+        
+        deltas = {}
+        for transaction in transactions:
+            count, spent, topup, last_activity = deltas.get(transaction.vehicle_id, (0, 0, 0, None))
+            deltas[transaction.vehicle_id] = (
+                count + 1,
+                spent + (-transaction.amount if transaction.transaction_type == 'toll' else 0),
+                topup + (transaction.amount if transaction.transaction_type == 'topup' else 0),
+                max(last_activity, transaction.created_at) if last_activity else transaction.created_at
+            )
+        
+        for vehicle_id, (count, spent, topup, last_activity) in deltas.items():
+            updated = VehicleStatistics.query.filter_by(vehicle_id=vehicle_id).update({
+                VehicleStatistics.total_transactions: VehicleStatistics.total_transactions + count,
+                VehicleStatistics.total_spent: VehicleStatistics.total_spent + spent,
+                VehicleStatistics.total_topup: VehicleStatistics.total_topup + topup,
+                VehicleStatistics.last_activity: last_activity,
+                VehicleStatistics.updated_at: vietnam_now()
+            }, synchronize_session=False)
+            
+            if not updated:
+                VehicleService._insert_statistics(VehicleService._compute_statistics(vehicle_id), count, spent, topup)
+    
+    @staticmethod
+    def _insert_statistics(statistics, count, spent, topup):
+        """Tạo bản ghi thống kê; nếu giao dịch khác vừa tạo trước thì chỉ cộng phần của giao dịch này
+        
+        statistics đã gồm giao dịch hiện tại (tính sau flush), nên khi trùng khoá chỉ cần
+        cộng count / spent / topup như nhánh UPDATE.
+        """
+        dialect = {'sqlite': sqlite, 'postgresql': postgresql}.get(db.engine.dialect.name)
+        if dialect is None:
+            db.session.add(statistics)
+            return
+        
+        table = VehicleStatistics.__table__
+        statement = dialect.insert(table).values(
+            vehicle_id=statistics.vehicle_id,
+            total_transactions=statistics.total_transactions,
+            total_spent=statistics.total_spent,
+            total_topup=statistics.total_topup,
+            last_activity=statistics.last_activity,
+            updated_at=vietnam_now()
+        )
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.vehicle_id],
+            set_={
+                'total_transactions': table.c.total_transactions + count,
+                'total_spent': table.c.total_spent + spent,
+                'total_topup': table.c.total_topup + topup,
+                'last_activity': statement.excluded.last_activity,
+                'updated_at': statement.excluded.updated_at
+            }
+        ))
+    
+    @staticmethod
+    def rebuild_statistics():
+        """Tính lại thống kê cho tất cả xe từ lịch sử giao dịch và bảng archive (backfill), trả về số xe"""
+        try:
+            aggregates = archived_transaction_aggregates()
+            hot_aggregates = {
+                vehicle_id: (count, spent, topup, last_activity)
+                for vehicle_id, count, spent, topup, last_activity in db.session.query(
+                    Transaction.vehicle_id,
+                    db.func.count(Transaction.id),
+                    db.func.sum(db.case((Transaction.transaction_type == 'toll', -Transaction.amount), else_=0)),
+                    db.func.sum(db.case((Transaction.transaction_type == 'topup', Transaction.amount), else_=0)),
+                    db.func.max(Transaction.created_at)
+                ).group_by(Transaction.vehicle_id)
+            }
+            for vehicle_id, hot in hot_aggregates.items():
+                aggregates[vehicle_id] = merge_aggregates(aggregates.get(vehicle_id), hot)
+            
+            VehicleStatistics.query.delete()
+            vehicle_ids = [vehicle_id for (vehicle_id,) in db.session.query(Vehicle.id)]
+            for vehicle_id in vehicle_ids:
+                count, spent, topup, last_activity = aggregates.get(vehicle_id, (0, 0, 0, None))
+                db.session.add(VehicleStatistics(
+                    vehicle_id=vehicle_id,
+                    total_transactions=count,
+                    total_spent=int(spent or 0),
+                    total_topup=int(topup or 0),
+                    last_activity=last_activity
+                ))
+            
+            db.session.commit()
+            return len(vehicle_ids), None
+            
+        except Exception as e:
+            db.session.rollback()
+            return None, str(e)
+    
     @staticmethod
     def get_vehicle_by_id(vehicle_id):
         """Lấy thông tin xe theo ID"""
@@ -97,7 +322,7 @@ class VehicleService:
         """Tạo xe mới"""
         try:
             vehicle = Vehicle(
-                license_plate=vehicle_data['license_plate'].upper(),
+                license_plate=vehicle_cache.normalize_key(vehicle_data['license_plate']),
                 owner_name=vehicle_data['owner_name'],
                 owner_phone=vehicle_data.get('owner_phone'),
                 vehicle_type=vehicle_data.get('vehicle_type'),
@@ -105,16 +330,23 @@ class VehicleService:
                 model=vehicle_data.get('model'),
                 color=vehicle_data.get('color'),
                 year=vehicle_data.get('year'),
-                account_balance=vehicle_data.get('account_balance', 0.0)
+                account_balance=to_dong(vehicle_data.get('account_balance') or 0)
             )
             
             db.session.add(vehicle)
+            db.session.add(VehicleStatistics(vehicle=vehicle))
             db.session.commit()
+            plate_index.add(vehicle.license_plate)
+            # Xoá kết quả "chưa đăng ký" đã cache cho biển số này
+            vehicle_cache.invalidate(vehicle.license_plate)
             return vehicle, None
             
         except IntegrityError:
             db.session.rollback()
             return None, "Biển số xe đã tồn tại trong hệ thống"
+        except ValueError as e:
+            db.session.rollback()
+            return None, str(e)
         except Exception as e:
             db.session.rollback()
             return None, str(e)
@@ -134,6 +366,8 @@ class VehicleService:
             
             vehicle.updated_at = vietnam_now()
             db.session.commit()
+            plate_index.add(vehicle.license_plate)
+            vehicle_cache.invalidate(vehicle.license_plate)
             return vehicle, None
             
         except Exception as e:
@@ -146,54 +380,96 @@ class VehicleService:
         return Vehicle.query.paginate(
             page=page, per_page=per_page, error_out=False
         )
+    
+    @staticmethod
+    def get_vehicles_by_cursor(cursor=None, per_page=20, include_total=False):
+        """Lấy danh sách xe phân trang keyset theo id, ValueError nếu cursor không hợp lệ"""
+        return keyset_paginate(
+            Vehicle.query, [Vehicle.id], cursor, per_page, include_total, descending=False
+        )
 
 
+@instrument_service
 class AccountService:
     """Service xử lý tài khoản ETC"""
     
     @staticmethod
     def get_balance(license_plate):
         """Lấy số dư tài khoản"""
-        vehicle = VehicleService.get_vehicle_by_plate(license_plate)
-        if not vehicle:
+        vehicle_info = VehicleService.get_vehicle_info(license_plate)
+        if not vehicle_info:
             return None, "Không tìm thấy xe"
         
         return {
-            'license_plate': vehicle.license_plate,
-            'balance': vehicle.account_balance,
-            'status': vehicle.account_status
+            'license_plate': vehicle_info['license_plate'],
+            'balance': vehicle_info['account_balance'],
+            'status': vehicle_info['account_status']
         }, None
     
+    @staticmethod
+    def _change_balance(vehicle_id, delta):
+        """Cộng delta vào số dư bằng một câu UPDATE có điều kiện, trả về số dư mới
+        
+        Khi trừ tiền, điều kiện (tài khoản active, số dư >= số tiền) nằm trong
+        chính câu UPDATE nên hai làn thu phí đồng thời không thể cùng trừ quá số
+        dư. Trả về None nếu không có dòng nào thoả điều kiện. Chưa commit.
+        """
+        conditions = [Vehicle.id == vehicle_id]
+        if delta < 0:
+            conditions += [Vehicle.account_status == 'active', Vehicle.account_balance >= -delta]
+        
+        statement = update(Vehicle).where(*conditions).values(
+            account_balance=Vehicle.account_balance + delta,
+            updated_at=vietnam_now()
+        ).execution_options(synchronize_session=False)
+        
+        if db.engine.dialect.update_returning:
+            row = db.session.execute(statement.returning(Vehicle.account_balance)).first()
+            return row[0] if row else None
+        
+        if db.session.execute(statement).rowcount != 1:
+            return None
+        # Dòng đã bị khoá bởi UPDATE trong transaction này nên đọc lại là nhất quán
+        return db.session.query(Vehicle.account_balance).filter(Vehicle.id == vehicle_id).scalar()
+    
     @staticmethod
     def topup_account(license_plate, amount, description="Nạp tiền"):
         """Nạp tiền vào tài khoản"""
+        vehicle_info = VehicleService.get_vehicle_info(license_plate)
+        if not vehicle_info:
+            return None, "Không tìm thấy xe"
+        
         try:
-            vehicle = VehicleService.get_vehicle_by_plate(license_plate)
-            if not vehicle:
+            amount = to_dong(amount)
+        except ValueError as e:
+            return None, str(e)
+        
+        if amount <= 0:
+            return None, "Số tiền nạp phải lớn hơn 0"
+        
+        try:
+            # Cập nhật số dư và ghi giao dịch trong cùng một DB transaction
+            balance_after = AccountService._change_balance(vehicle_info['id'], amount)
+            if balance_after is None:
+                db.session.rollback()
                 return None, "Không tìm thấy xe"
             
-            if amount <= 0:
-                return None, "Số tiền nạp phải lớn hơn 0"
-            
-            # Tạo transaction
             transaction = Transaction(
-                vehicle_id=vehicle.id,
+                vehicle_id=vehicle_info['id'],
                 transaction_type='topup',
                 amount=amount,
-                balance_before=vehicle.account_balance,
-                balance_after=vehicle.account_balance + amount,
+                balance_before=balance_after - amount,
+                balance_after=balance_after,
                 description=description
             )
             
-            # Cập nhật số dư
-            vehicle.account_balance += amount
-            vehicle.updated_at = vietnam_now()
-            
             db.session.add(transaction)
+            VehicleService._apply_transaction_statistics(transaction)
             db.session.commit()
+            vehicle_cache.invalidate(vehicle_info['license_plate'])
             
             return {
-                'license_plate': vehicle.license_plate,
+                'license_plate': vehicle_info['license_plate'],
                 'balance_before': transaction.balance_before,
                 'balance_after': transaction.balance_after,
                 'amount': amount,
@@ -207,37 +483,51 @@ class AccountService:
     @staticmethod
     def deduct_toll(license_plate, amount, toll_station, description="Thu phí BOT"):
         """Trừ tiền phí BOT"""
+        vehicle_info = VehicleService.get_vehicle_info(license_plate)
+        if not vehicle_info:
+            return None, "Không tìm thấy xe"
+        
         try:
-            vehicle = VehicleService.get_vehicle_by_plate(license_plate)
-            if not vehicle:
-                return None, "Không tìm thấy xe"
-            
-            if vehicle.account_status != 'active':
-                return None, "Tài khoản không hoạt động"
-            
-            if vehicle.account_balance < amount:
+            amount = to_dong(amount)
+        except ValueError as e:
+            return None, str(e)
+        
+        if amount <= 0:
+            return None, "Số tiền thu phí phải lớn hơn 0"
+        
+        try:
+            # Kiểm tra số dư và trừ tiền trong một câu UPDATE có điều kiện
+            balance_after = AccountService._change_balance(vehicle_info['id'], -amount)
+            if balance_after is None:
+                db.session.rollback()
+                # Thông tin trong cache có thể đã cũ, đọc lại để báo đúng lý do
+                vehicle_cache.invalidate(vehicle_info['license_plate'])
+                account_status = db.session.query(Vehicle.account_status).filter(
+                    Vehicle.id == vehicle_info['id']
+                ).scalar()
+                if account_status is None:
+                    return None, "Không tìm thấy xe"
+                if account_status != 'active':
+                    return None, "Tài khoản không hoạt động"
                 return None, "Số dư không đủ"
             
-            # Tạo transaction
             transaction = Transaction(
-                vehicle_id=vehicle.id,
+                vehicle_id=vehicle_info['id'],
                 transaction_type='toll',
                 amount=-amount,
-                balance_before=vehicle.account_balance,
-                balance_after=vehicle.account_balance - amount,
+                balance_before=balance_after + amount,
+                balance_after=balance_after,
                 toll_station=toll_station,
                 description=description
             )
             
-            # Cập nhật số dư
-            vehicle.account_balance -= amount
-            vehicle.updated_at = vietnam_now()
-            
             db.session.add(transaction)
+            VehicleService._apply_transaction_statistics(transaction)
             db.session.commit()
+            vehicle_cache.invalidate(vehicle_info['license_plate'])
             
             return {
-                'license_plate': vehicle.license_plate,
+                'license_plate': vehicle_info['license_plate'],
                 'balance_before': transaction.balance_before,
                 'balance_after': transaction.balance_after,
                 'toll_amount': amount,
@@ -249,46 +539,225 @@ class AccountService:
             db.session.rollback()
             return None, str(e)
     
+    @staticmethod
+    def deduct_tolls_batch(events, max_attempts=3):
+        """Thu phí nhiều sự kiện (hàng đợi của làn xe) trong một DB transaction
+        
+        Tất cả biển số được tra bằng một câu IN, các sự kiện được áp dụng theo thứ
+        tự trên số dư đã đọc, mỗi xe được cập nhật số dư một lần (compare-and-set
+        với số dư đã đọc) và các giao dịch được insert theo lô. Nếu số dư bị thay
+        đổi đồng thời, hoặc SQLite báo "database is locked" (FOR UPDATE không có tác
+        dụng trên SQLite, ở WAL lỗi BUSY_SNAPSHOT trả về ngay không chờ busy_timeout)
+        thì thử lại cả lô, tối đa max_attempts lần.
+        
+        Trả về (danh sách kết quả theo thứ tự sự kiện, lỗi).
+        """
+        for attempt in range(max_attempts):
+            try:
+                results, conflict = AccountService._settle_tolls(events)
+                if conflict:
+                    db.session.rollback()
+                    continue
+                
+                # Lấy ID trước commit (đã flush): sau commit đọc thuộc tính sẽ phải SELECT lại từng giao dịch
+                for result in results:
+                    transaction = result.pop('_transaction', None)
+                    if transaction is not None:
+                        result['transaction_id'] = transaction.id
+                
+                db.session.commit()
+                for plate in {result['license_plate'] for result in results if result['success']}:
+                    vehicle_cache.invalidate(plate)
+                return results, None
+                
+            except Exception as e:
+                db.session.rollback()
+                if is_lock_error(e) and attempt + 1 < max_attempts:
+                    time.sleep(0.01 * (attempt + 1))
+                    continue
+                return None, str(e)
+        
+        return None, "Số dư bị thay đổi đồng thời, vui lòng thử lại"
+    
+    @staticmethod
+    def _settle_tolls(events):
+        """Áp dụng các sự kiện thu phí (chưa commit), trả về (kết quả, có xung đột số dư không)"""
+        results = []
+        pending = []
+        for index, event in enumerate(events):
+            result = {'index': index, 'success': False}
+            results.append(result)
+            
+            if not isinstance(event, dict):
+                result.update(license_plate=None, error="Sự kiện không hợp lệ")
+                continue
+            if not isinstance(event.get('license_plate'), str) or not event['license_plate'] or not event.get('toll_station'):
+                result.update(license_plate=event.get('license_plate'), error="Thiếu biển số hoặc trạm thu phí")
+                continue
+            
+            result['license_plate'] = vehicle_cache.normalize_key(event['license_plate'])
+            try:
+                amount = to_dong(event.get('amount'))
+            except ValueError as e:
+                result['error'] = str(e)
+                continue
+            if amount <= 0:
+                result['error'] = "Số tiền thu phí phải lớn hơn 0"
+                continue
+            
+            pending.append((result, amount, event))
+        
+        # Tra tất cả biển số bằng một câu IN, khoá dòng nếu DB hỗ trợ FOR UPDATE (SQLite bỏ qua,
+        # khi đó compare-and-set bên dưới phát hiện số dư đã đổi)
+        plates = {result['license_plate'] for result, _, _ in pending}
+        accounts = {}
+        if plates:
+            rows = db.session.query(
+                Vehicle.id, Vehicle.license_plate, Vehicle.account_balance, Vehicle.account_status
+            ).filter(Vehicle.license_plate.in_(plates)).with_for_update().all()
+            accounts = {
+                row.license_plate: {'id': row.id, 'status': row.account_status,
+                                    'read_balance': row.account_balance, 'balance': row.account_balance}
+                for row in rows
+            }
+        
+        transactions = []
+        for result, amount, event in pending:
+            account = accounts.get(result['license_plate'])
+            if account is None:
+                result['error'] = "Không tìm thấy xe"
+                continue
+            if account['status'] != 'active':
+                result['error'] = "Tài khoản không hoạt động"
+                continue
+            if account['balance'] < amount:
+                result['error'] = "Số dư không đủ"
+                continue
+            
+            transaction = Transaction(
+                vehicle_id=account['id'],
+                transaction_type='toll',
+                amount=-amount,
+                balance_before=account['balance'],
+                balance_after=account['balance'] - amount,
+                toll_station=event['toll_station'],
+                description=event.get('description') or "Thu phí BOT"
+            )
+            account['balance'] -= amount
+            transactions.append(transaction)
+            
+            result.update(
+                success=True,
+                balance_before=transaction.balance_before,
+                balance_after=transaction.balance_after,
+                toll_amount=amount,
+                toll_station=transaction.toll_station,
+                _transaction=transaction
+            )
+        
+        if not transactions:
+            return results, False
+        
+        # Cập nhật số dư mỗi xe một lần, chỉ khi số dư vẫn bằng giá trị đã đọc và tài khoản vẫn hoạt động
+        table = Vehicle.__table__
+        statement = table.update().where(
+            table.c.id == bindparam('account_id'),
+            table.c.account_balance == bindparam('read_balance'),
+            table.c.account_status == 'active'
+        ).values(account_balance=bindparam('new_balance'), updated_at=vietnam_now())
+        params = [
+            {'account_id': account['id'], 'read_balance': account['read_balance'], 'new_balance': account['balance']}
+            for account in accounts.values() if account['balance'] != account['read_balance']
+        ]
+        
+        if db.engine.dialect.supports_sane_multi_rowcount:
+            if db.session.execute(statement, params).rowcount != len(params):
+                return results, True
+        else:
+            for param in params:
+                if db.session.execute(statement, param).rowcount != 1:
+                    return results, True
+        
+        db.session.add_all(transactions)
+        VehicleService._apply_transaction_statistics(*transactions)
+        return results, False
+    
     @staticmethod
     def get_transaction_history(license_plate, days=30, page=1, per_page=20):
         """Lấy lịch sử giao dịch"""
-        vehicle = VehicleService.get_vehicle_by_plate(license_plate)
-        if not vehicle:
+        vehicle_info = VehicleService.get_vehicle_info(license_plate)
+        if not vehicle_info:
             return None, "Không tìm thấy xe"
         
-        since_date = vietnam_now() - timedelta(days=days)
-        
-        transactions = Transaction.query.filter(
-            Transaction.vehicle_id == vehicle.id,
-            Transaction.created_at >= since_date
-        ).order_by(Transaction.created_at.desc()).paginate(
+        transactions = AccountService._transaction_history_query(vehicle_info['id'], days).order_by(
+            Transaction.created_at.desc()
+        ).paginate(
             page=page, per_page=per_page, error_out=False
         )
         
         return transactions, None
+    
+    @staticmethod
+    def get_transaction_history_by_cursor(license_plate, days=30, cursor=None, per_page=20, include_total=False):
+        """Lấy lịch sử giao dịch phân trang keyset theo (created_at, id), ValueError nếu cursor không hợp lệ"""
+        vehicle_info = VehicleService.get_vehicle_info(license_plate)
+        if not vehicle_info:
+            return None, "Không tìm thấy xe"
+        
+        return keyset_paginate(
+            AccountService._transaction_history_query(vehicle_info['id'], days),
+            [Transaction.created_at, Transaction.id], cursor, per_page, include_total
+        ), None
+    
+    @staticmethod
+    def get_archived_transactions(license_plate, start=None, end=None, limit=100):
+        """Lấy giao dịch đã lưu trữ trong khoảng [start, end) (kiểm toán)"""
+        vehicle_info = VehicleService.get_vehicle_info(license_plate)
+        if not vehicle_info:
+            return None, "Không tìm thấy xe"
+        
+        return query_archive('transactions', start, end, vehicle_info['id'], limit), None
+    
+    @staticmethod
+    def _transaction_history_query(vehicle_id, days):
+        since_date = vietnam_now() - timedelta(days=days)
+        return Transaction.query.filter(
+            Transaction.vehicle_id == vehicle_id,
+            Transaction.created_at >= since_date
+        )
 
 
+@instrument_service
 class ScanService:
     """Service xử lý quét ảnh"""
     
+    @staticmethod
+    def _build_scan_record(scan_data):
+        """Tạo bản ghi ScanHistory (chưa commit) từ dữ liệu quét"""
+        # Tìm xe nếu có biển số
+        vehicle_info = None
+        if scan_data.get('license_plate'):
+            vehicle_info = VehicleService.get_vehicle_info(scan_data['license_plate'])
+        
+        scan_record = ScanHistory(
+            vehicle_id=vehicle_info['id'] if vehicle_info else None,
+            scan_type=scan_data['scan_type'],
+            scanned_data=scan_data['scanned_data'],
+            confidence=scan_data.get('confidence'),
+            image_path=scan_data.get('image_path'),
+            station_location=scan_data.get('station_location'),
+            scan_result='success' if vehicle_info else 'unknown'
+        )
+        # Ghi trễ (write-behind) giữ thời điểm quét thay vì thời điểm commit
+        if scan_data.get('created_at'):
+            scan_record.created_at = scan_data['created_at']
+        return scan_record
+    
     @staticmethod
     def record_scan(scan_data):
         """Ghi lại lịch sử quét"""
         try:
-            # Tìm xe nếu có biển số
-            vehicle = None
-            if scan_data.get('license_plate'):
-                vehicle = VehicleService.get_vehicle_by_plate(scan_data['license_plate'])
-            
-            scan_record = ScanHistory(
-                vehicle_id=vehicle.id if vehicle else None,
-                scan_type=scan_data['scan_type'],
-                scanned_data=scan_data['scanned_data'],
-                confidence=scan_data.get('confidence'),
-                image_path=scan_data.get('image_path'),
-                station_location=scan_data.get('station_location'),
-                scan_result='success' if vehicle else 'unknown'
-            )
+            scan_record = ScanService._build_scan_record(scan_data)
             
             db.session.add(scan_record)
             db.session.commit()
@@ -299,19 +768,94 @@ class ScanService:
             db.session.rollback()
             return None, str(e)
     
+    @staticmethod
+    def record_scans(scan_data_list):
+        """Ghi lại nhiều lịch sử quét trong một lần commit"""
+        try:
+            scan_records = [ScanService._build_scan_record(scan_data) for scan_data in scan_data_list]
+            
+            db.session.add_all(scan_records)
+            db.session.commit()
+            
+            return scan_records, None
+            
+        except Exception as e:
+            db.session.rollback()
+            return None, str(e)
+    
     @staticmethod
     def get_scan_history(license_plate=None, days=7, page=1, per_page=20):
         """Lấy lịch sử quét"""
+        return ScanService._scan_history_query(license_plate, days).order_by(
+            ScanHistory.created_at.desc()
+        ).paginate(
+            page=page, per_page=per_page, error_out=False
+        )
+    
+    @staticmethod
+    def get_scan_history_by_cursor(license_plate=None, days=7, cursor=None, per_page=20, include_total=False):
+        """Lấy lịch sử quét phân trang keyset theo (created_at, id), ValueError nếu cursor không hợp lệ"""
+        return keyset_paginate(
+            ScanService._scan_history_query(license_plate, days),
+            [ScanHistory.created_at, ScanHistory.id], cursor, per_page, include_total
+        )
+    
+    @staticmethod
+    def get_archived_scans(license_plate=None, start=None, end=None, limit=100):
+        """Lấy lịch sử quét đã lưu trữ trong khoảng [start, end) (kiểm toán)"""
+        vehicle_id = None
+        if license_plate:
+            vehicle_info = VehicleService.get_vehicle_info(license_plate)
+            if not vehicle_info:
+                return []
+            vehicle_id = vehicle_info['id']
+        
+        return query_archive('scan_history', start, end, vehicle_id, limit)
+    
+    @staticmethod
+    def _scan_history_query(license_plate, days):
         query = ScanHistory.query
         
         if license_plate:
-            vehicle = VehicleService.get_vehicle_by_plate(license_plate)
-            if vehicle:
-                query = query.filter(ScanHistory.vehicle_id == vehicle.id)
+            vehicle_info = VehicleService.get_vehicle_info(license_plate)
+            if vehicle_info:
+                query = query.filter(ScanHistory.vehicle_id == vehicle_info['id'])
         
         since_date = vietnam_now() - timedelta(days=days)
-        query = query.filter(ScanHistory.created_at >= since_date)
+        return query.filter(ScanHistory.created_at >= since_date)
+
+
+@instrument_service
+class SystemService:
+    """Service kiểm tra trạng thái và số liệu tổng của hệ thống"""
+    
+    @staticmethod
+    def ping_database():
+        """Kiểm tra kết nối DB bằng SELECT 1 (không phụ thuộc kích thước bảng)"""
+        db.session.execute(text('SELECT 1'))
+    
+    @staticmethod
+    def get_system_stats():
+        """Số liệu tổng từ cache, trả về (số liệu, thời điểm tính)"""
+        return system_stats.get(SystemService._compute_system_stats)
+    
+    @staticmethod
+    def _compute_system_stats():
+        total_vehicles, active_vehicles = db.session.query(
+            db.func.count(Vehicle.id),
+            db.func.sum(db.case((Vehicle.account_status == 'active', 1), else_=0))
+        ).one()
+        # Tổng giao dịch lấy từ bảng thống kê xe (cập nhật cộng dồn, gồm cả giao dịch đã lưu trữ)
+        total_transactions, total_spent, total_topup = db.session.query(
+            db.func.sum(VehicleStatistics.total_transactions),
+            db.func.sum(VehicleStatistics.total_spent),
+            db.func.sum(VehicleStatistics.total_topup)
+        ).one()
         
-        return query.order_by(ScanHistory.created_at.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        return {
+            'total_vehicles': total_vehicles,
+            'active_vehicles': int(active_vehicles or 0),
+            'total_transactions': int(total_transactions or 0),
+            'total_spent': int(total_spent or 0),
+            'total_topup': int(total_topup or 0)
+        }
@@ -0,0 +1,92 @@
+"""
+Storage profile cho database: engine options (connection pool) và PRAGMA SQLite áp dụng khi mở kết nối
+    
+    STORAGE_PROFILE = 'sqlite_wal'  -> WAL, synchronous=NORMAL, busy_timeout, cache_size, mmap_size
+    STORAGE_PROFILE = 'default'     -> giữ mặc định của SQLite (rollback journal)
+
+Với URL database server (PostgreSQL, MySQL...) chỉ áp dụng cấu hình pool.
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+
+
+def _is_memory_sqlite(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def build_engine_options(database_url, config):
+    """SQLALCHEMY_ENGINE_OPTIONS theo loại database và cấu hình pool"""
+    url = make_url(database_url)
+    options = {}
+    
+    if url.get_backend_name() == 'sqlite':
+        if _is_memory_sqlite(url):
+            # SQLite trong bộ nhớ dùng pool riêng của SQLAlchemy, không cấu hình được kích thước
+            return options
+        options['connect_args'] = {
+            # Thời gian chờ khoá (giây) ở tầng driver, khớp với PRAGMA busy_timeout
+            'timeout': getattr(config, 'SQLITE_BUSY_TIMEOUT_MS', 5000) / 1000.0,
+            'check_same_thread': False
+        }
+    else:
+        options['pool_pre_ping'] = True
+        options['pool_recycle'] = getattr(config, 'DB_POOL_RECYCLE', 1800)
+    
+    options['pool_size'] = getattr(config, 'DB_POOL_SIZE', 10)
+    options['max_overflow'] = getattr(config, 'DB_MAX_OVERFLOW', 20)
+    options['pool_timeout'] = getattr(config, 'DB_POOL_TIMEOUT', 30)
+    return options
+
+
+def sqlite_pragmas(config):
+    """Danh sách PRAGMA của profile, rỗng nếu profile không chỉnh SQLite"""
+    if getattr(config, 'STORAGE_PROFILE', 'sqlite_wal') != 'sqlite_wal':
+        return []
+    
+    return [
+        ('journal_mode', 'WAL'),
+        # WAL + NORMAL: không fsync mỗi commit, chỉ fsync khi checkpoint; không hỏng DB khi mất điện
+        ('synchronous', 'NORMAL'),
+        ('busy_timeout', getattr(config, 'SQLITE_BUSY_TIMEOUT_MS', 5000)),
+        # Giá trị âm = KiB
+        ('cache_size', -getattr(config, 'SQLITE_CACHE_SIZE_KB', 65536)),
+        ('mmap_size', getattr(config, 'SQLITE_MMAP_SIZE', 268435456)),
+        ('temp_store', 'MEMORY')
+    ]
+
+
+def install_sqlite_pragmas(engine, config):
+    """Đăng ký PRAGMA chạy trên mỗi kết nối SQLite mới, trả về danh sách PRAGMA đã đăng ký"""
+    if engine.dialect.name != 'sqlite':
+        return []
+    
+    pragmas = sqlite_pragmas(config)
+    if not pragmas:
+        return []
+    
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas:
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+    
+    return pragmas
+
+
+def is_lock_error(error):
+    """Lỗi SQLite "database is locked" (SQLITE_BUSY, kể cả BUSY_SNAPSHOT của WAL), thử lại được"""
+    return isinstance(error, OperationalError) and 'database is locked' in str(error.orig)
+
+
+def get_storage_info(engine):
+    """Cấu hình thực tế của kết nối (để kiểm tra profile đã được áp dụng)"""
+    info = {'dialect': engine.dialect.name, 'pool': engine.pool.status()}
+    if engine.dialect.name == 'sqlite':
+        with engine.connect() as connection:
+            for name in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size'):
+                info[name] = connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+    return info
@@ -0,0 +1,49 @@
+import threading
+import time
+from datetime import datetime
+
+
+class SystemStatsCache:
+    """Cache số liệu tổng của hệ thống (số xe, số xe hoạt động, tổng giao dịch và tiền thu / nạp)
+
+    Số liệu chỉ được tính lại khi đã cũ hơn refresh_interval giây. Trong lúc
+    một request đang tính lại, các request khác nhận bản cũ thay vì cùng truy
+    vấn DB.
+    """
+
+    def __init__(self, refresh_interval=60):
+        self.refresh_interval = refresh_interval
+        self._snapshot = None
+        self._refreshed_at = None
+        self._refreshed_monotonic = 0.0
+        self._refresh_lock = threading.Lock()
+        self.refreshes = 0
+
+    def configure(self, refresh_interval=None):
+        if refresh_interval is not None:
+            self.refresh_interval = refresh_interval
+
+    def _is_stale(self):
+        return self._snapshot is None or time.monotonic() - self._refreshed_monotonic >= self.refresh_interval
+
+    def get(self, loader):
+        """Trả về (số liệu, thời điểm tính), gọi loader() nếu số liệu đã cũ"""
+        if self._is_stale():
+            # Chỉ một request tính lại; nếu đã có bản cũ thì request khác không chờ
+            if self._refresh_lock.acquire(blocking=self._snapshot is None):
+                try:
+                    if self._is_stale():
+                        self._snapshot = loader()
+                        self._refreshed_at = datetime.now()
+                        self._refreshed_monotonic = time.monotonic()
+                        self.refreshes += 1
+                finally:
+                    self._refresh_lock.release()
+
+        return dict(self._snapshot), self._refreshed_at
+
+    def invalidate(self):
+        self._snapshot = None
+
+
+system_stats = SystemStatsCache()
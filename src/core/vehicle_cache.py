@@ -0,0 +1,201 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+
+class LocalCacheBackend:
+    """Backend trong process: LRU giới hạn số phần tử, mỗi phần tử có TTL"""
+
+    name = 'local'
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> (hết hạn lúc, giá trị)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        """Trả về (có trong cache, giá trị)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+
+            expires_at, value = entry
+            if time.monotonic() > expires_at:
+                del self._entries[key]
+                self.evictions += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, ttl_seconds):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def size(self):
+        return len(self._entries)
+
+
+class RedisCacheBackend:
+    """Backend Redis dùng chung giữa các worker, giá trị lưu dạng JSON"""
+
+    name = 'redis'
+
+    def __init__(self, url, prefix='etc:vehicle:'):
+        if not REDIS_AVAILABLE:
+            raise RuntimeError('Thư viện redis chưa được cài đặt')
+        self.prefix = prefix
+        self.evictions = 0  # Redis tự loại bỏ theo TTL
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self._client.get(self.prefix + key)
+        if raw is None:
+            return False, None
+        return True, json.loads(raw)
+
+    def set(self, key, value, ttl_seconds):
+        self._client.set(self.prefix + key, json.dumps(value), ex=max(1, int(ttl_seconds)))
+
+    def delete(self, key):
+        self._client.delete(self.prefix + key)
+
+    def clear(self):
+        for key in self._client.scan_iter(match=self.prefix + '*'):
+            self._client.delete(key)
+
+    def size(self):
+        return None
+
+
+class VehicleCache:
+    """Cache read-through thông tin xe (dạng dict) theo biển số đã chuẩn hoá
+
+    Biển số chưa đăng ký cũng được cache (giá trị None) để ảnh quét lặp lại của
+    xe lạ không truy vấn DB mỗi lần. Các thao tác ghi (tạo/cập nhật xe, nạp tiền,
+    thu phí) gọi invalidate sau khi commit.
+    """
+
+    def __init__(self, backend=None, ttl_seconds=30, enabled=True):
+        self.backend = backend or LocalCacheBackend()
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    def configure(self, backend=None, ttl_seconds=None, enabled=None):
+        """Đổi backend / cấu hình khi khởi động app"""
+        if backend is not None:
+            self.backend = backend
+        if ttl_seconds is not None:
+            self.ttl_seconds = ttl_seconds
+        if enabled is not None:
+            self.enabled = enabled
+
+    @staticmethod
+    def normalize_key(license_plate):
+        """Biển số chuẩn hoá (bỏ khoảng trắng hai đầu, viết hoa), dùng cho cả khoá cache và truy vấn DB"""
+        return (license_plate or '').strip().upper()
+
+    def get_or_load(self, license_plate, loader):
+        """Lấy thông tin xe từ cache, nếu chưa có thì gọi loader() và lưu lại
+
+        Trả về bản sao dict để caller sửa thoải mái, hoặc None nếu không có xe.
+        """
+        if not self.enabled:
+            return loader()
+
+        key = self.normalize_key(license_plate)
+        try:
+            found, value = self.backend.get(key)
+        except Exception:
+            found, value = False, None
+            with self._lock:
+                self.errors += 1
+
+        with self._lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if not found:
+            value = loader()
+            try:
+                self.backend.set(key, value, self.ttl_seconds)
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+
+        return dict(value) if value is not None else None
+
+    def invalidate(self, license_plate):
+        """Xoá thông tin xe khỏi cache sau khi dữ liệu thay đổi"""
+        if not self.enabled:
+            return
+
+        try:
+            self.backend.delete(self.normalize_key(license_plate))
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            return
+
+        with self._lock:
+            self.invalidations += 1
+
+    def clear(self):
+        self.backend.clear()
+
+    def get_stats(self):
+        """Thống kê hit/miss của cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'backend': self.backend.name,
+                'size': self.backend.size(),
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'evictions': self.backend.evictions,
+                'errors': self.errors,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+def create_cache_backend(name, max_size=4096, redis_url=None):
+    """Tạo backend theo cấu hình VEHICLE_CACHE_BACKEND ('local' hoặc 'redis')"""
+    if name == 'redis':
+        return RedisCacheBackend(redis_url or 'redis://localhost:6379/0')
+    return LocalCacheBackend(max_size=max_size)
+
+
+# Cache dùng chung trong process, cấu hình khi khởi động app
+vehicle_cache = VehicleCache()
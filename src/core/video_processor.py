@@ -0,0 +1,169 @@
+import time
+from collections import defaultdict
+
+try:
+    import cv2
+    import numpy as np
+    CV2_AVAILABLE = True
+except ImportError:
+    CV2_AVAILABLE = False
+
+from .image_processor import LicensePlateProcessor
+
+
+class VideoPlateScanner:
+    """Nhận diện biển số từ video của một lượt xe qua trạm
+    
+    Chỉ OCR các frame có chuyển động (so sánh frame rẻ trên ảnh thu nhỏ), sau đó
+    gộp kết quả của nhiều frame thành một biển số bằng bỏ phiếu theo từng vị trí
+    ký tự, có trọng số là độ tin cậy OCR.
+    """
+    
+    def __init__(self, license_processor, config=None):
+        self.license_processor = license_processor
+        self.config = config or {}
+        
+        self.frame_step = self.config.get('VIDEO_FRAME_STEP', 2)
+        self.motion_threshold = self.config.get('VIDEO_MOTION_THRESHOLD', 0.01)
+        self.pixel_threshold = self.config.get('VIDEO_PIXEL_THRESHOLD', 25)
+        self.max_ocr_frames = self.config.get('VIDEO_MAX_OCR_FRAMES', 30)
+        self.motion_width = self.config.get('VIDEO_MOTION_WIDTH', 160)
+    
+    def scan_video(self, video_path):
+        """Đọc video, OCR các frame có chuyển động và bỏ phiếu ra biển số cuối cùng"""
+        if not CV2_AVAILABLE:
+            return {
+                'success': False,
+                'error': 'OpenCV không khả dụng - không thể xử lý video',
+                'license_plates': []
+            }
+        
+        capture = cv2.VideoCapture(video_path)
+        if not capture.isOpened():
+            return {
+                'success': False,
+                'error': f'Không thể mở video: {video_path}',
+                'license_plates': []
+            }
+        
+        start = time.perf_counter()
+        frames_read = 0
+        frames_static = 0
+        frames_ocr = 0
+        readings = []
+        previous_small = None
+        
+        try:
+            while frames_ocr < self.max_ocr_frames:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                
+                frames_read += 1
+                if (frames_read - 1) % self.frame_step:
+                    continue
+                
+                small = self._motion_image(frame)
+                has_motion = previous_small is None or self._motion_ratio(previous_small, small) >= self.motion_threshold
+                if not has_motion:
+                    frames_static += 1
+                    continue
+                
+                # Chỉ cập nhật frame tham chiếu khi có chuyển động, tránh trôi dần qua nhiều frame tĩnh
+                previous_small = small
+                frames_ocr += 1
+                
+                result = self.license_processor.detect_license_plate(frame)
+                if not result.get('success'):
+                    continue
+                
+                for plate in result.get('license_plates', []):
+                    readings.append({
+                        'text': plate['text'],
+                        'confidence': float(plate['confidence']),
+                        'frame': frames_read - 1
+                    })
+        finally:
+            capture.release()
+        
+        vote = self._vote_plate(readings)
+        
+        license_plates = []
+        if vote:
+            license_plates.append({
+                'text': vote['text'],
+                'confidence': vote['confidence'],
+                'score': vote['agreement'],
+                'source': 'video_vote',
+                'formatted': vote['text'],
+                'original_text': ''
+            })
+        
+        return {
+            'success': True,
+            'license_plates': license_plates,
+            'vote': vote,
+            'statistics': {
+                'frames_read': frames_read,
+                'frames_ocr': frames_ocr,
+                'frames_static_skipped': frames_static,
+                'readings': len(readings),
+                'processing_ms': round((time.perf_counter() - start) * 1000, 2)
+            },
+            'method': 'video_vote'
+        }
+    
+    def _motion_image(self, frame):
+        """Ảnh xám thu nhỏ, làm mờ để so sánh chuyển động"""
+        height, width = frame.shape[:2]
+        scale = self.motion_width / float(width)
+        small = cv2.resize(frame, (self.motion_width, max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+    
+    def _motion_ratio(self, previous, current):
+        """Tỉ lệ pixel thay đổi giữa hai frame"""
+        diff = cv2.absdiff(previous, current)
+        return float(np.count_nonzero(diff > self.pixel_threshold)) / diff.size
+    
+    def _vote_plate(self, readings):
+        """Bỏ phiếu theo từng vị trí ký tự, trọng số là độ tin cậy
+        
+        Các lần đọc được nhóm theo độ dài (bỏ dấu gạch ngang); nhóm có tổng độ tin
+        cậy lớn nhất được dùng để bỏ phiếu.
+        """
+        if not readings:
+            return None
+        
+        groups = defaultdict(list)
+        for reading in readings:
+            compact = reading['text'].replace('-', '').replace('.', '')
+            groups[len(compact)].append((compact, reading['confidence']))
+        
+        best_group = max(groups.values(), key=lambda group: sum(conf for _, conf in group))
+        
+        characters = []
+        agreements = []
+        for position in range(len(best_group[0][0])):
+            weights = defaultdict(float)
+            for compact, confidence in best_group:
+                weights[compact[position]] += confidence
+            winner, weight = max(weights.items(), key=lambda item: item[1])
+            characters.append(winner)
+            agreements.append(weight / sum(weights.values()))
+        
+        voted = ''.join(characters)
+        if not LicensePlateProcessor._is_vietnamese_license_plate(voted):
+            # Ghép theo vị trí ra chuỗi không hợp lệ -> dùng lần đọc tốt nhất
+            voted = max(best_group, key=lambda item: item[1])[0]
+        
+        agreement = sum(agreements) / len(agreements)
+        mean_confidence = sum(conf for _, conf in best_group) / len(best_group)
+        
+        return {
+            'text': LicensePlateProcessor._format_license_plate(voted),
+            'confidence': round(mean_confidence * agreement, 4),
+            'agreement': round(agreement, 4),
+            'votes': len(best_group),
+            'total_readings': len(readings)
+        }
@@ -1,8 +1,11 @@
 """
 Utilities cho ETC Backend
 """
+import atexit
 import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 import pytz
@@ -36,3 +39,54 @@ def setup_logging(log_folder, log_level='INFO'):
 
 def allowed_file(filename, allowed_extensions):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
+
+
+class EvidenceStore:
+    """Lưu ảnh bằng chứng xuống đĩa ở luồng nền, ngoài đường xử lý request
+    
+    Số ảnh chờ ghi (đang giữ bytes trong bộ nhớ) tối đa max_pending; khi đầy thì
+    ghi đồng bộ trong request thay vì xếp hàng thêm hoặc bỏ ảnh.
+    """
+    
+    def __init__(self, folder, enabled=True, max_workers=1, max_pending=64):
+        self.folder = folder
+        self.enabled = enabled
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='evidence-writer') if enabled else None
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._logger = logging.getLogger(__name__)
+        self.overflow_writes = 0
+        
+        if self._executor:
+            atexit.register(self.shutdown)
+    
+    def save(self, filename, data):
+        """Lên lịch ghi file, trả về đường dẫn sẽ được ghi (None nếu tắt lưu ảnh)"""
+        if not self.enabled:
+            return None
+        
+        filepath = os.path.join(self.folder, filename)
+        if self._pending.acquire(blocking=False):
+            try:
+                future = self._executor.submit(self._write, filepath, data)
+                future.add_done_callback(lambda _: self._pending.release())
+                return filepath
+            except RuntimeError:
+                # Executor đã dừng (app đang tắt)
+                self._pending.release()
+        
+        # Hàng đợi đầy -> ghi đồng bộ, không giữ thêm ảnh trong bộ nhớ
+        self.overflow_writes += 1
+        self._write(filepath, data)
+        return filepath
+    
+    def _write(self, filepath, data):
+        try:
+            with open(filepath, 'wb') as f:
+                f.write(data)
+        except Exception as e:
+            self._logger.error(f"Không thể lưu ảnh {filepath}: {e}")
+    
+    def shutdown(self, wait=True):
+        """Chờ các file đang ghi dở hoàn tất"""
+        if self._executor:
+            self._executor.shutdown(wait=wait)
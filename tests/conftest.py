@@ -0,0 +1,33 @@
+"""
+Fixture dùng chung: app Flask tối giản với database SQLite tạm (cùng storage profile với production)
+"""
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask
+
+from src.core.models import db
+from src.core.storage import build_engine_options, install_sqlite_pragmas
+from src.core.vehicle_cache import LocalCacheBackend, vehicle_cache
+
+
+@pytest.fixture
+def app(tmp_path):
+    config = SimpleNamespace(STORAGE_PROFILE='sqlite_wal')
+    database_url = f"sqlite:///{tmp_path / 'etc_test.db'}"
+    
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = build_engine_options(database_url, config)
+    db.init_app(app)
+    
+    # Cache thông tin xe là singleton của process -> làm mới cho mỗi test
+    vehicle_cache.configure(backend=LocalCacheBackend(), ttl_seconds=30, enabled=True)
+    
+    with app.app_context():
+        install_sqlite_pragmas(db.engine, config)
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
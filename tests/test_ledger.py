@@ -0,0 +1,71 @@
+import threading
+
+from src.core.migrations import check_ledger
+from src.core.models import db, Transaction, Vehicle, VehicleStatistics
+from src.core.services import AccountService, VehicleService
+
+THREADS = 8
+CHARGES = 25
+AMOUNT = 1000
+
+
+def test_concurrent_tolls_keep_ledger_consistent(app):
+    # Số dư chỉ đủ cho một nửa số lần thu phí
+    initial_balance = THREADS * CHARGES * AMOUNT // 2
+    vehicle, error = VehicleService.create_vehicle({
+        'license_plate': '30G-99999',
+        'owner_name': 'Stress Test',
+        'account_balance': initial_balance
+    })
+    assert error is None
+    
+    outcomes = {}
+    outcomes_lock = threading.Lock()
+    start_barrier = threading.Barrier(THREADS)
+    
+    def worker():
+        with app.app_context():
+            start_barrier.wait()
+            for _ in range(CHARGES):
+                _, error = AccountService.deduct_toll('30G-99999', AMOUNT, 'Stress')
+                with outcomes_lock:
+                    outcomes[error or 'ok'] = outcomes.get(error or 'ok', 0) + 1
+            db.session.remove()
+    
+    threads = [threading.Thread(target=worker) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    charged = outcomes.get('ok', 0)
+    assert sum(outcomes.values()) == THREADS * CHARGES
+    assert charged == initial_balance // AMOUNT
+    
+    db.session.expire_all()
+    vehicle = Vehicle.query.filter_by(license_plate='30G-99999').one()
+    assert vehicle.account_balance == initial_balance - charged * AMOUNT
+    assert Transaction.query.filter_by(vehicle_id=vehicle.id, transaction_type='toll').count() == charged
+    
+    statistics = db.session.get(VehicleStatistics, vehicle.id)
+    assert statistics.total_transactions == charged
+    assert statistics.total_spent == charged * AMOUNT
+    
+    assert not any(check_ledger().values())
+
+
+def test_batch_tolls_skip_inactive_accounts(app):
+    VehicleService.create_vehicle({'license_plate': '30G-11111', 'owner_name': 'A', 'account_balance': 50000})
+    VehicleService.create_vehicle({'license_plate': '30G-22222', 'owner_name': 'B', 'account_balance': 50000})
+    Vehicle.query.filter_by(license_plate='30G-22222').update({'account_status': 'suspended'})
+    db.session.commit()
+    
+    results, error = AccountService.deduct_tolls_batch([
+        {'license_plate': '30G-11111', 'amount': 10000, 'toll_station': 'Trạm 1'},
+        {'license_plate': '30G-22222', 'amount': 10000, 'toll_station': 'Trạm 1'}
+    ])
+    
+    assert error is None
+    assert [result['success'] for result in results] == [True, False]
+    assert Vehicle.query.filter_by(license_plate='30G-22222').one().account_balance == 50000
+    assert not any(check_ledger().values())
@@ -0,0 +1,61 @@
+import pytest
+from sqlalchemy import Integer, inspect
+
+from src.core.migrations import check_ledger, migrate_money_columns, pending_money_columns
+from src.core.models import db
+
+# Schema cũ: cột tiền kiểu FLOAT
+LEGACY_SCHEMA = [
+    'CREATE TABLE vehicles (id INTEGER PRIMARY KEY, license_plate VARCHAR(20) NOT NULL UNIQUE, '
+    'owner_name VARCHAR(100) NOT NULL, owner_phone VARCHAR(20), vehicle_type VARCHAR(50), brand VARCHAR(50), '
+    'model VARCHAR(50), color VARCHAR(30), year INTEGER, account_balance FLOAT, account_status VARCHAR(20), '
+    'created_at DATETIME, updated_at DATETIME)',
+    'CREATE TABLE transactions (id INTEGER PRIMARY KEY, vehicle_id INTEGER NOT NULL REFERENCES vehicles(id), '
+    'transaction_type VARCHAR(20) NOT NULL, amount FLOAT NOT NULL, balance_before FLOAT NOT NULL, '
+    'balance_after FLOAT NOT NULL, toll_station VARCHAR(100), description TEXT, status VARCHAR(20), '
+    'created_at DATETIME)'
+]
+
+
+def _legacy_database(toll_amount, balance):
+    db.drop_all()
+    with db.engine.begin() as connection:
+        for statement in LEGACY_SCHEMA:
+            connection.exec_driver_sql(statement)
+        connection.exec_driver_sql(
+            "INSERT INTO vehicles (id, license_plate, owner_name, account_balance, account_status) "
+            f"VALUES (1, '30G-12345', 'A', {balance}, 'active')"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO transactions VALUES (1, 1, 'topup', 100000.0, 0.0, 100000.0, NULL, NULL, 'completed', "
+            "'2024-01-01 00:00:00')"
+        )
+        connection.exec_driver_sql(
+            f"INSERT INTO transactions VALUES (2, 1, 'toll', {toll_amount}, 100000.0, {balance}, 'X', NULL, "
+            "'completed', '2024-01-02 00:00:00')"
+        )
+
+
+def test_migrate_money_columns_keeps_ledger_consistent(app):
+    _legacy_database(-15000.4, 84999.6)
+    assert 'transactions.balance_after' in pending_money_columns()
+    
+    converted = migrate_money_columns()
+    
+    assert 'vehicles.account_balance' in converted
+    assert pending_money_columns() == []
+    columns = {column['name']: column['type'] for column in inspect(db.engine).get_columns('transactions')}
+    assert isinstance(columns['amount'], Integer)
+    assert not any(check_ledger().values())
+    # Chạy lại không làm gì
+    assert migrate_money_columns() == []
+
+
+def test_migrate_money_columns_refuses_when_rounding_breaks_arithmetic(app):
+    # ROUND(100000) + ROUND(-15000.5) = 84999 nhưng ROUND(84999.5) = 85000
+    _legacy_database(-15000.5, 84999.5)
+    
+    with pytest.raises(ValueError):
+        migrate_money_columns()
+    
+    assert 'transactions.amount' in pending_money_columns()
@@ -0,0 +1,20 @@
+from src.core.models import db, Vehicle
+from src.core.plate_index import plate_index
+from src.core.services import VehicleService
+
+
+def test_index_picks_up_vehicles_created_by_other_workers(app):
+    plate_index.configure(refresh_interval=60)
+    VehicleService.create_vehicle({'license_plate': '30G-49729', 'owner_name': 'A'})
+    VehicleService.load_plate_index()
+    
+    # Xe tạo ở process khác: có trong DB nhưng không qua plate_index.add của process này
+    db.session.add(Vehicle(license_plate='51F-12345', owner_name='B'))
+    db.session.commit()
+    assert VehicleService.find_similar_plates('51F-I2345') == []
+    
+    # Hết refresh_interval -> lần tra cứu sau dựng lại chỉ mục từ DB
+    plate_index._built_monotonic -= plate_index.refresh_interval
+    matches = VehicleService.find_similar_plates('51F-I2345')
+    assert [match['license_plate'] for match in matches] == ['51F-12345']
+    assert VehicleService.find_similar_plates('30G-49729')[0]['distance'] == 0
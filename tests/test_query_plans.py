@@ -0,0 +1,9 @@
+from src.core.migrations import check_query_plans
+
+
+def test_history_queries_use_indexes(app):
+    report = check_query_plans()
+    
+    assert report
+    for name, result in report.items():
+        assert result['uses_index'], f"{name}: {' | '.join(result['plan'])}"
@@ -0,0 +1,20 @@
+from src.core.services import AccountService, VehicleService
+
+
+def test_plate_with_whitespace_does_not_cache_missing_vehicle(app):
+    VehicleService.create_vehicle({'license_plate': '30G-49729', 'owner_name': 'A', 'account_balance': 50000})
+    
+    assert VehicleService.get_vehicle_info(' 30G-49729 ')['license_plate'] == '30G-49729'
+    assert VehicleService.get_vehicle_info('30G-49729')['license_plate'] == '30G-49729'
+    
+    result, error = AccountService.deduct_toll('30g-49729 ', 10000, 'Trạm 1')
+    assert error is None
+    assert result['balance_after'] == 40000
+
+
+def test_unknown_plate_is_cached_as_missing(app):
+    assert VehicleService.get_vehicle_info('51A-00001') is None
+    
+    # Tạo xe phải xoá kết quả "chưa đăng ký" đã cache
+    VehicleService.create_vehicle({'license_plate': '51a-00001', 'owner_name': 'B'})
+    assert VehicleService.get_vehicle_info('51A-00001')['license_plate'] == '51A-00001'